@@ -0,0 +1,360 @@
+from gcpaiutils import wrappers
+from gcpaiutils.fakeapi import FakeJobsServer
+from gcpaiutils.utils import get_deployment_config, get_storage_client
+from datetime import datetime as dt, timezone
+from itertools import product
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+from random import Random
+from uuid import uuid4
+import numpy as np
+import tracemalloc
+import platform
+import argparse
+import logging
+import json
+import yaml
+import sys
+import os
+
+
+SCHEMA_VERSION = 1
+ATOMS = ["class_lgbm", "class_xgb", "class_skl_logreg", "class_lda"]
+SCORED_STRATEGY = "Top4MostStrata_StratifiedKFold"  # the only strategy scored and aggregated by the wrappers
+EVALUATION_METRIC = "accuracy"
+USER, PROBLEM, VERSION = "bench", "problem", "v1"
+TIME_METRICS = ["wall_time", "cpu_time", "peak_memory"]
+
+
+class FakeTaskInstance:
+    """Airflow task instance stand-in. XComs of every task of a run live in one shared dict, keyed by (task id, key).
+
+       Args:
+           - xcom: dict shared by the tasks of a DAG run
+           - task_id: id of the task
+           - dag_id: id of the DAG
+    """
+
+    def __init__(self, xcom, task_id, dag_id="benchmark"):
+        self.xcom = xcom
+        self.task_id = task_id
+        self.dag_id = dag_id
+
+    def xcom_push(self, key, value):
+        self.xcom[(self.task_id, key)] = value
+
+    def xcom_pull(self, task_ids=None, key=None):
+        if isinstance(task_ids, (list, tuple)):
+            return [self.xcom.get((task_id, key)) for task_id in task_ids]
+        return self.xcom.get((task_ids, key))
+
+
+class BenchmarkSelector:
+    """Selection strategy keeping the top models on the evaluation metric. Reads the shared InfoDataset only, so that
+    the benchmark measures the wrappers rather than a selection library."""
+
+    def __init__(self, deployment_config, model_dir, evaluation_metric, problem_type, n_class, verbose,
+                 info_dataset=None):
+        self.deployment_config = deployment_config
+        self.evaluation_metric = evaluation_metric
+        self.info_dataset = info_dataset
+
+    def select(self, destination_uri, validation_schema=None, top=4):
+        scores = self.info_dataset.columns("info")[self.evaluation_metric].astype(float)
+        selection = []
+        for index in np.argsort(-scores, kind="stable")[:top]:
+            selection += [name for name in self.info_dataset.file_names(self.info_dataset.model_ids[index])
+                          if "stratified_info" not in name]
+        gcs_client = get_storage_client(get_deployment_config(self.deployment_config))
+        bucket_name, _, prefix = destination_uri[len("gs://"):].partition("/")
+        gcs_client.bucket(bucket_name).blob(prefix + "selection.json").upload_from_string(
+            json.dumps({'selection': selection, 'aggregation': 'average'}), content_type='application/json')
+        return selection
+
+
+class DagBenchmark:
+    """Runs the train, selection, metadata_check, score, aggregate and clear_results wrappers, as a DAG run would,
+    against the fake jobs API (fakeapi.py) and a local or in-memory storage backend (backends.py). The benchmark plays
+    the part of the atoms: it writes the artifacts that train and score jobs would produce between stages, outside
+    measured sections.
+
+    Each stage reports wall time, CPU time, peak Python memory (tracemalloc), jobs API requests by method and storage
+    requests by method and bytes transferred.
+
+       Args:
+           - work_dir: scratch directory (storage root, deployment config, wrapper temp dirs)
+           - models: number of trained models, spread over the atoms
+           - features: number of features of the dataset
+           - strategies: number of selection strategies
+           - blobs: number of data objects, and of output objects per score job
+           - atoms: list of atoms, one train task each
+           - storage: 'local' or 'memory'
+           - run_duration: run duration distribution of fake jobs (see FakeJobsServer)
+           - poll_interval: interval (in seconds) between two job status sweeps
+           - blob_size: size (in bytes) of data and model objects
+           - max_pack_size: see score()
+           - selection_workers: see selection()
+           - seed: random seed
+
+        Main usage:
+           - run(): returns dict of params and per-stage metrics
+    """
+
+    def __init__(self, work_dir, models=8, features=20, strategies=2, blobs=4, atoms=None, storage="local",
+                 run_duration=0.2, poll_interval=0.05, blob_size=64 * 1024, max_pack_size=64, selection_workers=1,
+                 seed=0):
+        self.work_dir = work_dir
+        self.params = {'models': models, 'features': features, 'strategies': strategies, 'blobs': blobs,
+                       'atoms': list(atoms or ATOMS), 'storage': storage, 'run_duration': run_duration,
+                       'poll_interval': poll_interval, 'blob_size': blob_size, 'max_pack_size': max_pack_size,
+                       'selection_workers': selection_workers, 'seed': seed}
+        self._random = Random(seed)
+        self.xcom = {}
+        self.run_id = "benchmark_" + uuid4().hex[:8]
+        self.bucket = "benchmark-" + self.run_id[-8:]  # in-memory storage outlives runs
+        self.deployment_config = None
+        self.gcs_client = None
+        self.server = None
+
+    # Setup
+    def _write_deployment_config(self):
+        _globals = {'PROJECT_ID': 'benchmark-project',
+                    'CONTAINERS_ROOT_URL': 'gcr.io',
+                    'MODEL_BUCKET_NAME': self.bucket,
+                    'MODEL_BUCKET_ADDRESS': "gs://{}/".format(self.bucket),
+                    'region': 'us-central1',
+                    'MLAPI_DISCOVERY_URL': self.server.discovery_url,
+                    'STORAGE_BACKEND': self.params['storage'],
+                    'STORAGE_ROOT': os.path.join(self.work_dir, "storage"),
+                    'STAGING_DIR': os.path.join(self.work_dir, "staging"),
+                    'SELECTION_WORKERS': self.params['selection_workers']}
+        self.deployment_config = os.path.join(self.work_dir, "deployment_config.yml")
+        with open(self.deployment_config, 'w') as f:
+            yaml.safe_dump(_globals, f)
+        self.gcs_client = get_storage_client(_globals)
+
+    def _upload(self, name, data):
+        self.gcs_client.bucket(self.bucket).blob(name).upload_from_string(data)
+
+    def _seed_data(self):
+        features = ["feature_{}".format(i) for i in range(self.params['features'])]
+        self._upload(f"{USER}/{PROBLEM}/METADATA/metadata.json",
+                     json.dumps({'size': 0.05, 'missing_data_rate': {feature: 0 for feature in features}}))
+        for i in range(self.params['blobs']):
+            self._upload(f"{USER}/{PROBLEM}/DATA/part-{i:05d}.csv", os.urandom(self.params['blob_size']))
+        params = {'user': USER, 'problem': PROBLEM, 'version': VERSION, 'use_hyperspace': 'False',
+                  'data_uri': f"gs://{self.bucket}/{USER}/{PROBLEM}/DATA/", 'atom_params': None,
+                  'hardware_config': None,
+                  'evaluation_metric': EVALUATION_METRIC, 'output_uri': f"gs://{self.bucket}/{USER}/{PROBLEM}/RESULTS/"}
+        for key, value in params.items():
+            self.xcom[('retrieve_params', key)] = value
+
+    def _seed_models(self):
+        """Writes what train jobs would: one model file, feature importances and info files per model."""
+        jobs = [job for atom in self.params['atoms'] for job in self.xcom.get(('train_' + atom, 'successful_jobs'))]
+        features = ["feature_{}".format(i) for i in range(self.params['features'])]
+        for i in range(self.params['models']):
+            job_dir = jobs[i % len(jobs)].replace("train_", "")
+            metrics = json.dumps({EVALUATION_METRIC: self._random.random(), 'logloss': self._random.random()})
+            featimp = "feature_name,feature_importance\n" + "".join(
+                "{},{}\n".format(feature, self._random.random()) for feature in features)
+            model_prefix = f"{USER}/ACTIVE_MODELS/{PROBLEM}/{job_dir}/"
+            self._upload(model_prefix + f"model_{i:05d}.pkl", os.urandom(self.params['blob_size']))
+            self._upload(model_prefix + f"featimp_{i:05d}.csv", featimp)
+            for prefix in [model_prefix, f"{USER}/{PROBLEM}/{VERSION}/MODELS/{job_dir}/"]:
+                self._upload(prefix + f"info_{i:05d}.json", metrics)
+                self._upload(prefix + f"stratified_info_{i:05d}.json", metrics)
+
+    def _seed_score_outputs(self):
+        """Writes what score jobs would: prediction part files in each model output folder."""
+        selection = self.xcom[('selection', 'selected_info')][SCORED_STRATEGY]
+        for info_file in selection:
+            job_dir, _, model = info_file.partition("_info_")
+            prefix = f"{USER}/{PROBLEM}/RESULTS_STAGING/{SCORED_STRATEGY}/{job_dir}/model_{model.split('.')[0]}/"
+            for i in range(self.params['blobs']):
+                self._upload(prefix + f"part-{i:05d}.csv", "id,prediction\n" + "".join(
+                    "{},{}\n".format(row, self._random.random()) for row in range(100)))
+
+    def _seed_aggregate_outputs(self):
+        self._upload(f"{USER}/{PROBLEM}/RESULTS/{SCORED_STRATEGY}/aggregate.csv", "id,prediction\n0,0.5\n")
+
+    # Stages
+    def _context(self, task_id):
+        return {'task_instance': FakeTaskInstance(self.xcom, task_id), 'run_id': self.run_id}
+
+    def _stages(self):
+        strategies = [SCORED_STRATEGY] + ["Strategy{}".format(i) for i in range(1, self.params['strategies'])]
+        selector_class_dict = {strategy: {'selector': BenchmarkSelector, 'validation_schema': None}
+                               for strategy in strategies}
+        train_task_ids = ['train_' + atom for atom in self.params['atoms']]
+
+        def train():
+            for atom, task_id in zip(self.params['atoms'], train_task_ids):
+                wrappers.train(self.deployment_config, atom=atom, fail_fast=True, **self._context(task_id))
+
+        return [("train", train, self._seed_models),
+                ("selection", lambda: wrappers.selection(self.deployment_config, train_task_ids=train_task_ids,
+                                                         selector_class_dict=selector_class_dict,
+                                                         **self._context('selection')), None),
+                ("metadata_check", lambda: wrappers.metadata_check(self.deployment_config,
+                                                                   **self._context('metadata_check')), None),
+                ("score", lambda: wrappers.score(self.deployment_config, max_pack_size=self.params['max_pack_size'],
+                                                 **self._context('score')), self._seed_score_outputs),
+                ("aggregate", lambda: wrappers.aggregate(self.deployment_config, score_task_id='score',
+                                                         **self._context('aggregate')), self._seed_aggregate_outputs),
+                ("clear_results", lambda: wrappers.clear_results(self.deployment_config,
+                                                                 **self._context('clear_results')), None)]
+
+    def _measure(self, fn):
+        jobs_before, storage_before = dict(self.server.stats), dict(self.gcs_client.stats)
+        tracemalloc.start()
+        start_wall, start_cpu = perf_counter(), process_time()
+        try:
+            fn()
+        finally:
+            wall_time, cpu_time = perf_counter() - start_wall, process_time() - start_cpu
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return {'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_memory': peak_memory,
+                'jobs_api': {key: value - jobs_before.get(key, 0) for key, value in self.server.stats.items()},
+                'storage': {key: value - storage_before.get(key, 0) for key, value in self.gcs_client.stats.items()}}
+
+    def run(self):
+        previous_dir, previous_interval = os.getcwd(), wrappers.TIME_INTERVAL
+        self.server = FakeJobsServer(queue_duration=0, run_duration=self.params['run_duration'],
+                                     seed=self.params['seed']).start()
+        try:
+            os.chdir(self.work_dir)  # wrappers create temp dirs in the working directory
+            wrappers.TIME_INTERVAL = self.params['poll_interval']
+            self._write_deployment_config()
+            self._seed_data()
+            stages = {}
+            for name, fn, after in self._stages():
+                logging.info("Benchmark stage: {}".format(name))
+                stages[name] = self._measure(fn)
+                if after is not None:
+                    after()
+        finally:
+            wrappers.TIME_INTERVAL = previous_interval
+            os.chdir(previous_dir)
+            self.server.stop()
+        return {'params': self.params, 'stages': stages, 'total': _sum_metrics(stages.values())}
+
+
+def _sum_metrics(metrics):
+    total = {}
+    for item in metrics:
+        for key, value in item.items():
+            if isinstance(value, dict):
+                total[key] = _sum_metrics([total.get(key, {}), value])
+            elif key == 'peak_memory':
+                total[key] = max(total.get(key, 0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def run_benchmarks(grid, **kwargs):
+    """
+    Runs the DAG benchmark for every combination of grid values.
+
+    :param grid: dict of DagBenchmark parameter names as keys and list of values as value
+    :param kwargs: fixed DagBenchmark parameters
+    :return: JSON-serializable results (one run per combination)
+    """
+    runs = []
+    for values in product(*grid.values()):
+        params = dict(zip(grid.keys(), values), **kwargs)
+        with TemporaryDirectory() as work_dir:
+            runs.append(DagBenchmark(work_dir, **params).run())
+        logging.warning("Benchmark run {}: {:.2f}s".format(dict(zip(grid.keys(), values)),
+                                                           runs[-1]['total']['wall_time']))
+    return {'schema': SCHEMA_VERSION,
+            'created': dt.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': runs}
+
+
+def compare(baseline, results, tolerance=0.25, count_tolerance=0.1):
+    """
+    Compares two benchmark results run by run (runs are matched on their parameters) and stage by stage.
+
+    :param baseline: results of a previous run_benchmarks() call
+    :param results: results of the current run_benchmarks() call
+    :param tolerance: relative increase of wall time, CPU time or peak memory flagged as regression
+    :param count_tolerance: relative increase of request or byte counts flagged as regression (status requests
+                            depend on timing, hence the default slack)
+    :return: list of (params, stage, metric, baseline value, current value) regressions
+    """
+    baseline_runs = {json.dumps(run['params'], sort_keys=True): run for run in baseline['runs']}
+    regressions = []
+    for run in results['runs']:
+        baseline_run = baseline_runs.get(json.dumps(run['params'], sort_keys=True))
+        if baseline_run is None:
+            continue
+        for stage, metrics in list(run['stages'].items()) + [('total', run['total'])]:
+            baseline_metrics = baseline_run['total'] if stage == 'total' else baseline_run['stages'].get(stage, {})
+            for metric, value, baseline_value in _flatten(metrics, baseline_metrics):
+                limit = tolerance if metric in TIME_METRICS else count_tolerance
+                if value > baseline_value * (1 + limit) and value - baseline_value > 1e-3:
+                    regressions.append((run['params'], stage, metric, baseline_value, value))
+    return regressions
+
+
+def _flatten(metrics, baseline_metrics, prefix=""):
+    for key, value in metrics.items():
+        baseline_value = baseline_metrics.get(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, baseline_value or {}, prefix + key + ".")
+        elif baseline_value is not None:
+            yield prefix + key if prefix else key, value, baseline_value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end DAG benchmark against local storage and jobs API "
+                                                 "stand-ins. Grid parameters accept several values.")
+    parser.add_argument("--models", type=int, nargs='+', default=[8])
+    parser.add_argument("--features", type=int, nargs='+', default=[20])
+    parser.add_argument("--strategies", type=int, nargs='+', default=[2])
+    parser.add_argument("--blobs", type=int, nargs='+', default=[4])
+    parser.add_argument("--atoms", nargs='+', default=ATOMS)
+    parser.add_argument("--storage", choices=['local', 'memory'], default='local')
+    parser.add_argument("--run-duration", type=float, default=0.2, help="fake job duration (seconds)")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--blob-size", type=int, default=64 * 1024)
+    parser.add_argument("--selection-workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file receiving results")
+    parser.add_argument("--baseline", help="JSON results of a previous run. Exits with status 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative tolerance of time and memory")
+    parser.add_argument("--count-tolerance", type=float, default=0.1, help="relative tolerance of counts")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logging.getLogger("OperatorsLogger").setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    results = run_benchmarks({'models': args.models, 'features': args.features, 'strategies': args.strategies,
+                              'blobs': args.blobs},
+                             atoms=args.atoms, storage=args.storage, run_duration=args.run_duration,
+                             poll_interval=args.poll_interval, blob_size=args.blob_size,
+                             selection_workers=args.selection_workers, seed=args.seed)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(json.load(f), results, tolerance=args.tolerance,
+                                  count_tolerance=args.count_tolerance)
+        for params, stage, metric, baseline_value, value in regressions:
+            print("REGRESSION {} {}.{}: {} -> {}".format(params, stage, metric, baseline_value, value), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
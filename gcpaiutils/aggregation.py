@@ -0,0 +1,84 @@
+from gcpaiutils import tracing
+from pandas import read_csv
+from io import BytesIO
+
+
+class RunningAverage:
+    """Incremental average of model predictions. Score outputs are folded in one at a time, as soon as their job
+    completes, so that the aggregate is ready right after the last score job. Rows are aligned on the first CSV
+    column (row id) and averaged over the models that scored them, which also covers sharded scoring outputs.
+
+       Args:
+           - gcs_client: google.cloud.storage client
+
+        Main usage:
+           - fold_uri(uri): folds every CSV file (part files) found under a 'gs://bucket/prefix/' score output dir
+           - fold(df): folds a DataFrame of predictions indexed by row id
+           - n_outputs: number of score outputs folded so far (one per fold_uri() or fold() call)
+           - result(): returns the average as a DataFrame
+           - write(uri): writes the average to a 'gs://bucket/path.csv' object
+    """
+
+    def __init__(self, gcs_client):
+        self.gcs_client = gcs_client
+        self.n_outputs = 0
+        self._sum = None
+        self._count = None
+
+    def _add(self, df):
+        count = df.notna().astype(int)
+        if self._sum is None:
+            self._sum, self._count = df.fillna(0), count
+        else:
+            self._sum = self._sum.add(df, fill_value=0)
+            self._count = self._count.add(count, fill_value=0)
+
+    def fold(self, df):
+        self._add(df)
+        self.n_outputs += 1
+
+    def fold_uri(self, uri):
+        """Folds a score output dir as one output. Raises ValueError if the dir holds no CSV file."""
+        bucket_name, _, prefix = uri[len("gs://"):].partition("/")
+        with tracing.span('gcs.list_blobs', prefix=prefix) as sp:
+            blobs = [blob for blob in self.gcs_client.list_blobs(bucket_or_name=bucket_name, prefix=prefix)
+                     if blob.name.endswith(".csv")]
+            sp.add_requests()
+        if not blobs:
+            raise ValueError("No score output found under {}".format(uri))
+        for blob in blobs:
+            with tracing.span('gcs.download', blob=blob.name) as sp:
+                data = blob.download_as_string(client=self.gcs_client)
+                sp.add_requests()
+                sp.add_bytes(len(data))
+            self._add(read_csv(BytesIO(data), index_col=0))
+        self.n_outputs += 1
+
+    def result(self):
+        if self._sum is None:
+            raise ValueError("No score output folded yet.")
+        return self._sum / self._count
+
+    def write(self, uri):
+        bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+        data = self.result().to_csv()
+        with tracing.span('gcs.upload', blob=blob_name) as sp:
+            self.gcs_client.bucket(bucket_name).blob(blob_name).upload_from_string(data, content_type='text/csv',
+                                                                                  client=self.gcs_client)
+            sp.add_requests()
+            sp.add_bytes(len(data))
+
+
+def get_output_size(gcs_client, uris):
+    """
+    :param gcs_client: google.cloud.storage client
+    :param uris: list of 'gs://bucket/prefix/' URIs
+    :return: total size (in bytes) of objects under uris
+    """
+    size = 0
+    for uri in uris:
+        bucket_name, _, prefix = uri[len("gs://"):].partition("/")
+        with tracing.span('gcs.list_blobs', prefix=prefix) as sp:
+            size += sum(blob.size or 0 for blob in gcs_client.list_blobs(bucket_or_name=bucket_name, prefix=prefix))
+            sp.add_requests()
+    return size
@@ -0,0 +1,206 @@
+from googleapiclient import errors
+from gcpaiutils.handler import JobHandler
+from gcpaiutils.utils import build_mlapi_client, get_jobs_info, JobFailedError, TERMINAL_STATES, FAILURE_STATES, \
+    BATCH_SIZE
+from gcpaiutils import tracing
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+
+
+TIME_INTERVAL = 60*1
+
+
+class AsyncJobHandler:
+    """Asyncio client for GCP AI Platform jobs. Submits jobs and watches them from a single event loop.
+
+    Blocking discovery API calls run on a small thread pool sharing one thread-safe discovery client (requests borrow
+    connections from the process-wide pool of transport.py, bounded by MLAPI_MAX_CONNECTIONS). All watched jobs are
+    refreshed by one background sweep per time_interval, made of batch requests of batch_size status requests spread
+    over the thread pool, and each job exposes an asyncio future resolved with its terminal state.
+
+       Args:
+           - deployment_config: string specifying deployment configuration YAML file absolute path
+           - job_handler_class: JobHandler subclass translating job specs (e.g. ScoreJobHandler). Required to submit.
+           - time_interval: interval (in seconds) between two consecutive status sweeps
+           - max_workers: number of threads issuing API calls concurrently
+           - retries: number of consecutive sweeps in which the status of a job may fail to be fetched before its
+                      future raises the error
+           - batch_size: number of status requests per batch request
+
+        Main usage:
+           - submit_job(job_spec): coroutine. Submits the job and returns its completion future.
+           - watch(job): returns the completion future of an already submitted job.
+           - cancel(job): coroutine. Requests cancellation of a job.
+           - close(): coroutine. Stops the sweep and releases threads.
+    """
+
+    def __init__(self, deployment_config, job_handler_class=None, time_interval=TIME_INTERVAL, max_workers=4,
+                 retries=10, batch_size=BATCH_SIZE):
+        self.job_handler = (job_handler_class or JobHandler)(deployment_config, job_executor='mlapi')
+        self._can_submit = job_handler_class is not None
+        self._project_id = self.job_handler._project_id
+        self.time_interval = time_interval
+        self.retries = retries
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self.status = {}
+        self._failures = {}
+        self._sweeper = None
+
+    def _get_mlapi(self):
+        return build_mlapi_client(self.job_handler._globals, self.job_handler._credentials)
+
+    def _create(self, job_spec):
+        mlapi = self._get_mlapi()
+        return mlapi.projects().jobs().create(body=self.job_handler.translate_job_specs(job_spec),
+                                              parent='projects/{}'.format(self._project_id)).execute()
+
+    def _cancel(self, job):
+        return self._get_mlapi().projects().jobs().cancel(name='projects/{}/jobs/{}'.format(self._project_id,
+                                                                                            job)).execute()
+
+    async def _run(self, fn, *args):
+        tracing.add_requests()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def submit_job(self, job_spec):
+        """
+        Submits a job.
+
+        :param job_spec: job specification as produced by a JobSpecHandler
+        :return: asyncio future resolved with the job terminal state
+        """
+        if not self._can_submit:
+            raise ValueError("Must set job_handler_class to submit jobs.")
+        job = job_spec['jobId']
+        with tracing.span('AsyncJobHandler.submit_job', job_id=job):
+            try:
+                await self._run(self._create, job_spec)
+            except errors.HttpError as err:
+                logging.error(err._get_reason())
+                raise ValueError("Unable to submit job {}.".format(job))
+        logging.info("Request successful: {}".format(job))
+        return self.watch(job)
+
+    def watch(self, job):
+        """
+        Starts watching a job. Must be called from the event loop (e.g. from a coroutine).
+
+        :param job: job name
+        :return: asyncio future resolved with the job terminal state. Cancelling the future cancels the job.
+        """
+        if job not in self._futures:
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda f, job=job: self._on_future_done(job, f))
+            self._futures[job] = future
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.ensure_future(self._sweep())
+        return self._futures[job]
+
+    def _on_future_done(self, job, future):
+        if future.cancelled() and self.status.get(job) not in TERMINAL_STATES:
+            asyncio.ensure_future(self.cancel(job))
+
+    async def cancel(self, job):
+        """
+        Requests cancellation of a job. Its future resolves with CANCELLED at the next sweep.
+
+        :param job: job name
+        :return: True if cancellation was accepted
+        """
+        try:
+            await self._run(self._cancel, job)
+            logging.warning("Job cancelled: {}".format(job))
+            return True
+        except errors.HttpError as err:
+            logging.warning("Unable to cancel job {}: {}".format(job, err._get_reason()))
+            return False
+
+    async def _get_jobs_info(self, job_names):
+        # one batch request per batch_size jobs, batches issued concurrently by the thread pool
+        loop = asyncio.get_running_loop()
+        mlapi = self._get_mlapi()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, get_jobs_info, mlapi, job_names[start:start + self.batch_size],
+                                 self.batch_size)
+            for start in range(0, len(job_names), self.batch_size)])
+        job_info, job_errors = {}, {}
+        for info, failures in results:
+            job_info.update(info)
+            job_errors.update(failures)
+        return job_info, job_errors
+
+    async def _sweep(self):
+        while True:
+            pending = [job for job, future in self._futures.items() if not future.done()]
+            if not pending:
+                return
+            job_names = ['projects/{}/jobs/{}'.format(self._project_id, job) for job in pending]
+            job_info, job_errors = await self._get_jobs_info(job_names)
+            for job, name in zip(pending, job_names):
+                future = self._futures[job]
+                if name not in job_info:
+                    self._failures[job] = self._failures.get(job, 0) + 1
+                    logging.warning("Unable to get job {}: {}".format(job, job_errors.get(name)))
+                    if self._failures[job] >= self.retries and not future.done():
+                        future.set_exception(job_errors.get(name) or ValueError("No status for job {}".format(job)))
+                    continue
+                self._failures.pop(job, None)
+                self.status[job] = job_info[name]['state']
+                if self.status[job] in TERMINAL_STATES and not future.done():
+                    future.set_result(self.status[job])
+            await asyncio.sleep(self.time_interval)
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+
+async def async_poll(deployment_config, time_interval, jobs, fail_fast=False, cancel_on_failure=False, handler=None):
+    """
+    Monitors job status on GCP AI Platform without blocking the event loop. Asyncio counterpart of wrappers.poll().
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param time_interval: interval (in seconds) between two consecutive checks
+    :param jobs: list of jobs to monitor
+    :param fail_fast: raise JobFailedError as soon as one job fails instead of waiting for all jobs to finish
+    :param cancel_on_failure: when failing fast, cancel all jobs that are still running
+    :param handler: AsyncJobHandler to reuse (e.g. the one that submitted the jobs). A private one is created otherwise.
+    :return: dict containing job names as keys and job status (SUCCEEDED, FAILED, CANCELLED) as value. Jobs whose
+             future was cancelled (which cancels the job, see AsyncJobHandler.watch()) are reported CANCELLED.
+    """
+    own_handler = handler is None
+    if own_handler:
+        handler = AsyncJobHandler(deployment_config, time_interval=time_interval)
+    try:
+        futures = {handler.watch(job): job for job in jobs}
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                job = futures[future]
+                if fail_fast and _get_state(future) in FAILURE_STATES:
+                    logging.error("Job {}: {}".format(_get_state(future).lower(), job))
+                    cancelled_jobs = []
+                    if cancel_on_failure:
+                        running_jobs = [futures[f] for f in pending]
+                        accepted = await asyncio.gather(*[handler.cancel(j) for j in running_jobs])
+                        cancelled_jobs = [j for j, ok in zip(running_jobs, accepted) if ok]
+                    raise JobFailedError("Job {} failed. Cancelled sibling jobs: {}".format(job, cancelled_jobs),
+                                         status={j: handler.status.get(j) for j in jobs}, failed_jobs=[job],
+                                         cancelled_jobs=cancelled_jobs)
+        return {futures[future]: _get_state(future) for future in futures}
+    finally:
+        if own_handler:
+            await handler.close()
+
+
+def _get_state(future):
+    return 'CANCELLED' if future.cancelled() else future.result()
@@ -0,0 +1,276 @@
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from threading import Lock
+from random import Random
+from time import sleep
+import base64
+import zlib
+import os
+
+
+class StorageBackend:
+    """Object storage exposing the subset of the google.cloud.storage client API used by this library (list_blobs,
+    bucket, get_bucket; see Bucket and Blob), so that code written against GCS runs unchanged on other stores.
+    Subclasses implement a handful of primitives on (bucket name, object name) pairs.
+
+    Request counts (total and per primitive: list, stat, read, write, delete) and byte counts are kept in the stats
+    attribute (useful to compare I/O patterns offline).
+
+        Main usage:
+           - get_storage_client(_globals) in utils picks the backend from STORAGE_BACKEND in the deployment config
+           - list_blobs(bucket_or_name, prefix): returns blobs whose name starts with prefix, sorted by name
+           - bucket(name) / get_bucket(name): returns a Bucket
+    """
+
+    def __init__(self):
+        self.stats = {'requests': 0, 'list': 0, 'stat': 0, 'read': 0, 'write': 0, 'delete': 0, 'bytes_read': 0,
+                      'bytes_written': 0}
+        self._stats_lock = Lock()
+
+    def _count(self, method, bytes_read=0, bytes_written=0):
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats[method] += 1
+            self.stats['bytes_read'] += bytes_read
+            self.stats['bytes_written'] += bytes_written
+
+    # Primitives
+    def _list(self, bucket_name, prefix):
+        """:return: list of (name, size, generation, crc32c) tuples"""
+        raise NotImplementedError
+
+    def _stat(self, bucket_name, name):
+        """:return: (size, generation, crc32c) tuple, None if the object does not exist"""
+        raise NotImplementedError
+
+    def _read(self, bucket_name, name):
+        """:return: object content (bytes). Raises NotFound if the object does not exist."""
+        raise NotImplementedError
+
+    def _write(self, bucket_name, name, data):
+        raise NotImplementedError
+
+    def _delete(self, bucket_name, name):
+        """Raises NotFound if the object does not exist."""
+        raise NotImplementedError
+
+    # google.cloud.storage.Client API
+    def bucket(self, bucket_name):
+        return Bucket(self, bucket_name)
+
+    def get_bucket(self, bucket_name):
+        return Bucket(self, bucket_name)
+
+    def list_blobs(self, bucket_or_name, prefix=None, max_results=None):
+        bucket = bucket_or_name if isinstance(bucket_or_name, Bucket) else self.bucket(bucket_or_name)
+        self._count('list')
+        items = sorted(self._list(bucket.name, prefix or ''))
+        if max_results is not None:
+            items = items[:max_results]
+        return iter([Blob(name, bucket, size=size, generation=generation, crc32c=crc32c)
+                     for name, size, generation, crc32c in items])
+
+
+class Bucket:
+    """google.cloud.storage.Bucket counterpart of StorageBackend."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name):
+        return Blob(blob_name, self)
+
+    def get_blob(self, blob_name):
+        blob = Blob(blob_name, self)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None, max_results=None):
+        return self.client.list_blobs(self, prefix=prefix, max_results=max_results)
+
+    def copy_blob(self, blob, destination_bucket, new_name=None):
+        data = self.client._read(self.name, blob.name)  # server-side for remote stores: not counted as bytes read
+        self.client._count('write')
+        new_blob = Blob(new_name if new_name is not None else blob.name, destination_bucket)
+        destination_bucket.client._write(destination_bucket.name, new_blob.name, data)
+        return new_blob
+
+    def rename_blob(self, blob, new_name):
+        new_blob = self.copy_blob(blob, self, new_name)
+        blob.delete()
+        return new_blob
+
+
+class Blob:
+    """google.cloud.storage.Blob counterpart of StorageBackend. The client argument of methods is accepted for
+    compatibility and ignored (the bucket's backend is used)."""
+
+    def __init__(self, name, bucket, size=None, generation=None, crc32c=None):
+        self.name = name
+        self.bucket = bucket
+        self.size = size
+        self.generation = generation
+        self.crc32c = crc32c
+
+    @property
+    def _backend(self):
+        return self.bucket.client
+
+    def reload(self, client=None):
+        self._backend._count('stat')
+        meta = self._backend._stat(self.bucket.name, self.name)
+        if meta is None:
+            raise NotFound("No such object: {}/{}".format(self.bucket.name, self.name))
+        self.size, self.generation, self.crc32c = meta
+
+    def exists(self, client=None):
+        self._backend._count('stat')
+        return self._backend._stat(self.bucket.name, self.name) is not None
+
+    def download_as_bytes(self, client=None):
+        data = self._backend._read(self.bucket.name, self.name)
+        self._backend._count('read', bytes_read=len(data))
+        return data
+
+    def download_as_string(self, client=None):
+        return self.download_as_bytes(client=client)
+
+    def download_to_filename(self, filename, client=None):
+        data = self.download_as_bytes(client=client)
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    def upload_from_string(self, data, content_type=None, client=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._backend._write(self.bucket.name, self.name, data)
+        self._backend._count('write', bytes_written=len(data))
+
+    def upload_from_filename(self, filename, content_type=None, client=None):
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read(), content_type=content_type)
+
+    def delete(self, client=None):
+        self._backend._delete(self.bucket.name, self.name)
+        self._backend._count('delete')
+
+
+class LocalBackend(StorageBackend):
+    """Stores objects on the local filesystem: gs://bucket/path/to/object maps to <root>/bucket/path/to/object.
+
+       Args:
+           - root: root directory
+    """
+
+    _TMP_SUFFIX = '.gcpaiutils-tmp'
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+
+    def _path(self, bucket_name, name):
+        return os.path.join(self.root, bucket_name, *name.split("/"))
+
+    def _meta(self, path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns, None  # no checksum: listing must not read whole files
+
+    def _list(self, bucket_name, prefix):
+        bucket_dir = os.path.join(self.root, bucket_name)
+        search_dir = os.path.join(bucket_dir, *prefix.split("/")[:-1])
+        items = []
+        for dir_path, _, file_names in os.walk(search_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                name = os.path.relpath(path, bucket_dir).replace(os.sep, "/")
+                if name.startswith(prefix) and not name.endswith(self._TMP_SUFFIX):
+                    items.append((name,) + self._meta(path))
+        return items
+
+    def _stat(self, bucket_name, name):
+        path = self._path(bucket_name, name)
+        return self._meta(path) if os.path.isfile(path) else None
+
+    def _read(self, bucket_name, name):
+        try:
+            with open(self._path(bucket_name, name), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise NotFound("No such object: {}/{}".format(bucket_name, name))
+
+    def _write(self, bucket_name, name, data):
+        path = self._path(bucket_name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + self._TMP_SUFFIX, 'wb') as f:
+            f.write(data)
+        os.replace(path + self._TMP_SUFFIX, path)  # atomic, like an object upload
+
+    def _delete(self, bucket_name, name):
+        try:
+            os.remove(self._path(bucket_name, name))
+        except FileNotFoundError:
+            raise NotFound("No such object: {}/{}".format(bucket_name, name))
+
+
+class MemoryBackend(StorageBackend):
+    """Stores objects in memory. Latency and transient errors can be injected to mimic a remote store.
+
+       Args:
+           - latency: delay (in seconds) added to every primitive call
+           - error_rate: probability of a primitive call failing with ServiceUnavailable (503)
+           - seed: random seed of error injection
+    """
+
+    def __init__(self, latency=0, error_rate=0, seed=None):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = Random(seed)
+        self._objects = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def _call(self):
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            raise ServiceUnavailable("Injected storage error")
+
+    def _list(self, bucket_name, prefix):
+        self._call()
+        with self._lock:
+            return [(name, len(data), generation, crc32c)
+                    for (bucket, name), (data, generation, crc32c) in self._objects.items()
+                    if bucket == bucket_name and name.startswith(prefix)]
+
+    def _stat(self, bucket_name, name):
+        self._call()
+        with self._lock:
+            item = self._objects.get((bucket_name, name))
+        return None if item is None else (len(item[0]), item[1], item[2])
+
+    def _read(self, bucket_name, name):
+        self._call()
+        with self._lock:
+            item = self._objects.get((bucket_name, name))
+        if item is None:
+            raise NotFound("No such object: {}/{}".format(bucket_name, name))
+        return item[0]
+
+    def _write(self, bucket_name, name, data):
+        self._call()
+        with self._lock:
+            self._generation += 1
+            self._objects[(bucket_name, name)] = (bytes(data), self._generation, _get_crc32c(data))
+
+    def _delete(self, bucket_name, name):
+        self._call()
+        with self._lock:
+            if self._objects.pop((bucket_name, name), None) is None:
+                raise NotFound("No such object: {}/{}".format(bucket_name, name))
+
+
+def _get_crc32c(data):
+    # content checksum used as fingerprint (CRC-32, not the Castagnoli variant GCS reports)
+    return base64.b64encode(zlib.crc32(data).to_bytes(4, 'big')).decode('utf-8')
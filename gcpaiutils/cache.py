@@ -0,0 +1,142 @@
+from gcpaiutils.utils import get_storage_client, get_user, get_problem
+from gcpaiutils.journal import get_spec_hash
+from gcpaiutils import tracing
+from time import time
+import json
+
+
+class TrainingCache:
+    """Index of trained models keyed by training fingerprint (see get_training_fingerprint()). Each entry is a small
+    JSON object in the model bucket holding the job id that produced the model (and the project it ran in).
+
+       Args:
+           - gcs_client: google.cloud.storage client
+           - bucket_name: model bucket name
+           - prefix: folder holding cache entries
+           - model_prefix: folder holding trained models (used to check that cached models still exist)
+
+        Main usage:
+           - lookup(fingerprint, ttl): returns cached job id (None on miss, expired entry or deleted model)
+           - store(fingerprint, job_id, project_id): records a submitted train job
+           - projects: dict of project ids of the jobs returned by lookup() (jobs routed to another project)
+    """
+
+    def __init__(self, gcs_client, bucket_name, prefix, model_prefix):
+        self.gcs_client = gcs_client
+        self._bucket = gcs_client.bucket(bucket_name)
+        self.prefix = prefix
+        self.model_prefix = model_prefix
+        self.projects = {}
+
+    def _get_blob(self, fingerprint):
+        return self._bucket.blob(self.prefix + fingerprint + '.json')
+
+    def lookup(self, fingerprint, ttl=None):
+        """
+        :param fingerprint: training fingerprint
+        :param ttl: maximum age (in seconds) of a reusable entry. None means no expiry.
+        :return: job id, None on cache miss
+        """
+        blob = self._get_blob(fingerprint)
+        with tracing.span('cache.lookup', fingerprint=fingerprint) as sp:
+            sp.add_requests()
+            if not blob.exists(client=self.gcs_client):
+                return None
+            sp.add_requests()
+            entry = json.loads(blob.download_as_string(client=self.gcs_client).decode('utf-8'))
+            if ttl is not None and time() - entry['created'] > ttl:
+                return None
+            # Model folder is named after the job id without its 'train_' prefix
+            model_dir = self.model_prefix + '_'.join(entry['job_id'].split("_")[1:]) + '/'
+            sp.add_requests()
+            if not list(self.gcs_client.list_blobs(bucket_or_name=self._bucket.name, prefix=model_dir,
+                                                   max_results=1)):
+                return None
+        if entry.get('project_id'):
+            self.projects[entry['job_id']] = entry['project_id']
+        return entry['job_id']
+
+    def store(self, fingerprint, job_id, project_id=None):
+        entry = {'job_id': job_id, 'created': time()}
+        if project_id is not None:
+            entry['project_id'] = project_id
+        with tracing.span('cache.store', fingerprint=fingerprint) as sp:
+            self._get_blob(fingerprint).upload_from_string(json.dumps(entry), content_type='application/json',
+                                                           client=self.gcs_client)
+            sp.add_requests()
+
+
+def load_json_blob(gcs_client, uri):
+    """
+    :param gcs_client: google.cloud.storage client
+    :param uri: 'gs://bucket/path.json' object URI
+    :return: parsed JSON content, None if the object does not exist
+    """
+    bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+    blob = gcs_client.bucket(bucket_name).blob(blob_name)
+    with tracing.span('gcs.download', blob=blob_name) as sp:
+        sp.add_requests()
+        if not blob.exists(client=gcs_client):
+            return None
+        data = blob.download_as_string(client=gcs_client)
+        sp.add_requests()
+        sp.add_bytes(len(data))
+    return json.loads(data.decode('utf-8'))
+
+
+def store_json_blob(gcs_client, uri, content):
+    """
+    :param gcs_client: google.cloud.storage client
+    :param uri: 'gs://bucket/path.json' object URI
+    :param content: JSON-serializable object
+    """
+    bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+    data = json.dumps(content)
+    with tracing.span('gcs.upload', blob=blob_name) as sp:
+        gcs_client.bucket(bucket_name).blob(blob_name).upload_from_string(data, content_type='application/json',
+                                                                          client=gcs_client)
+        sp.add_requests()
+        sp.add_bytes(len(data))
+
+
+def get_added_objects(previous_fingerprints, current_fingerprints):
+    """
+    Compares two data fingerprints (see get_blob_fingerprints()).
+
+    :param previous_fingerprints: fingerprints of the previously evaluated data
+    :param current_fingerprints: fingerprints of the current data
+    :return: list of object names added since the previous evaluation, None if any previous object changed or vanished
+    """
+    current = {item[0]: item for item in current_fingerprints}
+    for item in previous_fingerprints:
+        if current.get(item[0]) != item:
+            return None
+    previous_names = set(item[0] for item in previous_fingerprints)
+    return [name for name in sorted(current) if name not in previous_names]
+
+
+def get_training_fingerprint(atom, image_uri, args, hyperparameters, data_fingerprints, machine_type):
+    """
+    Fingerprints a training run. Two runs with the same fingerprint produce the same model.
+
+    :param atom: algorithm name
+    :param image_uri: atom container image URI (see deployment.yml)
+    :param args: atom arguments
+    :param hyperparameters: hyper-parameter tuning configuration (None without tuning)
+    :param data_fingerprints: training data fingerprints as returned by get_blob_fingerprints()
+    :param machine_type: AI Platform master machine type
+    :return: hex digest
+    """
+    return get_spec_hash(atom, image_uri, args, hyperparameters, data_fingerprints, machine_type)
+
+
+def get_training_cache(_globals, kwargs):
+    """
+    :param _globals: deployment configuration dict
+    :param kwargs: Airflow context
+    :return: TrainingCache of the current user and problem
+    """
+    gcs_client = get_storage_client(_globals)
+    return TrainingCache(gcs_client, _globals["MODEL_BUCKET_NAME"],
+                         prefix=f"{get_user(kwargs)}/TRAINING_CACHE/{get_problem(kwargs)}/",
+                         model_prefix=f"{get_user(kwargs)}/ACTIVE_MODELS/{get_problem(kwargs)}/")
@@ -0,0 +1,389 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.parser import BytesParser
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime as dt, timezone
+from threading import Thread, Lock
+from random import Random
+from time import time, sleep
+from uuid import uuid4
+import argparse
+import logging
+import json
+import re
+
+
+TERMINAL_STATES = ["SUCCEEDED", "FAILED", "CANCELLED"]
+_JOB_PATH = re.compile(r"^/v1/projects/(?P<project>[^/]+)/jobs(?:/(?P<job>[^/:]+))?(?P<cancel>:cancel)?$")
+_STATUS_NAMES = {200: 'OK', 400: 'FAILED_PRECONDITION', 404: 'NOT_FOUND', 409: 'ALREADY_EXISTS',
+                 429: 'RESOURCE_EXHAUSTED', 500: 'INTERNAL', 503: 'UNAVAILABLE'}
+
+
+class FakeJobsServer:
+    """Local stand-in for the AI Platform jobs API (ml/v1 projects.jobs create, get, list, cancel, and batch requests).
+    Serves its own discovery document, so that the discovery client (and everything built on it: JobHandler, poll(),
+    the wrappers) talks to it when MLAPI_DISCOVERY_URL is set to discovery_url (see utils.build_mlapi_client()).
+
+    Jobs move through QUEUED, PREPARING and RUNNING to SUCCEEDED or FAILED on the wall clock: durations are sampled at
+    creation from configurable distributions, given as a number (constant), a ('uniform', low, high),
+    ('exponential', mean) or ('lognormal', mu, sigma) tuple, or a callable taking a random.Random and returning seconds.
+
+    Request counts (per method, injected errors included) are kept in the stats attribute and served at /_stats.
+
+       Args:
+           - host: interface to bind
+           - port: port to bind (0 picks a free port)
+           - queue_duration: distribution of the time spent QUEUED and PREPARING (seconds)
+           - run_duration: distribution of the time spent RUNNING (seconds)
+           - failure_rate: probability of a job ending FAILED
+           - throttle_rate: probability of a request being rejected with 429 RESOURCE_EXHAUSTED
+           - error_rate: probability of a request failing with 503 UNAVAILABLE
+           - latency: delay (in seconds) added to every request
+           - seed: random seed of durations and injected errors
+
+        Main usage:
+           - start() / stop(), or use as a context manager
+           - discovery_url: value of MLAPI_DISCOVERY_URL in the deployment config
+           - stats: dict of request counts
+           - jobs: dict of job names as keys and job descriptions as value
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, queue_duration=0, run_duration=1, failure_rate=0, throttle_rate=0,
+                 error_rate=0, latency=0, seed=None):
+        self.queue_duration = queue_duration
+        self.run_duration = run_duration
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.latency = latency
+        self.jobs = {}
+        self.stats = {}
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    @property
+    def discovery_url(self):
+        return self.url + "discovery/ml/v1"
+
+    def start(self):
+        self._thread = Thread(target=self._httpd.serve_forever, name="FakeJobsServer", daemon=True)
+        self._thread.start()
+        logging.info("Fake jobs API listening on {}".format(self.url))
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'requests': 0, 'create': 0, 'get': 0, 'list': 0, 'cancel': 0, 'batch': 0, 'batched': 0,
+                          'throttled': 0, 'errors': 0, 'created_jobs': 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _sample(self, distribution):
+        with self._lock:
+            if callable(distribution):
+                return max(0.0, float(distribution(self._random)))
+            if isinstance(distribution, (int, float)):
+                return float(distribution)
+            kind, params = distribution[0], distribution[1:]
+            if kind == 'uniform':
+                return self._random.uniform(*params)
+            if kind == 'exponential':
+                return self._random.expovariate(1 / params[0])
+            if kind == 'lognormal':
+                return self._random.lognormvariate(*params)
+        raise ValueError("Unknown duration distribution: {}".format(distribution))
+
+    def _draw(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    # Jobs
+    def _refresh(self, job_info, now=None):
+        """Advances the job state according to its sampled timeline. Caller holds the lock."""
+        if job_info['state'] in TERMINAL_STATES:
+            return job_info
+        timeline = job_info.pop('_timeline')
+        now = now or time()
+        if now >= timeline['end']:
+            job_info['state'] = 'FAILED' if timeline['fail'] else 'SUCCEEDED'
+            job_info['startTime'] = _format_time(timeline['start'])
+            job_info['endTime'] = _format_time(timeline['end'])
+            if timeline['fail']:
+                job_info['errorMessage'] = "Injected job failure."
+        elif now >= timeline['start']:
+            job_info['state'] = 'RUNNING'
+            job_info['startTime'] = _format_time(timeline['start'])
+        elif now >= timeline['prepare']:
+            job_info['state'] = 'PREPARING'
+        if job_info['state'] not in TERMINAL_STATES:
+            job_info['_timeline'] = timeline
+        return job_info
+
+    def _public(self, job_info):
+        return {key: value for key, value in job_info.items() if not key.startswith('_')}
+
+    def create_job(self, project, body):
+        job = body.get('jobId') if isinstance(body, dict) else None
+        if not job:
+            return 400, _error(400, "Field jobId is required.")
+        queue_time, run_time = self._sample(self.queue_duration), self._sample(self.run_duration)
+        fail = self._draw(self.failure_rate)
+        now = time()
+        with self._lock:
+            if (project, job) in self.jobs:
+                return 409, _error(409, "Field: job.job_id Error: A job with this id already exists.")
+            job_info = dict(body, state='QUEUED', createTime=_format_time(now), etag=uuid4().hex[:12])
+            job_info['_timeline'] = {'prepare': now + queue_time / 2, 'start': now + queue_time,
+                                     'end': now + queue_time + run_time, 'fail': fail}
+            self.jobs[(project, job)] = job_info
+            self.stats['created_jobs'] += 1
+            return 200, self._public(job_info)
+
+    def get_job(self, project, job):
+        with self._lock:
+            job_info = self.jobs.get((project, job))
+            if job_info is None:
+                return 404, _error(404, "Field: name Error: The specified job was not found.")
+            return 200, self._public(self._refresh(job_info))
+
+    def list_jobs(self, project, filter_=None, page_size=None, page_token=None):
+        state_filter = None
+        if filter_:
+            match = re.match(r'^\s*state\s*[:=]\s*"?(\w+)"?\s*$', filter_)
+            if match is None:
+                return 400, _error(400, "Unsupported filter: {}".format(filter_))
+            state_filter = match.group(1)
+        with self._lock:
+            now = time()
+            jobs = [self._public(self._refresh(job_info, now)) for (job_project, _), job_info in
+                    sorted(self.jobs.items()) if job_project == project]
+        if state_filter is not None:
+            jobs = [job_info for job_info in jobs if job_info['state'] == state_filter]
+        start = int(page_token or 0)
+        end = start + (int(page_size) if page_size else len(jobs))
+        response = {'jobs': jobs[start:end]} if jobs[start:end] else {}
+        if end < len(jobs):
+            response['nextPageToken'] = str(end)
+        return 200, response
+
+    def cancel_job(self, project, job):
+        with self._lock:
+            job_info = self.jobs.get((project, job))
+            if job_info is None:
+                return 404, _error(404, "Field: name Error: The specified job was not found.")
+            self._refresh(job_info)
+            if job_info['state'] in TERMINAL_STATES:
+                return 400, _error(400, "Job {} is already in a terminal state: {}".format(job, job_info['state']))
+            job_info.pop('_timeline')
+            job_info.update(state='CANCELLED', endTime=_format_time(time()))
+            return 200, {}
+
+    # HTTP
+    def dispatch(self, method, path, body=None):
+        """
+        Serves a single API call.
+
+        :param method: HTTP method
+        :param path: request path, query string included
+        :param body: request body (bytes)
+        :return: (status, response dict)
+        """
+        self._count('requests')
+        if self.latency:
+            sleep(self.latency)
+        if self._draw(self.throttle_rate):
+            self._count('throttled')
+            return 429, _error(429, "Quota exceeded (injected).")
+        if self._draw(self.error_rate):
+            self._count('errors')
+            return 503, _error(503, "The service is currently unavailable (injected).")
+
+        parsed = urlparse(path)
+        match = _JOB_PATH.match(parsed.path)
+        if match is None:
+            return 404, _error(404, "Unknown path: {}".format(parsed.path))
+        project, job = match.group('project'), match.group('job')
+        if method == 'POST' and job is None:
+            self._count('create')
+            try:
+                return self.create_job(project, json.loads(body or b'{}'))
+            except ValueError:
+                return 400, _error(400, "Invalid JSON payload.")
+        if method == 'GET' and job is None:
+            self._count('list')
+            query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+            return self.list_jobs(project, query.get('filter'), query.get('pageSize'), query.get('pageToken'))
+        if method == 'GET' and not match.group('cancel'):
+            self._count('get')
+            return self.get_job(project, job)
+        if method == 'POST' and match.group('cancel'):
+            self._count('cancel')
+            return self.cancel_job(project, job)
+        return 404, _error(404, "Unknown method: {} {}".format(method, parsed.path))
+
+    def dispatch_batch(self, content_type, body):
+        """
+        Serves a multipart/mixed batch request (see googleapiclient BatchHttpRequest): every part is dispatched on its
+        own, so injected errors hit individual calls.
+
+        :param content_type: Content-Type header of the batch request (holds the multipart boundary)
+        :param body: batch request body (bytes)
+        :return: (content type, response body as bytes)
+        """
+        self._count('batch')
+        message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode('utf-8') + b"\r\n\r\n" + body)
+        boundary = "batch_" + uuid4().hex
+        lines = []
+        for part in message.get_payload():
+            request = part.get_payload(decode=True) or part.get_payload().encode('utf-8')
+            request_line, _, rest = request.replace(b"\r\n", b"\n").partition(b"\n")
+            _, _, payload = rest.partition(b"\n\n")
+            method, path = request_line.decode('utf-8').split(" ")[:2]
+            self._count('batched')
+            status, response = self.dispatch(method, path, payload or None)
+            content_id = part['Content-ID'].strip()
+            lines += ["--" + boundary, "Content-Type: application/http",
+                      "Content-ID: <response-" + content_id[1:], "",
+                      "HTTP/1.1 {} {}".format(status, _STATUS_NAMES.get(status, '')),
+                      "Content-Type: application/json; charset=UTF-8", "", json.dumps(response)]
+        lines += ["--" + boundary + "--", ""]
+        return "multipart/mixed; boundary=" + boundary, "\r\n".join(lines).encode('utf-8')
+
+    def get_discovery_document(self):
+        methods = {
+            'create': {'id': 'ml.projects.jobs.create', 'httpMethod': 'POST', 'path': 'v1/{+parent}/jobs',
+                       'parameters': {'parent': _path_parameter('^projects/[^/]+$')},
+                       'parameterOrder': ['parent'], 'request': {'$ref': 'Job'}, 'response': {'$ref': 'Job'}},
+            'get': {'id': 'ml.projects.jobs.get', 'httpMethod': 'GET', 'path': 'v1/{+name}',
+                    'parameters': {'name': _path_parameter('^projects/[^/]+/jobs/[^/]+$')},
+                    'parameterOrder': ['name'], 'response': {'$ref': 'Job'}},
+            'list': {'id': 'ml.projects.jobs.list', 'httpMethod': 'GET', 'path': 'v1/{+parent}/jobs',
+                     'parameters': {'parent': _path_parameter('^projects/[^/]+$'),
+                                    'filter': {'type': 'string', 'location': 'query'},
+                                    'pageSize': {'type': 'integer', 'format': 'int32', 'location': 'query'},
+                                    'pageToken': {'type': 'string', 'location': 'query'}},
+                     'parameterOrder': ['parent'], 'response': {'$ref': 'ListJobsResponse'}},
+            'cancel': {'id': 'ml.projects.jobs.cancel', 'httpMethod': 'POST', 'path': 'v1/{+name}:cancel',
+                       'parameters': {'name': _path_parameter('^projects/[^/]+/jobs/[^/]+$')},
+                       'parameterOrder': ['name'], 'request': {'$ref': 'CancelJobRequest'},
+                       'response': {'$ref': 'Empty'}},
+        }
+        return {'kind': 'discovery#restDescription', 'discoveryVersion': 'v1', 'id': 'ml:v1', 'name': 'ml',
+                'version': 'v1', 'protocol': 'rest', 'rootUrl': self.url, 'servicePath': '', 'batchPath': 'batch',
+                'parameters': {}, 'schemas': {'Job': {'id': 'Job', 'type': 'object'},
+                                              'ListJobsResponse': {'id': 'ListJobsResponse', 'type': 'object',
+                                                                   'properties': {'jobs': {'type': 'array',
+                                                                                           'items': {'$ref': 'Job'}},
+                                                                                  'nextPageToken': {'type': 'string'}}},
+                                              'CancelJobRequest': {'id': 'CancelJobRequest', 'type': 'object'},
+                                              'Empty': {'id': 'Empty', 'type': 'object'}},
+                'resources': {'projects': {'resources': {'jobs': {'methods': methods}}}}}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else None
+
+    def _send(self, status, content, content_type="application/json; charset=UTF-8"):
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode('utf-8')
+        self.send_response(status, _STATUS_NAMES.get(status))
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self, method):
+        fake = self.server.fake
+        body = self._read_body()
+        path = urlparse(self.path).path
+        if method == 'GET' and path == '/discovery/ml/v1':
+            self._send(200, fake.get_discovery_document())
+        elif method == 'GET' and path == '/_stats':
+            with fake._lock:
+                self._send(200, dict(fake.stats))
+        elif method == 'POST' and path == '/batch':
+            content_type, content = fake.dispatch_batch(self.headers.get('Content-Type', ''), body or b'')
+            self._send(200, content, content_type=content_type)
+        else:
+            self._send(*fake.dispatch(method, self.path, body))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, format, *args):
+        logging.debug("FakeJobsServer: " + format % args)
+
+
+def _path_parameter(pattern):
+    return {'type': 'string', 'location': 'path', 'required': True, 'pattern': pattern}
+
+
+def _error(status, message):
+    return {'error': {'code': status, 'message': message, 'status': _STATUS_NAMES.get(status, 'UNKNOWN')}}
+
+
+def _format_time(epoch):
+    return dt.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake AI Platform jobs API (ml/v1) for load and latency testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--queue-duration", type=float, default=0, help="seconds spent QUEUED/PREPARING")
+    parser.add_argument("--run-duration", type=float, nargs='+', default=[1],
+                        help="seconds spent RUNNING: one value (constant) or two (uniform bounds)")
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    run_duration = args.run_duration[0] if len(args.run_duration) == 1 else ('uniform',) + tuple(args.run_duration[:2])
+    server = FakeJobsServer(host=args.host, port=args.port, queue_duration=args.queue_duration,
+                            run_duration=run_duration, failure_rate=args.failure_rate,
+                            throttle_rate=args.throttle_rate, error_rate=args.error_rate, latency=args.latency,
+                            seed=args.seed)
+    print("Set MLAPI_DISCOVERY_URL: {}".format(server.discovery_url))
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
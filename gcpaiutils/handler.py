@@ -1,29 +1,48 @@
-from googleapiclient import discovery, errors
+from googleapiclient import errors
 from google.oauth2.service_account import Credentials
 from gcpaiutils.utils import get_deployment_config, get_deployment_constants, get_defaults,\
-    get_hyper, get_timestamp_components
+    get_hyper, get_timestamp_components, build_mlapi_client
+from gcpaiutils import tracing
+from threading import local
 import logging
 import abc
 
 
+def _thread_local_property(name):
+    # per-thread attribute: concurrent submissions through a shared handler do not overwrite each other's state
+    return property(lambda self: getattr(self._local, name, None),
+                    lambda self, value: setattr(self._local, name, value))
+
+
 class JobHandler:
     """Builds request for GCP AI Platform. Requires job specification as produced by JobSpecHandler.
 
        Args:
            - deployment_config: string specifying deployment configuration YAML file absolute path
-           - job_executor: can be either 'gcloud' or 'mlapi'. The former leverages gcloud to submit train job while
-                           the latter uses google's discovery api.
+           - job_executor: can be either 'gcloud', 'mlapi' or 'local'. The former leverages gcloud to submit train job
+                           while 'mlapi' uses google's discovery api and 'local' runs the job on this host (see
+                           local.py). Defaults to JOB_EXECUTOR in the deployment config, or 'mlapi'.
 
         Main usage:
            - submit_job(): returns the object. Sends the job request (async) with the specified parameters.
+             submit_job(job_spec, reattach=True) resubmits a job of a previous attempt: 409 ALREADY_EXISTS then
+             counts as success (see journal.submit_job_once()).
+
+    Handlers can be shared by threads: the API client is thread-safe (see transport.py) and the outcome of a
+    submission (job_request, reattach, success, error) is tracked per thread.
     """
 
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, deployment_config, job_executor='mlapi'):
+    job_request = _thread_local_property('job_request')
+    reattach = _thread_local_property('reattach')
+    success = _thread_local_property('success')
+    error = _thread_local_property('error')
+
+    def __init__(self, deployment_config, job_executor=None, project_id=None):
 
         self._globals = get_deployment_config(deployment_config)
-        self._project_id = self._globals['PROJECT_ID']
+        self._project_id = project_id or self._globals['PROJECT_ID']
         try:
             self._credentials = Credentials.from_service_account_file(self._globals['AI_PLATFORM_SA'])
         except:
@@ -31,13 +50,12 @@ class JobHandler:
                 self._credentials = Credentials.from_service_account_file(self._globals['GCP_AI_PLATFORM_SA'])
             except KeyError:
                 self._credentials = None
-        self.job_executor = job_executor
+        self.job_executor = job_executor or self._globals.get('JOB_EXECUTOR', 'mlapi')
         self.mlapi = None
-        self.job_request = None
-        self.success = None
+        self._local = local()
 
     def _execute_job_request(self):
-        if self.job_executor == 'mlapi':
+        if self.job_executor in ['mlapi', 'local']:
             self._exe_job_mlapi()
         else:
             raise NotImplementedError
@@ -46,16 +64,29 @@ class JobHandler:
         pass
 
     def _exe_job_mlapi(self):
-        try:
-            self.job_request.execute()  # TODO: manage output (jobId, state, ...)
-            self.success = True
-        except errors.HttpError as err:
-            logging.error(err._get_reason())
-            self.success = False
+        with tracing.span('mlapi.jobs.create') as sp:
+            try:
+                self.job_request.execute()  # TODO: manage output (jobId, state, ...)
+                self.success = True
+            except errors.HttpError as err:
+                self.error = err
+                if err.resp.status == 409 and self.reattach:  # ALREADY_EXISTS: submitted by a previous attempt
+                    logging.warning(err._get_reason())
+                    self.success = True
+                else:
+                    logging.error(err._get_reason())
+                    self.success = False
+            sp.add_requests()
 
     def create_job_request(self, job_spec=None):
         self.success = None  # reset success flag
-        self.mlapi = discovery.build('ml', 'v1', credentials=self._credentials)
+        self.error = None
+        if self.mlapi is None:
+            if self.job_executor == 'local':
+                from gcpaiutils.local import get_local_executor  # POSIX only: imported when selected
+                self.mlapi = get_local_executor(self._globals)  # same interface as the discovery client
+            else:
+                self.mlapi = build_mlapi_client(self._globals, self._credentials)
         self.job_request = self.mlapi.projects().jobs().create(body=self.translate_job_specs(job_spec)
                                                                , parent='projects/{}'.format(self._project_id))
 
@@ -63,10 +94,12 @@ class JobHandler:
     def translate_job_specs(self, job_spec=None):
         pass
 
-    def submit_job(self, job_spec):
-        if self.job_executor == 'mlapi':
-            self.create_job_request(job_spec)
-        self._execute_job_request()
+    def submit_job(self, job_spec, reattach=False):
+        self.reattach = reattach
+        with tracing.span('JobHandler.submit_job', job_id=job_spec.get('jobId'), executor=self.job_executor):
+            if self.job_executor in ['mlapi', 'local']:
+                self.create_job_request(job_spec)
+            self._execute_job_request()
 
 
 class JobSpecHandler:
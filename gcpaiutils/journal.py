@@ -0,0 +1,205 @@
+from gcpaiutils.utils import get_storage_client, get_deployment_config, FAILURE_STATES
+from gcpaiutils.routing import get_job_router
+from gcpaiutils.poller import get_status_client
+from gcpaiutils import tracing, metrics
+from googleapiclient import errors
+from hashlib import sha256
+from copy import deepcopy
+from time import sleep
+import logging
+import json
+import os
+
+
+MAX_RENAMES = 3  # fresh names tried when a new job's name is taken (job names have a one-second resolution)
+
+
+class SubmissionJournal:
+    """Durable record of submitted jobs, keyed by a content hash of their specification. Each entry holds the full job
+    specification (job id included) and is persisted before the job is submitted, so that a retried task re-attaches to
+    its jobs instead of paying for them twice.
+
+       Args:
+           - uri: journal location. Either a local file path or a 'gs://bucket/path.json' object URI.
+           - gcs_client: google.cloud.storage client, required for GCS URIs
+
+        Main usage:
+           - get(key): returns journaled job specification (None if not found)
+           - record(key, job_specs): persists job specification
+           - discard(key): removes an entry (e.g. after a rejected submission)
+    """
+
+    def __init__(self, uri, gcs_client=None):
+        self.uri = uri
+        self._gcs_client = gcs_client
+        self._entries = self._load()
+
+    def _get_blob(self):
+        bucket_name, _, blob_name = self.uri[len("gs://"):].partition("/")
+        return self._gcs_client.bucket(bucket_name).blob(blob_name)
+
+    def _load(self):
+        with tracing.span('journal.load', uri=self.uri):
+            if self.uri.startswith("gs://"):
+                blob = self._get_blob()
+                tracing.add_requests()
+                if not blob.exists(client=self._gcs_client):
+                    return {}
+                tracing.add_requests()
+                return json.loads(blob.download_as_string(client=self._gcs_client).decode('utf-8'))
+            if not os.path.exists(self.uri):
+                return {}
+            with open(self.uri, 'r') as f:
+                return json.load(f)
+
+    def _save(self):
+        data = json.dumps(self._entries, sort_keys=True, default=str)
+        with tracing.span('journal.save', uri=self.uri) as sp:
+            if self.uri.startswith("gs://"):
+                self._get_blob().upload_from_string(data, content_type='application/json', client=self._gcs_client)
+                sp.add_requests()
+                sp.add_bytes(len(data))
+            else:
+                os.makedirs(os.path.dirname(os.path.abspath(self.uri)), exist_ok=True)
+                tmp_file = self.uri + '.tmp'
+                with open(tmp_file, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_file, self.uri)  # atomic: never leave a truncated journal behind
+
+    def get(self, key):
+        job_specs = self._entries.get(key)
+        return deepcopy(job_specs) if job_specs is not None else None
+
+    def record(self, key, job_specs):
+        self._entries[key] = deepcopy(job_specs)
+        self._save()
+
+    def discard(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+
+def get_spec_hash(*items):
+    """
+    Computes a content hash of job specification inputs (e.g. spec handler name and its keyword arguments).
+
+    :param items: JSON-serializable objects
+    :return: hex digest
+    """
+    return sha256(json.dumps(items, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_submission_journal(_globals, kwargs):
+    """
+    Returns the submission journal of the running Airflow task. Retries of the same task instance share the journal.
+    Journals live under JOURNAL_URI (deployment config; local dir or gs:// prefix, defaults to the model bucket) and
+    can be disabled setting SUBMISSION_JOURNAL to False.
+
+    :param _globals: deployment configuration dict
+    :param kwargs: Airflow context
+    :return: SubmissionJournal, None if disabled or outside an Airflow task
+    """
+    if not _globals.get('SUBMISSION_JOURNAL', True):
+        return None
+    try:
+        task_instance = kwargs['task_instance']
+        journal_name = '/'.join([task_instance.dag_id, kwargs['run_id'], task_instance.task_id]) + '.json'
+    except (KeyError, AttributeError, TypeError):
+        return None
+    root_uri = _globals.get('JOURNAL_URI', "gs://{}/JOURNAL/".format(_globals["MODEL_BUCKET_NAME"]))
+    if root_uri.startswith("gs://"):
+        gcs_client = get_storage_client(_globals)
+        return SubmissionJournal(root_uri.rstrip('/') + '/' + journal_name, gcs_client=gcs_client)
+    return SubmissionJournal(os.path.join(root_uri, journal_name))
+
+
+def submit_job_once(journal, spec_handler_class, job_handler_class, deployment_config, **spec_kwargs):
+    """
+    Submits a job unless the journal shows it was already submitted by a previous attempt. Journaled jobs are
+    submitted again with their original specification (same job id) to their original target: the API answers 409
+    ALREADY_EXISTS, which JobHandler then treats as success, or creates the job if the previous attempt died before
+    submitting it. Journaled jobs that ended FAILED or CANCELLED are discarded and submitted again under a fresh
+    name, so that a failed task can be rerun.
+
+    New jobs are sent to the region/project target chosen by the job router (see routing.get_job_router()). A target
+    answering 429 (quota exhausted) is taken out of rotation and the job is sent to the next one. A new job whose
+    name is already taken (409, e.g. a sibling submitted within the same second) is renamed and submitted again.
+
+    :param journal: SubmissionJournal (None disables journaling)
+    :param spec_handler_class: JobSpecHandler subclass
+    :param job_handler_class: JobHandler subclass
+    :param deployment_config: YAML file containing all deployment variables
+    :param spec_kwargs: keyword arguments used to instantiate the spec handler
+    :return: job id, None if submission failed
+    """
+    _globals = get_deployment_config(deployment_config)
+    router = get_job_router(_globals)
+    spec_key = get_spec_hash(spec_handler_class.__name__, spec_kwargs)
+    job_specs = journal.get(spec_key) if journal is not None else None
+    if job_specs is not None:
+        target = job_specs.pop('target', None) or router.targets[0]  # entries predating routing: home target
+        state = _get_job_state(_globals, target['project_id'], job_specs['jobId'])
+        if state in FAILURE_STATES:
+            logging.warning("Journaled job {} ended {}, submitting a new job.".format(job_specs['jobId'], state))
+            journal.discard(spec_key)
+            job_specs = None
+    reattach = job_specs is not None
+    if job_specs is None:
+        fresh_kwargs = deepcopy(spec_kwargs)  # spec handlers mutate their inputs
+        job_specs = _create_job_specs(spec_handler_class, deployment_config, spec_kwargs)
+        target = router.choose()
+    else:
+        logging.info("Re-attaching to journaled job: {}".format(job_specs['jobId']))
+
+    job_id = job_specs['jobId']
+    tried = []
+    renames = 0
+    while target is not None:
+        if target['region']:
+            job_specs['trainingInput']['region'] = target['region']
+        if journal is not None:
+            journal.record(spec_key, dict(job_specs, target={'project_id': target['project_id'],
+                                                             'region': target['region']}))
+        T = job_handler_class(deployment_config=deployment_config, project_id=target['project_id'])
+        T.submit_job(deepcopy(job_specs), reattach=reattach)  # handlers translate specs in place
+        if T.success:
+            router.assign(job_id, target)
+            return job_id
+        if T.error is not None and T.error.resp.status == 409 and not reattach and renames < MAX_RENAMES:
+            renames += 1
+            sleep(1)  # next timestamp, hence next job name
+            job_specs = _create_job_specs(spec_handler_class, deployment_config, deepcopy(fresh_kwargs))
+            logging.warning("Job {} already exists, submitting as {}".format(job_id, job_specs['jobId']))
+            job_id = job_specs['jobId']
+            continue
+        if T.error is None or T.error.resp.status != 429:
+            break
+        router.exhaust(target)
+        tried.append(target)
+        target = router.choose(exclude=tried)
+        if target is not None:
+            metrics.inc_counter('gcpaiutils_mlapi_retries_total', method='ml.projects.jobs.create', reason='quota')
+            logging.warning("Retrying job {} on {}".format(job_id, (target['project_id'], target['region'])))
+
+    if journal is not None:
+        journal.discard(spec_key)
+    return None
+
+
+def _create_job_specs(spec_handler_class, deployment_config, spec_kwargs):
+    with tracing.span('create_job_specs', handler=spec_handler_class.__name__):
+        S = spec_handler_class(deployment_config=deployment_config, **spec_kwargs)
+        S.create_job_specs()
+    return S.job_specs
+
+
+def _get_job_state(_globals, project_id, job):
+    # state of a journaled job, None if it was never created (previous attempt died before submitting) or is unknown
+    try:
+        tracing.add_requests()
+        return get_status_client(_globals).projects().jobs().get(
+            name='projects/{}/jobs/{}'.format(project_id, job)).execute()['state']
+    except errors.HttpError as err:
+        if err.resp.status != 404:
+            logging.warning("Unable to fetch journaled job {}: {}".format(job, err._get_reason()))
+        return None
@@ -0,0 +1,311 @@
+from googleapiclient import errors
+from datetime import datetime as dt, timezone
+from importlib import import_module
+from tempfile import gettempdir
+from threading import Lock
+from time import sleep
+import subprocess
+import argparse
+import httplib2
+import logging
+import signal
+import fcntl
+import json
+import sys
+import os
+
+
+ENTRY_POINTS = {}  # image tag (e.g. 'class_lgbm', 'scorer_lgbm') -> callable or 'module:function'
+TERMINAL_STATES = ['SUCCEEDED', 'FAILED', 'CANCELLED']
+SLOT_POLL_INTERVAL = 0.5  # seconds between two attempts of a queued job to grab a worker slot
+_EXECUTORS = {}
+_EXECUTORS_LOCK = Lock()
+
+
+def register_entry_point(image_tag, target):
+    """
+    Registers the local Python entry point of an atom. The entry point is called with the argument list the container
+    would receive (e.g. ['--model-dir', 'gs://...', '--train-files', 'gs://...']).
+
+    :param image_tag: tag of the atom image in deployment.yml (e.g. 'class_lgbm' for
+                      '.../classification_lgbm:class_lgbm')
+    :param target: importable module-level callable, or 'module:function' string
+    """
+    ENTRY_POINTS[image_tag] = target
+
+
+class LocalJobExecutor:
+    """Runs AI Platform jobs on the local host instead of submitting them to GCP. Exposes the subset of the ML API
+    discovery client used by this library (projects().jobs().create/get/cancel), so that JobHandler, poll() and
+    poke_jobs() work unchanged.
+
+    Each job runs in a detached runner process (own session, see `python -m gcpaiutils.local`), so it outlives the
+    task that submitted it and can be polled by a later sensor task of the same host. The runner is the only writer
+    of the job state file (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED), atomically replaced on each update. At most
+    max_workers jobs run at once per state_dir, across processes: runners queue on lock files under state_dir/slots.
+    A job whose runner died without recording an outcome is reported FAILED.
+
+    Each job runs the entry point registered for its master image tag (see register_entry_point() and
+    LOCAL_ENTRY_POINTS in the deployment config) with the translated job args. Entry points must be importable by
+    the runner ('module:function' strings, or callables defined at module level outside __main__).
+
+       Args:
+           - state_dir: directory holding job states, logs and worker slots
+           - entry_points: dict of image tags as keys and entry points as value (merged over ENTRY_POINTS)
+           - max_workers: number of jobs running concurrently (defaults to the number of CPUs)
+
+        Main usage:
+           - select via JOB_EXECUTOR: 'local' in the deployment config (see get_local_executor())
+    """
+
+    def __init__(self, state_dir, entry_points=None, max_workers=None):
+        self.state_dir = state_dir
+        self.entry_points = entry_points or {}
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._processes = {}
+        os.makedirs(state_dir, exist_ok=True)
+
+    def projects(self):
+        return self
+
+    def jobs(self):
+        return self
+
+    def create(self, body=None, parent=None):
+        return _Request(self._create, body)
+
+    def get(self, name=None):
+        return _Request(self._get, name.split("/")[-1])
+
+    def cancel(self, name=None):
+        return _Request(self._cancel, name.split("/")[-1])
+
+    def _get_entry_point(self, image_uri):
+        image_tag = image_uri.split(":")[-1]
+        for entry_points in [self.entry_points, ENTRY_POINTS]:
+            for key in [image_uri, image_tag]:
+                if key in entry_points:
+                    return _get_target_path(entry_points[key])
+        raise _http_error(400, "No local entry point registered for image {}".format(image_uri))
+
+    def _create(self, body):
+        job = body['jobId']
+        target = self._get_entry_point(body['trainingInput']['masterConfig']['imageUri'])
+        try:  # exclusive creation: concurrent submissions of the same job id get a 409
+            with open(_get_state_file(self.state_dir, job), 'x') as f:
+                json.dump({'jobId': job, 'state': 'QUEUED', 'createTime': _now()}, f)
+        except FileExistsError:
+            raise _http_error(409, "Job {} already exists.".format(job))
+        args = list(body['trainingInput'].get('args', []))
+        with open(_get_log_file(self.state_dir, job), 'ab') as log:
+            process = subprocess.Popen([sys.executable, "-m", "gcpaiutils.local", self.state_dir, job, target,
+                                        "--max-workers", str(self.max_workers), "--args", json.dumps(args)],
+                                       stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+        self._processes[job] = process
+        with open(_get_pid_file(self.state_dir, job), 'w') as f:
+            f.write(str(process.pid))
+        logging.info("Local job queued: {} (runner pid {})".format(job, process.pid))
+        return {'jobId': job, 'state': 'QUEUED'}
+
+    def _get(self, job):
+        try:
+            job_info = _read_state(self.state_dir, job)
+        except FileNotFoundError:
+            raise _http_error(404, "Job {} not found.".format(job))
+        if job_info['state'] not in TERMINAL_STATES and not self._is_alive(job):
+            job_info = _read_state(self.state_dir, job)  # the runner may have recorded its outcome meanwhile
+            if job_info['state'] not in TERMINAL_STATES:
+                job_info.update(state='FAILED', errorMessage="Local runner of job {} died (see {})".format(
+                    job, _get_log_file(self.state_dir, job)))
+        return job_info
+
+    def _cancel(self, job):
+        try:
+            job_info = _read_state(self.state_dir, job)
+        except FileNotFoundError:
+            job_info = None
+        if job_info is None or job_info['state'] in TERMINAL_STATES:
+            raise _http_error(400, "Job {} cannot be cancelled (unknown or finished).".format(job))
+        open(_get_cancel_file(self.state_dir, job), 'w').close()  # picked up by the runner until it starts the job
+        job_info = _read_state(self.state_dir, job)  # after the cancel file: a runner not signalled below sees it
+        if job_info['state'] == 'RUNNING':
+            try:
+                os.kill(job_info['pid'], signal.SIGTERM)
+            except (KeyError, ProcessLookupError):
+                pass
+        return {}
+
+    def _is_alive(self, job):
+        process = self._processes.get(job)
+        if process is not None:  # runner started by this process: poll() also reaps it
+            return process.poll() is None
+        try:
+            with open(_get_pid_file(self.state_dir, job), 'r') as f:
+                pid = int(f.read())
+        except (FileNotFoundError, ValueError):
+            return True  # runner being started by another process
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+
+class _Request:
+
+    def __init__(self, fn, *args):
+        self._fn = fn
+        self._args = args
+
+    def execute(self):
+        return self._fn(*self._args)
+
+
+class _JobCancelled(BaseException):
+    pass
+
+
+def get_local_executor(_globals):
+    """
+    Returns the local job executor configured in the deployment config (LOCAL_JOBS_DIR, LOCAL_WORKERS,
+    LOCAL_ENTRY_POINTS). Executors are shared within a process; jobs themselves run in detached runners, so any
+    process of the host using the same LOCAL_JOBS_DIR sees them.
+
+    :param _globals: deployment configuration dict
+    :return: LocalJobExecutor
+    """
+    state_dir = _globals.get('LOCAL_JOBS_DIR', os.path.join(gettempdir(), "gcpaiutils_local_jobs"))
+    with _EXECUTORS_LOCK:
+        if state_dir not in _EXECUTORS:
+            _EXECUTORS[state_dir] = LocalJobExecutor(state_dir, entry_points=_globals.get('LOCAL_ENTRY_POINTS'),
+                                                     max_workers=_globals.get('LOCAL_WORKERS'))
+        return _EXECUTORS[state_dir]
+
+
+def _run_job(state_dir, job, target, args, max_workers):
+    """Body of the runner process, the single writer of the job state once created. Cancellation reaches the runner
+    through the cancel file while queued and through SIGTERM once RUNNING (see LocalJobExecutor._cancel())."""
+    cancellable = [True]
+
+    def _on_sigterm(signum, frame):
+        if cancellable[0]:
+            raise _JobCancelled()
+
+    signal.signal(signal.SIGTERM, _on_sigterm)  # before anything else: an early SIGTERM must not kill the runner
+    cancel_file = _get_cancel_file(state_dir, job)
+    slot = None
+    try:
+        slot = _acquire_slot(state_dir, job, max_workers)
+        if slot is None or os.path.exists(cancel_file):  # cancelled while queued or while the slot was handed over
+            raise _JobCancelled()
+        _update_state(state_dir, job, state='RUNNING', startTime=_now(), pid=os.getpid())
+        if os.path.exists(cancel_file):  # cancelled by someone who still saw QUEUED, hence sent no SIGTERM
+            raise _JobCancelled()
+        module_name, _, function_name = target.partition(":")
+        function = import_module(module_name)
+        for attr in function_name.split("."):
+            function = getattr(function, attr)
+        function(args)
+        cancellable[0] = False
+        outcome = {'state': 'SUCCEEDED'}
+    except _JobCancelled:
+        cancellable[0] = False
+        outcome = {'state': 'CANCELLED'}
+    except BaseException as err:
+        cancellable[0] = False
+        logging.exception("Local job {} failed".format(job))
+        outcome = {'state': 'FAILED', 'errorMessage': repr(err)}
+    finally:
+        if slot is not None:
+            slot.close()
+    _update_state(state_dir, job, endTime=_now(), **outcome)
+
+
+def _acquire_slot(state_dir, job, max_workers):
+    """Blocks until one of the max_workers slot locks is held (released by the OS when the runner exits), or returns
+    None when the job gets cancelled while queued."""
+    slot_dir = os.path.join(state_dir, "slots")
+    os.makedirs(slot_dir, exist_ok=True)
+    while not os.path.exists(_get_cancel_file(state_dir, job)):
+        for i in range(max_workers):
+            slot = open(os.path.join(slot_dir, "{}.lock".format(i)), 'w')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except OSError:
+                slot.close()
+        sleep(SLOT_POLL_INTERVAL)
+    return None
+
+
+def _get_target_path(target):
+    if isinstance(target, str):
+        return target
+    if target.__module__ == '__main__':
+        raise _http_error(400, "Local entry point {} is not importable (defined in __main__)".format(target))
+    return "{}:{}".format(target.__module__, target.__qualname__)
+
+
+def _now():
+    return dt.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _get_state_file(state_dir, job):
+    return os.path.join(state_dir, job + '.json')
+
+
+def _get_pid_file(state_dir, job):
+    return os.path.join(state_dir, job + '.pid')
+
+
+def _get_cancel_file(state_dir, job):
+    return os.path.join(state_dir, job + '.cancel')
+
+
+def _get_log_file(state_dir, job):
+    return os.path.join(state_dir, job + '.log')
+
+
+def _read_state(state_dir, job):
+    with open(_get_state_file(state_dir, job), 'r') as f:
+        return json.load(f)
+
+
+def _write_state(state_dir, job, job_info):
+    state_file = _get_state_file(state_dir, job)
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(job_info, f)
+    os.replace(state_file + '.tmp', state_file)  # atomic: readers never see a partial state
+
+
+def _update_state(state_dir, job, **fields):
+    # Only called by the runner of the job, hence no concurrent read-modify-write of the same file
+    job_info = _read_state(state_dir, job)
+    if job_info['state'] in TERMINAL_STATES:
+        return
+    job_info.update(fields)
+    _write_state(state_dir, job, job_info)
+
+
+def _http_error(status, message):
+    return errors.HttpError(httplib2.Response({'status': status, 'reason': message}),
+                            json.dumps({'error': {'code': status, 'message': message}}).encode('utf-8'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runner of a local AI Platform job (started by LocalJobExecutor)")
+    parser.add_argument("state_dir")
+    parser.add_argument("job")
+    parser.add_argument("target", help="'module:function' entry point")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--args", default="[]", help="JSON list of job args")
+    parsed = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    _run_job(parsed.state_dir, parsed.job, parsed.target, json.loads(parsed.args), parsed.max_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+from gcpaiutils import tracing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Event, Lock
+import logging
+import math
+import os
+
+
+METRICS_PORT_ENV = "GCPAIUTILS_METRICS_PORT"
+METRICS_FILE_ENV = "GCPAIUTILS_METRICS_FILE"
+METRICS_HOST_ENV = "GCPAIUTILS_METRICS_HOST"
+DEFAULT_HOST = "127.0.0.1"  # the endpoint is unauthenticated: loopback only unless explicitly widened
+FLUSH_INTERVAL = 15
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DETECTION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# metrics recorded by the library: name -> (type, help, histogram buckets)
+LIBRARY_METRICS = {
+    'gcpaiutils_mlapi_requests_total':
+        ('counter', "ML API requests by method, project and HTTP status code (code 'error' when no response was "
+                    "received). Requests of a batch are counted individually.", None),
+    'gcpaiutils_mlapi_request_duration_seconds':
+        ('histogram', "ML API round trip latency by method (method 'batch' for batch requests).", LATENCY_BUCKETS),
+    'gcpaiutils_mlapi_retries_total':
+        ('counter', "ML API requests retried by method and reason ('error', or 'quota' for submissions sent to "
+                    "another job target after a 429).", None),
+    'gcpaiutils_gcs_operations_total':
+        ('counter', "Storage operations by operation (download, upload, list_blobs, ...) and status.", None),
+    'gcpaiutils_gcs_operation_duration_seconds':
+        ('histogram', "Storage operation latency by operation.", LATENCY_BUCKETS),
+    'gcpaiutils_gcs_bytes_total':
+        ('counter', "Bytes transferred by storage operation and caller (outermost span, e.g. wrappers.selection).",
+         None),
+    'gcpaiutils_poll_watched_jobs':
+        ('gauge', "Jobs currently watched by poll(), by last known state.", None),
+    'gcpaiutils_poll_detection_seconds':
+        ('histogram', "Time between the end of a job and poll() noticing it, by source (poller daemon or API).",
+         DETECTION_BUCKETS),
+}
+
+_registry = None
+_exporter = None
+_exposition = []
+_lock = Lock()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation=""):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = Lock()
+
+    def samples(self):
+        """:return: list of (sample name, labels dict, value)"""
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, _escape(self.documentation, help_text=True)),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        if value < 0:
+            raise ValueError("Counters can only increase.")
+        key = _get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_get_key(labels)] = value
+
+    def inc(self, value=1, **labels):
+        key = _get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation="", buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = _get_key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            series = self._values[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', dict(key, le=_format_value(bound)), cumulative))
+                samples.append((self.name + '_bucket', dict(key, le='+Inf'), series['count']))
+                samples.append((self.name + '_sum', dict(key), series['sum']))
+                samples.append((self.name + '_count', dict(key), series['count']))
+        return samples
+
+
+class MetricsRegistry:
+    """In-process registry of counters, gauges and histograms, rendered in the Prometheus text exposition format.
+    Metrics are created on first use; the metrics recorded by the library (LIBRARY_METRICS) are declared upfront so
+    that their help text is exposed before any sample is recorded.
+
+       Args:
+           - metrics: dict of metric names as keys and (type, help, buckets) as value, declared at creation
+
+        Main usage:
+           - counter(name) / gauge(name) / histogram(name, buckets=...): returns the metric, created if missing
+           - render(): Prometheus text exposition of every metric
+           - get_sample_value(name, labels): current value of a sample (e.g. in tests or health checks)
+    """
+
+    def __init__(self, metrics=None):
+        self._metrics = {}
+        self._lock = Lock()
+        for name, (metric_type, documentation, buckets) in (metrics or {}).items():
+            self._get(name, metric_type, documentation, buckets)
+
+    def _get(self, name, metric_type, documentation="", buckets=None):
+        with self._lock:
+            if name not in self._metrics:
+                if metric_type == 'counter':
+                    self._metrics[name] = Counter(name, documentation)
+                elif metric_type == 'gauge':
+                    self._metrics[name] = Gauge(name, documentation)
+                elif metric_type == 'histogram':
+                    self._metrics[name] = Histogram(name, documentation, buckets=buckets or LATENCY_BUCKETS)
+                else:
+                    raise ValueError("Unknown metric type: %s" % metric_type)
+            metric = self._metrics[name]
+        if metric.type != metric_type:
+            raise ValueError("Metric %s is a %s, not a %s." % (name, metric.type, metric_type))
+        return metric
+
+    def counter(self, name, documentation=""):
+        return self._get(name, 'counter', documentation)
+
+    def gauge(self, name, documentation=""):
+        return self._get(name, 'gauge', documentation)
+
+    def histogram(self, name, documentation="", buckets=None):
+        return self._get(name, 'histogram', documentation, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() + "\n" for metric in metrics)
+
+    def get_sample_value(self, name, labels=None):
+        """
+        :param name: sample name (histograms expose <name>_bucket, <name>_sum and <name>_count)
+        :param labels: dict of label values
+        :return: sample value, None if the sample does not exist
+        """
+        labels = labels or {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if name.startswith(metric.name):
+                for sample_name, sample_labels, value in metric.samples():
+                    if sample_name == name and sample_labels == labels:
+                        return value
+        return None
+
+
+class MetricsExporter:
+    """Tracing hook (see tracing.add_hook()) deriving storage metrics from 'gcs.*' spans: operation counts, latency
+    and bytes transferred, the latter broken down by the outermost span of the thread (the wrapper or task step that
+    caused the transfer).
+
+       Args:
+           - registry: MetricsRegistry receiving the samples
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        if not span.name.startswith('gcs.'):
+            return
+        operation = span.name[len('gcs.'):]
+        root = span
+        while root.parent is not None:
+            root = root.parent
+        self.registry.counter('gcpaiutils_gcs_operations_total').inc(
+            operation=operation, status='error' if span.error is not None else 'ok')
+        self.registry.histogram('gcpaiutils_gcs_operation_duration_seconds').observe(span.duration,
+                                                                                     operation=operation)
+        if span.bytes:
+            self.registry.counter('gcpaiutils_gcs_bytes_total').inc(
+                span.bytes, operation=operation, caller=root.name if root is not span else '')
+
+    def shutdown(self):
+        pass
+
+
+class MetricsServer:
+    """Serves the Prometheus text exposition of a registry over HTTP (GET /metrics) from a background thread.
+
+       Args:
+           - registry: MetricsRegistry
+           - host: interface to listen on (loopback by default)
+           - port: TCP port, 0 for any free port (see the port attribute once created)
+    """
+
+    def __init__(self, registry, host=DEFAULT_HOST, port=0):
+        self.registry = registry
+        self._httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.registry = registry
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._httpd.serve_forever, name="MetricsServer", daemon=True)
+        self._thread.start()
+        logging.info("Metrics served on http://{}:{}/metrics".format(self.host, self.port))
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class MetricsFileWriter:
+    """Periodically writes the Prometheus text exposition of a registry to a local file (atomically replaced, as
+    expected by the node_exporter textfile collector). A '{pid}' placeholder in the file path gives each process its
+    own file, e.g. for Airflow tasks sharing a worker.
+
+       Args:
+           - registry: MetricsRegistry
+           - file_path: path of the metrics file
+           - interval: interval (in seconds) between two flushes. The file is also flushed when the writer stops.
+    """
+
+    def __init__(self, registry, file_path, interval=FLUSH_INTERVAL):
+        self.registry = registry
+        self.file_path = file_path.format(pid=os.getpid())
+        self.interval = interval
+        self._stopped = Event()
+        self._thread = None
+
+    def flush(self):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.file_path)
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as err:  # metrics must not break the task
+                logging.warning("Unable to write metrics to {}: {}".format(self.file_path, err))
+
+    def start(self):
+        self._thread = Thread(target=self._flush_loop, name="MetricsFileWriter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except OSError as err:
+            logging.warning("Unable to write metrics to {}: {}".format(self.file_path, err))
+
+
+class StateGauge:
+    """Share of a gauge owned by a single watcher (e.g. one poll() call), so that concurrent watchers add up:
+    update() applies the difference with the counts previously reported, clear() withdraws them.
+
+       Args:
+           - name: gauge name
+           - label: name of the label holding the keys of the counts
+    """
+
+    def __init__(self, name, label='state'):
+        self.name = name
+        self.label = label
+        self._registry = None
+        self._counts = {}
+
+    def update(self, counts):
+        """:param counts: dict of label values as keys and count as value"""
+        registry = _registry
+        if registry is not self._registry:  # metrics enabled or disabled meanwhile
+            self.clear()
+            self._registry = registry
+        if registry is None:
+            return
+        gauge = registry.gauge(self.name)
+        for value in set(counts) | set(self._counts):
+            delta = counts.get(value, 0) - self._counts.get(value, 0)
+            if delta:
+                gauge.inc(delta, **{self.label: value})
+        self._counts = dict(counts)
+
+    def clear(self):
+        if self._registry is not None:
+            gauge = self._registry.gauge(self.name)
+            for value, count in self._counts.items():
+                gauge.inc(-count, **{self.label: value})
+        self._counts = {}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        content = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _get_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value, help_text=False):
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value if help_text else value.replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, _escape(str(value))) for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def configure_metrics(port=None, file_path=None, flush_interval=FLUSH_INTERVAL, host=DEFAULT_HOST):
+    """
+    Enables metrics. Samples are kept in an in-process registry, optionally exposed over HTTP in the Prometheus text
+    format and/or periodically flushed to a local file. Calling it again replaces the exposition but keeps the
+    samples recorded so far.
+
+    :param port: TCP port of the /metrics endpoint (None for no endpoint). A port already in use is logged and
+                 skipped, so that several processes of a worker can share the same configuration.
+    :param file_path: path of a metrics file flushed every flush_interval seconds ('{pid}' is replaced by the process
+                      id)
+    :param flush_interval: interval (in seconds) between two flushes of file_path
+    :param host: interface of the /metrics endpoint. Defaults to loopback, since the endpoint is unauthenticated;
+                 pass '0.0.0.0' to let a remote Prometheus scrape it.
+    :return: the active MetricsRegistry
+    """
+    global _registry, _exporter
+    with _lock:
+        _stop_exposition()
+        if _registry is None:
+            _registry = MetricsRegistry(LIBRARY_METRICS)
+            _exporter = MetricsExporter(_registry)
+            tracing.add_hook(_exporter)
+        if port is not None:
+            try:
+                _exposition.append(MetricsServer(_registry, host=host, port=port).start())
+            except OSError as err:
+                logging.warning("Unable to serve metrics on port {}: {}".format(port, err))
+        if file_path is not None:
+            _exposition.append(MetricsFileWriter(_registry, file_path, interval=flush_interval).start())
+        return _registry
+
+
+def disable_metrics():
+    global _registry, _exporter
+    with _lock:
+        _stop_exposition()
+        if _exporter is not None:
+            tracing.remove_hook(_exporter)
+        _registry = None
+        _exporter = None
+
+
+def _stop_exposition():
+    while _exposition:
+        _exposition.pop().stop()
+
+
+def is_enabled():
+    return _registry is not None
+
+
+def get_registry():
+    """:return: the active MetricsRegistry, None when metrics are disabled"""
+    return _registry
+
+
+def inc_counter(name, value=1, **labels):
+    """Increments a counter of the active registry. No-op when metrics are disabled."""
+    registry = _registry
+    if registry is not None:
+        registry.counter(name).inc(value, **labels)
+
+
+def add_gauge(name, value, **labels):
+    """Adds value (possibly negative) to a gauge of the active registry. No-op when metrics are disabled."""
+    registry = _registry
+    if registry is not None:
+        registry.gauge(name).inc(value, **labels)
+
+
+def observe(name, value, **labels):
+    """Records an observation in a histogram of the active registry. No-op when metrics are disabled."""
+    registry = _registry
+    if registry is not None:
+        registry.histogram(name).observe(value, **labels)
+
+
+if os.environ.get(METRICS_PORT_ENV) or os.environ.get(METRICS_FILE_ENV):
+    configure_metrics(port=int(os.environ[METRICS_PORT_ENV]) if os.environ.get(METRICS_PORT_ENV) else None,
+                      file_path=os.environ.get(METRICS_FILE_ENV), host=os.environ.get(METRICS_HOST_ENV, DEFAULT_HOST))
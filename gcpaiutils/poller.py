@@ -0,0 +1,313 @@
+from gcpaiutils.utils import get_deployment_config, build_mlapi_client, get_jobs_info, TERMINAL_STATES, BATCH_SIZE
+from gcpaiutils import tracing, metrics
+from google.oauth2.service_account import Credentials
+from socketserver import StreamRequestHandler
+from threading import Thread, Condition, Event
+from time import time
+import argparse
+import logging
+import socket
+import json
+import os
+
+
+TIME_INTERVAL = 30
+WATCH_TTL = 60*60
+FETCH_TIMEOUT = 10  # seconds a waiter grants the daemon to fetch jobs it did not watch yet
+CLIENT_TIMEOUT_MARGIN = 30  # seconds granted to the daemon on top of the requested wait
+SOCKET_MODE = 0o600  # owner only: statuses of the jobs of every task of the host go through the socket
+
+
+class PollerDaemon:
+    """Per-host job status service. Tasks running on the same worker register the jobs they wait for over a unix
+    socket; the daemon refreshes every distinct job once per time_interval (one batch request per deployment config
+    and batch_size jobs) and wakes up waiters as soon as one of their jobs changes state. API traffic therefore
+    scales with the number of distinct jobs, not with the number of tasks polling them.
+
+    Protocol: one JSON line per connection, {'deployment_config', 'jobs': {job: project_id}, 'known': {job: state},
+    'timeout'}, answered with one JSON line {'jobs': {job: job description}} once every job was fetched and one of
+    them is not in its known state, or when timeout expires ({'op': 'stats'} returns the stats attribute instead).
+    Jobs nobody asked about for ttl seconds are forgotten. The socket is only accessible to the user running the
+    daemon (SOCKET_MODE), who must therefore be the user running the tasks.
+
+       Args:
+           - socket_path: unix socket to listen on (POLLER_SOCKET in the deployment config of clients)
+           - time_interval: interval (in seconds) between two consecutive status sweeps
+           - ttl: time (in seconds) after which unrequested jobs stop being watched
+           - batch_size: number of status requests per batch request
+
+        Main usage:
+           - start() / stop(), or use as a context manager; `python -m gcpaiutils.poller --socket PATH` from a shell
+           - poll() and check_jobs() in wrappers use the daemon when POLLER_SOCKET is set (see get_poller())
+    """
+
+    def __init__(self, socket_path, time_interval=TIME_INTERVAL, ttl=WATCH_TTL, batch_size=BATCH_SIZE):
+        self.socket_path = socket_path
+        self.time_interval = time_interval
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.watches = {}  # (deployment_config, project_id, job) -> {'info': job description or None, 'seen': epoch}
+        self.stats = {'sweeps': 0, 'requests': 0, 'errors': 0, 'waits': 0}
+        self._clients = {}
+        self._cond = Condition()
+        self._wake = Event()
+        self._stopped = Event()
+        self._server = None
+        self._threads = []
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            if PollerClient(self.socket_path).is_alive():
+                raise ValueError("A poller daemon already listens on {}".format(self.socket_path))
+            os.remove(self.socket_path)  # stale socket of a dead daemon
+        from socketserver import ThreadingUnixStreamServer  # POSIX only: imported when a daemon starts
+        self._server = ThreadingUnixStreamServer(self.socket_path, _RequestHandler, bind_and_activate=False)
+        try:
+            self._server.server_bind()
+            os.chmod(self.socket_path, SOCKET_MODE)  # before listening: no connection gets through default permissions
+            self._server.server_activate()
+        except BaseException:
+            self._server.server_close()
+            raise
+        self._server.daemon_threads = True
+        self._server.poller = self
+        self._threads = [Thread(target=self._server.serve_forever, name="PollerDaemon", daemon=True),
+                         Thread(target=self._sweep_loop, name="PollerDaemon.sweep", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        logging.info("Poller daemon listening on {}".format(self.socket_path))
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _get_client(self, deployment_config):
+        if deployment_config not in self._clients:
+            self._clients[deployment_config] = get_status_client(get_deployment_config(deployment_config))
+        return self._clients[deployment_config]
+
+    def _sweep_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception("Poller sweep failed")
+            self._wake.wait(self.time_interval)
+            self._wake.clear()
+
+    def sweep(self):
+        """Refreshes every watched job that is not done yet."""
+        now = time()
+        with self._cond:
+            for key in [key for key, watch in self.watches.items() if now - watch['seen'] > self.ttl]:
+                del self.watches[key]
+            pending = [key for key, watch in self.watches.items()
+                       if watch['info'] is None or watch['info']['state'] not in TERMINAL_STATES]
+        groups = {}
+        for key in pending:
+            groups.setdefault(key[0], []).append(key)
+        with tracing.span('poller.sweep', jobs=len(pending)):
+            for deployment_config, keys in groups.items():
+                job_info = self._fetch(deployment_config, keys)
+                with self._cond:
+                    for key, info in job_info.items():
+                        if key in self.watches:
+                            self.watches[key]['info'] = info
+                    self._cond.notify_all()
+        self.stats['sweeps'] += 1
+
+    def _fetch(self, deployment_config, keys):
+        try:
+            mlapi = self._get_client(deployment_config)
+        except Exception as err:
+            logging.error("Unable to build status client for {}: {}".format(deployment_config, err))
+            self.stats['errors'] += 1
+            return {}
+        self.stats['requests'] += len(keys)
+        job_names = {_get_job_name(key): key for key in keys}
+        job_info, job_errors = get_jobs_info(mlapi, list(job_names), batch_size=self.batch_size)
+        for name, err in job_errors.items():  # transient: retried at next sweep
+            logging.warning("Unable to get job {}: {}".format(job_names[name][2], err))
+        self.stats['errors'] += len(job_errors)
+        return {job_names[name]: info for name, info in job_info.items()}
+
+    def wait(self, deployment_config, jobs, known=None, timeout=0):
+        """
+        :param deployment_config: YAML file containing all deployment variables
+        :param jobs: dict containing job names as keys and GCP project id as value
+        :param known: dict containing job names as keys and the state last seen by the caller as value
+        :param timeout: maximum time (in seconds) to wait for a state change (at least FETCH_TIMEOUT for jobs that were
+                        not watched yet)
+        :return: dict containing job names as keys and job descriptions as value (jobs fetched so far)
+        """
+        known = known or {}
+        deadline = time() + timeout
+        keys = {job: (deployment_config, project_id, job) for job, project_id in jobs.items()}
+        with self._cond:
+            self.stats['waits'] += 1
+            new_jobs = False
+            for key in keys.values():
+                watch = self.watches.setdefault(key, {'info': None, 'seen': 0})
+                watch['seen'] = time()
+                new_jobs = new_jobs or watch['info'] is None
+        if new_jobs:
+            self._wake.set()  # fetch new jobs now rather than at the next sweep
+            deadline = max(deadline, time() + FETCH_TIMEOUT)
+
+        with self._cond:
+            while True:
+                job_info = {job: self.watches[key]['info'] for job, key in keys.items()
+                            if key in self.watches and self.watches[key]['info'] is not None}
+                changed = any(info['state'] != known.get(job) for job, info in job_info.items())
+                remaining = deadline - time()
+                if (len(job_info) == len(keys) and changed) or remaining <= 0 or self._stopped.is_set():
+                    return job_info
+                self._cond.wait(remaining)
+
+
+class _RequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        poller = self.server.poller
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            if request.get('op') == 'stats':
+                response = {'stats': dict(poller.stats), 'watches': len(poller.watches)}
+            else:
+                response = {'jobs': poller.wait(request['deployment_config'], request['jobs'],
+                                                known=request.get('known'), timeout=float(request.get('timeout', 0)))}
+        except Exception as err:
+            response = {'error': repr(err)}
+        self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+
+
+class PollerClient:
+    """Client of the per-host PollerDaemon.
+
+       Args:
+           - socket_path: unix socket the daemon listens on
+
+        Main usage:
+           - get_job_info(deployment_config, projects, known, timeout): returns job descriptions, waiting up to
+             timeout for one of the jobs to leave its known state. Raises OSError when the daemon is unreachable.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def _call(self, request, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            with sock.makefile('rb') as f:
+                line = f.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise ConnectionError("Poller daemon closed the connection.")
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise ValueError("Poller daemon error: {}".format(response['error']))
+        return response
+
+    def is_alive(self):
+        try:
+            self.get_stats()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def get_stats(self):
+        return self._call({'op': 'stats'}, timeout=CLIENT_TIMEOUT_MARGIN)
+
+    def get_job_info(self, deployment_config, projects, known=None, timeout=0):
+        """
+        :param deployment_config: YAML file containing all deployment variables
+        :param projects: dict containing job names as keys and GCP project id as value
+        :param known: dict containing job names as keys and the state last seen by the caller as value
+        :param timeout: maximum time (in seconds) to wait for a state change (0 returns current descriptions)
+        :return: dict containing job names as keys and job descriptions as value. Jobs the daemon could not fetch yet
+                 are missing.
+        """
+        request = {'deployment_config': os.path.abspath(deployment_config), 'jobs': projects, 'known': known or {},
+                   'timeout': timeout}
+        with tracing.span('poller.get_job_info', jobs=len(projects)):
+            return self._call(request, timeout=timeout + CLIENT_TIMEOUT_MARGIN)['jobs']
+
+
+def get_status_client(_globals):
+    """
+    :param _globals: deployment configuration dict
+    :return: ML API discovery client (AI Platform service account credentials), or the local job executor with
+             JOB_EXECUTOR: 'local'
+    """
+    if _globals.get('JOB_EXECUTOR') == 'local':
+        from gcpaiutils.local import get_local_executor  # POSIX only: imported when selected
+        return get_local_executor(_globals)
+    try:
+        credentials = Credentials.from_service_account_file(_globals["AI_PLATFORM_SA"])
+    except (KeyError, OSError, ValueError):
+        credentials = None
+    return build_mlapi_client(_globals, credentials)
+
+
+def get_poller(_globals):
+    """
+    :param _globals: deployment configuration dict
+    :return: PollerClient if POLLER_SOCKET is set in the deployment config and the daemon socket exists, None otherwise
+    """
+    socket_path = _globals.get('POLLER_SOCKET')
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    return PollerClient(socket_path)
+
+
+def _get_job_name(key):
+    return 'projects/{}/jobs/{}'.format(key[1], key[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-host job status poller shared by Airflow tasks.")
+    parser.add_argument("--socket", required=True, help="unix socket path (POLLER_SOCKET in the deployment config)")
+    parser.add_argument("--interval", type=float, default=TIME_INTERVAL, help="seconds between status sweeps")
+    parser.add_argument("--ttl", type=float, default=WATCH_TTL, help="seconds before unrequested jobs are dropped")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default=metrics.DEFAULT_HOST, help="interface of the metrics endpoint")
+    parser.add_argument("--metrics-file", default=None, help="periodically write Prometheus metrics to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if args.metrics_port is not None or args.metrics_file is not None:
+        metrics.configure_metrics(port=args.metrics_port, file_path=args.metrics_file, host=args.metrics_host)
+    daemon = PollerDaemon(args.socket, time_interval=args.interval, ttl=args.ttl, batch_size=args.batch_size)
+    daemon.start()
+    try:
+        daemon._stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        metrics.disable_metrics()
+        print(json.dumps(daemon.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,8 +16,8 @@ class PostprocessJobHandler(JobHandler):
         Main usage:
            - submit_job(): returns the object. Sends the job request (async) with the specified parameters.
     """
-    def __init__(self, deployment_config, job_executor=None):
-        super().__init__(deployment_config, job_executor)
+    def __init__(self, deployment_config, job_executor=None, project_id=None):
+        super().__init__(deployment_config, job_executor, project_id)
 
     def translate_job_specs(self, job_spec=None):
         if job_spec is None:
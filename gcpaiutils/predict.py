@@ -7,6 +7,8 @@ JOB_SPECS_DEFAULT_ARGS = ['modelFile', 'scoreDir', 'outputDir', 'useProba']
 
 class ScoreJobHandler(JobHandler):
     """Builds train request for GCP AI Platform. Requires job specification as produced by JobSpecHandler.
+    Packed jobs (modelFile and outputDir given as lists) score several models on a single read of scoreDir; lists are
+    passed to the atom as comma-separated values, i-th output dir belonging to i-th model.
 
        Args:
            - deployment_config: string specifying deployment configuration YAML file absolute path
@@ -16,8 +18,8 @@ class ScoreJobHandler(JobHandler):
         Main usage:
            - submit_job(): returns the object. Sends the job request (async) with the specified parameters.
     """
-    def __init__(self, deployment_config, job_executor=None):
-        super().__init__(deployment_config, job_executor)
+    def __init__(self, deployment_config, job_executor=None, project_id=None):
+        super().__init__(deployment_config, job_executor, project_id)
 
     def translate_job_specs(self, job_spec=None):
         if job_spec is None:
@@ -25,10 +27,16 @@ class ScoreJobHandler(JobHandler):
 
         # Map job_spec information to docker entrypoint kwargs
         job_spec['trainingInput']['masterConfig'] = {'imageUri': job_spec['trainingInput'].pop('imageUri')}
+        model_file = job_spec['trainingInput'].pop('modelFile')
+        output_dir = job_spec['trainingInput'].pop('outputDir')
+        if isinstance(model_file, list):
+            if not isinstance(output_dir, list) or len(output_dir) != len(model_file):
+                raise ValueError("Packed score jobs require one output dir per model file.")
+            model_file, output_dir = ','.join(model_file), ','.join(output_dir)
         job_spec['trainingInput']['args'] = []
-        job_spec['trainingInput']['args'] += ['--model-file', job_spec['trainingInput'].pop('modelFile')]
+        job_spec['trainingInput']['args'] += ['--model-file', model_file]
         job_spec['trainingInput']['args'] += ['--score-dir', job_spec['trainingInput'].pop('scoreDir')]
-        job_spec['trainingInput']['args'] += ['--output-dir', job_spec['trainingInput'].pop('outputDir')]
+        job_spec['trainingInput']['args'] += ['--output-dir', output_dir]
         job_spec['trainingInput']['args'] += ['--use-proba', job_spec['trainingInput'].pop('useProba')]
 
         return job_spec
@@ -40,7 +48,8 @@ class ScoreJobSpecHandler(JobSpecHandler):
 
     Args:
         - project_name: GCP project name
-        - train_inputs: a dict specifying ()
+        - train_inputs: a dict specifying (). modelFile and outputDir may be lists to pack models sharing the
+          scoring image of algorithm into one job.
 
     Main usage:
         - create_job_specs(): returns the object with the job_specs property properly configured for a GCP AI
@@ -0,0 +1,150 @@
+from gcpaiutils.utils import get_user, get_problem, get_version
+from gcpaiutils.scratch import get_scratch_root
+from gcpaiutils import tracing
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree
+from time import time
+import logging
+import os
+
+
+COMPLETE_MARKER = "_COMPLETE"
+INFO_FILE_PREFIXES = ("info", "stratified_info")
+STAGING_TTL = 24*60*60
+
+
+class InfoPrefetcher:
+    """Downloads info files (info*, stratified_info*) of train jobs into a local staging area as soon as each job
+    succeeds, so that selection finds them already local. Meant to be passed as on_complete callback of poll().
+
+    Files of a job land in <staging_dir>/<job name without 'train_'>/; a marker file is written once all of them are
+    there, so that readers never pick up a partial download. Jobs without any info file get no marker: selection
+    then looks for their files in GCS.
+
+       Args:
+           - gcs_client: google.cloud.storage client
+           - bucket_name: model bucket name
+           - model_prefix: folder holding trained models (one sub-folder per job), see get_model_prefix()
+           - staging_dir: local staging directory
+           - max_workers: number of concurrent downloads
+
+        Main usage:
+           - on_complete(job, effective_job, state): schedules the download of a finished job
+           - wait(): blocks until scheduled downloads are done. Returns list of prefetched jobs.
+           - cleanup(): removes the staged files of scheduled jobs (e.g. when the train task fails)
+    """
+
+    def __init__(self, gcs_client, bucket_name, model_prefix, staging_dir, max_workers=4):
+        self.gcs_client = gcs_client
+        self.bucket_name = bucket_name
+        self.model_prefix = model_prefix
+        self.staging_dir = staging_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+
+    def on_complete(self, job, effective_job, state):
+        if state == 'SUCCEEDED' and effective_job not in self._futures:
+            self._futures[effective_job] = self._executor.submit(self._download, effective_job)
+
+    def _download(self, job):
+        job_dir_name = job.replace("train_", "")
+        job_dir = os.path.join(self.staging_dir, job_dir_name)
+        prefix = self.model_prefix + job_dir_name + "/"
+        with tracing.span('gcs.list_blobs', prefix=prefix) as sp:
+            blobs = [blob for blob in self.gcs_client.list_blobs(bucket_or_name=self.bucket_name, prefix=prefix)
+                     if blob.name.split("/")[-1].startswith(INFO_FILE_PREFIXES)]
+            sp.add_requests()
+        if not blobs:
+            raise ValueError("No info files found under gs://{}/{}".format(self.bucket_name, prefix))
+        os.makedirs(job_dir, exist_ok=True)
+        for blob in blobs:
+            with tracing.span('gcs.download', blob=blob.name) as sp:
+                blob.download_to_filename(os.path.join(job_dir, blob.name.split("/")[-1]), client=self.gcs_client)
+                sp.add_requests()
+                sp.add_bytes(blob.size)
+        open(os.path.join(job_dir, COMPLETE_MARKER), 'w').close()
+        return job
+
+    def wait(self):
+        prefetched_jobs = []
+        for job, future in self._futures.items():
+            try:
+                prefetched_jobs.append(future.result())
+            except Exception as err:  # selection downloads whatever is missing
+                logging.warning("Unable to prefetch info files of {}: {}".format(job, err))
+        self._executor.shutdown(wait=True)
+        return prefetched_jobs
+
+    def cleanup(self):
+        for job in self._futures:
+            rmtree(os.path.join(self.staging_dir, job.replace("train_", "")), ignore_errors=True)
+
+
+def get_model_prefix(kwargs):
+    """
+    :param kwargs: Airflow context
+    :return: folder holding the info files of trained models (one sub-folder per job), read by prefetch and selection
+    """
+    return os.path.join(get_user(kwargs), get_problem(kwargs), get_version(kwargs), "MODELS", "")
+
+
+def get_staging_root(_globals):
+    return _globals.get('STAGING_DIR', os.path.join(get_scratch_root(_globals), "gcpaiutils_staging"))
+
+
+def get_staging_dir(_globals, kwargs):
+    """
+    Returns the local staging directory shared by the tasks of a DAG run. Lives under STAGING_DIR (deployment config,
+    defaults to the scratch root, see scratch.get_scratch_root()). Only tasks running on the same host benefit from
+    staged files. Selection removes the directory once done (see remove_staging_dir()).
+
+    :param _globals: deployment configuration dict
+    :param kwargs: Airflow context
+    :return: local directory path, None outside an Airflow DAG run (prefetching disabled)
+    """
+    try:
+        return os.path.join(get_staging_root(_globals), kwargs['task_instance'].dag_id, kwargs['run_id'])
+    except (KeyError, AttributeError, TypeError):
+        return None
+
+
+def remove_staging_dir(staging_dir):
+    if staging_dir is not None:
+        rmtree(staging_dir, ignore_errors=True)
+
+
+def prune_staging_dirs(_globals, ttl=STAGING_TTL):
+    """
+    Removes staging directories of DAG runs older than ttl seconds, left behind when selection ran on another host
+    or never ran.
+
+    :param _globals: deployment configuration dict
+    :param ttl: maximum age (in seconds) of a staging directory. Defaults to STAGING_TTL (deployment config) or 1 day.
+    """
+    root_dir = get_staging_root(_globals)
+    ttl = _globals.get('STAGING_TTL', ttl)
+    if not os.path.isdir(root_dir):
+        return
+    for dag_id in os.listdir(root_dir):
+        dag_dir = os.path.join(root_dir, dag_id)
+        for run_id in os.listdir(dag_dir) if os.path.isdir(dag_dir) else []:
+            run_dir = os.path.join(dag_dir, run_id)
+            try:
+                if time() - os.path.getmtime(run_dir) > ttl:
+                    rmtree(run_dir, ignore_errors=True)
+            except OSError:  # removed meanwhile
+                pass
+
+
+def get_staged_files(staging_dir, job):
+    """
+    :param staging_dir: local staging directory (None when prefetching is disabled)
+    :param job: train job name
+    :return: list of paths of the job's prefetched info files, None if the job was not (fully) prefetched
+    """
+    if staging_dir is None:
+        return None
+    job_dir = os.path.join(staging_dir, job.replace("train_", ""))
+    if not os.path.exists(os.path.join(job_dir, COMPLETE_MARKER)):
+        return None
+    return [os.path.join(job_dir, f) for f in sorted(os.listdir(job_dir)) if f != COMPLETE_MARKER]
@@ -0,0 +1,193 @@
+from gcpaiutils.utils import build_mlapi_client, get_gcs_credentials
+from gcpaiutils import tracing
+from threading import Lock
+import logging
+import json
+
+
+ROUTING_STRATEGIES = ["round_robin", "least_loaded", "quota_aware"]
+ACTIVE_STATES = ["QUEUED", "PREPARING", "RUNNING"]
+_ROUTERS = {}
+_ROUTERS_LOCK = Lock()
+
+
+class JobRouter:
+    """Spreads jobs across several region/project targets, so that burst submissions are not bound to the quota of a
+    single region. Remembers the target of every job it routed (or was told about), so that status requests and
+    cancellations reach the right project. Models, data, outputs and container images keep being resolved from the
+    home project and buckets of the deployment config: only the jobs API project and the job region change.
+
+    Strategies:
+        - round_robin: smooth weighted round-robin over targets
+        - least_loaded: target with the fewest active jobs per unit of weight. Active jobs are counted once through the
+          jobs API, then tracked locally.
+        - quota_aware: least loaded target among those below their max_jobs (concurrent jobs quota); least loaded
+          target overall once every target is full
+
+    Submissions rejected for quota (429 RESOURCE_EXHAUSTED) are retried on another target whatever the strategy.
+
+       Args:
+           - targets: list of dicts with keys project_id, region and optionally weight (default 1) and max_jobs. A
+                      single target may omit region (jobs keep the region of their specification).
+           - strategy: one of ROUTING_STRATEGIES
+           - mlapi: ML API discovery client used to count active jobs (least_loaded and quota_aware strategies)
+
+        Main usage:
+           - choose(exclude): returns the target of the next job
+           - assign(job, target) / get_project(job): records and resolves the project of a job
+           - exhaust(target): takes a target out of rotation until its jobs are polled again
+           - get_job_router(_globals) builds the router of a deployment config (JOB_TARGETS, JOB_ROUTING)
+    """
+
+    def __init__(self, targets, strategy="round_robin", mlapi=None):
+        if not targets:
+            raise ValueError("Must specify at least one job target.")
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError("Unknown routing strategy: %s. Must be one of %s." % (strategy, ROUTING_STRATEGIES))
+        self.targets = [dict(target, region=target.get('region'), weight=target.get('weight', 1))
+                        for target in targets]
+        for target in self.targets:
+            if not target.get('project_id') or (len(targets) > 1 and not target.get('region')):
+                raise ValueError("Job targets require project_id and region: %s" % target)
+            if target['weight'] <= 0:
+                raise ValueError("Job target weight must be positive: %s" % target)
+        self.strategy = strategy
+        self.mlapi = mlapi
+        self.projects = {}
+        self._targets = {}  # job -> (project_id, region) key of the target it counts towards
+        self._current_weights = [0] * len(self.targets)
+        self._load = None
+        self._exhausted = set()
+        self._lock = Lock()
+
+    @property
+    def is_routed(self):
+        return len(self.targets) > 1
+
+    def _key(self, target):
+        return target['project_id'], target['region']
+
+    def _count_active_jobs(self, target):
+        if self.mlapi is None:
+            return 0
+        count = 0
+        with tracing.span('mlapi.jobs.list', project_id=target['project_id']) as sp:
+            for state in ACTIVE_STATES:
+                request = self.mlapi.projects().jobs().list(parent='projects/' + target['project_id'],
+                                                            filter='state={}'.format(state))
+                while request is not None:
+                    response = request.execute()
+                    sp.add_requests()
+                    count += sum(1 for job in response.get('jobs', [])
+                                 if job.get('trainingInput', {}).get('region', target['region']) == target['region'])
+                    request = self.mlapi.projects().jobs().list_next(request, response)
+        return count
+
+    def _get_load(self):
+        if self._load is None:
+            self._load = {}
+            for target in self.targets:
+                try:
+                    self._load[self._key(target)] = self._count_active_jobs(target)
+                except Exception as err:  # routing must not prevent submission
+                    logging.warning("Unable to count active jobs of {}: {}".format(self._key(target), err))
+                    self._load[self._key(target)] = 0
+        return self._load
+
+    def choose(self, exclude=None):
+        """
+        :param exclude: list of targets not to choose (e.g. targets that just rejected the job)
+        :return: target dict, None when every target is excluded
+        """
+        excluded = set(self._key(target) for target in exclude or [])
+        with self._lock:
+            candidates = [index for index, target in enumerate(self.targets) if self._key(target) not in excluded]
+            if not candidates:
+                return None
+            available = [index for index in candidates if self._key(self.targets[index]) not in self._exhausted]
+            candidates = available or candidates
+
+            if self.strategy == "round_robin":
+                total_weight = sum(self.targets[index]['weight'] for index in candidates)
+                for index in candidates:
+                    self._current_weights[index] += self.targets[index]['weight']
+                chosen = max(candidates, key=lambda index: self._current_weights[index])
+                self._current_weights[chosen] -= total_weight
+                return dict(self.targets[chosen])
+
+            load = self._get_load()
+            if self.strategy == "quota_aware":
+                below_quota = [index for index in candidates if self.targets[index].get('max_jobs') is None or
+                               load[self._key(self.targets[index])] < self.targets[index]['max_jobs']]
+                if not below_quota:
+                    logging.warning("Every job target is at its quota, jobs will queue.")
+                candidates = below_quota or candidates
+            chosen = min(candidates, key=lambda index: load[self._key(self.targets[index])] /
+                         self.targets[index]['weight'])
+            return dict(self.targets[chosen])
+
+    def assign(self, job, target):
+        """Records that job was submitted to target (counts towards the target's load)."""
+        with self._lock:
+            if job not in self.projects:
+                self._targets[job] = self._key(target)
+                if self._load is not None and self._key(target) in self._load:
+                    self._load[self._key(target)] += 1
+            self.projects[job] = target['project_id']
+
+    def register(self, job, project_id):
+        """Records the project of a job submitted elsewhere (e.g. by a previous task). Such jobs do not count towards
+        the load of any target."""
+        if project_id:
+            with self._lock:
+                self.projects.setdefault(job, project_id)
+
+    def release(self, job):
+        """Stops counting a finished job towards its target's load."""
+        with self._lock:
+            key = self._targets.pop(job, None)
+            if key is None:
+                return
+            if self._load is not None and key in self._load:
+                self._load[key] = max(self._load[key] - 1, 0)
+            self._exhausted.discard(key)
+
+    def exhaust(self, target):
+        with self._lock:
+            self._exhausted.add(self._key(target))
+        logging.warning("Job target out of quota: {}".format(self._key(target)))
+
+    def get_project(self, job, default=None):
+        return self.projects.get(job, default)
+
+
+def get_job_targets(_globals):
+    """
+    :param _globals: deployment configuration dict
+    :return: list of job targets. JOB_TARGETS in the deployment config, or the single PROJECT_ID / region target.
+    """
+    targets = _globals.get('JOB_TARGETS')
+    if not targets:
+        return [{'project_id': _globals['PROJECT_ID'], 'region': _globals.get('region'), 'weight': 1}]
+    return [dict(target, project_id=target.get('project_id', _globals['PROJECT_ID'])) for target in targets]
+
+
+def get_job_router(_globals):
+    """
+    Returns the job router of the deployment config: targets from JOB_TARGETS (list of dicts with project_id, region,
+    weight and max_jobs), strategy from JOB_ROUTING (default 'round_robin'). Routers are shared within a process, so
+    that polling finds the project of jobs submitted by any handler.
+
+    :param _globals: deployment configuration dict
+    :return: JobRouter
+    """
+    targets = get_job_targets(_globals)
+    strategy = _globals.get('JOB_ROUTING', 'round_robin')
+    key = (json.dumps(targets, sort_keys=True), strategy)
+    with _ROUTERS_LOCK:
+        if key not in _ROUTERS:
+            mlapi = None
+            if len(targets) > 1 and strategy != 'round_robin' and _globals.get('JOB_EXECUTOR', 'mlapi') == 'mlapi':
+                mlapi = build_mlapi_client(_globals, get_gcs_credentials(_globals))
+            _ROUTERS[key] = JobRouter(targets, strategy=strategy, mlapi=mlapi)
+        return _ROUTERS[key]
@@ -0,0 +1,190 @@
+from tempfile import mkdtemp, gettempdir
+from shutil import rmtree
+from threading import Lock
+import os
+
+
+SHM_DIR = "/dev/shm"
+
+
+class ScratchQuotaError(ValueError):
+    """Raised when a scratch workspace grows beyond its quota."""
+
+
+class ScratchSpace:
+    """Scratch workspace for the local files of a task (downloaded metadata, selectors, info files, status files).
+    Lives under a fast local root (tmpfs or local SSD) rather than the working directory, which on Airflow workers is
+    often the network-mounted DAG folder, and is removed when the context exits, whether the task succeeded or not.
+
+    In-memory workspaces keep small artifacts in a dict and only spill to disk when a caller asks for a real path
+    (e.g. to hand a directory to a selector).
+
+       Args:
+           - root: parent directory of the workspace (see get_scratch_root())
+           - quota: maximum size (in bytes) of the workspace content, None for no limit. Raises ScratchQuotaError.
+           - in_memory: keep artifacts in memory instead of files
+
+        Main usage:
+           - with get_scratch_space(_globals) as scratch: ... (see get_scratch_space())
+           - download(blob, name, client) / upload(blob, name, client): transfers between storage and workspace
+           - read(name) / write(name, data): workspace content
+           - path(*parts): local path inside the workspace (parent directories created); check_quota() after writing
+             files through it
+    """
+
+    def __init__(self, root=None, quota=None, in_memory=False):
+        self.root = root or get_scratch_root()
+        self.quota = quota
+        self.in_memory = in_memory
+        self.directory = None
+        self._files = {}
+        self._sizes = {}
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def cleanup(self):
+        with self._lock:
+            self._files = {}
+            self._sizes = {}
+            if self.directory is not None:
+                rmtree(self.directory, ignore_errors=True)
+                self.directory = None
+
+    @property
+    def size(self):
+        return sum(self._sizes.values())
+
+    def _get_directory(self):
+        with self._lock:
+            if self.directory is None:
+                os.makedirs(self.root, exist_ok=True)
+                self.directory = mkdtemp(prefix="gcpaiutils_", dir=self.root)
+                for name, data in self._files.items():  # spill in-memory artifacts
+                    self._write_file(name, data)
+                self._files = {}
+            return self.directory
+
+    def _write_file(self, name, data):
+        file_path = os.path.join(self.directory, *name.split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+
+    def _reserve(self, name, size):
+        with self._lock:
+            if self.quota is not None and self.size - self._sizes.get(name, 0) + size > self.quota:
+                raise ScratchQuotaError("Scratch quota of {} bytes exceeded writing {} ({} bytes, {} bytes used)"
+                                        .format(self.quota, name, size, self.size))
+            self._sizes[name] = size
+
+    def path(self, *parts):
+        """
+        :param parts: path components relative to the workspace (none for the workspace directory itself)
+        :return: local path. Files written there count towards the quota at the next check_quota().
+        """
+        directory = self._get_directory()
+        file_path = os.path.join(directory, *parts)
+        os.makedirs(os.path.dirname(file_path) if parts else file_path, exist_ok=True)
+        return file_path
+
+    def check_quota(self):
+        """Accounts for files written through path(). Raises ScratchQuotaError beyond quota."""
+        if self.directory is None:
+            return
+        sizes = {}
+        for dir_path, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                sizes[os.path.relpath(file_path, self.directory).replace(os.sep, "/")] = os.path.getsize(file_path)
+        with self._lock:
+            self._sizes = sizes
+        if self.quota is not None and self.size > self.quota:
+            raise ScratchQuotaError("Scratch quota of {} bytes exceeded ({} bytes used)".format(self.quota, self.size))
+
+    def write(self, name, data):
+        """
+        :param name: artifact name ('/' separated, e.g. 'strategy/selection.json')
+        :param data: bytes or str
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._reserve(name, len(data))
+        if self.in_memory and self.directory is None:
+            with self._lock:
+                self._files[name] = bytes(data)
+        else:
+            self._get_directory()
+            self._write_file(name, data)
+
+    def read(self, name):
+        with self._lock:
+            if name in self._files:
+                return self._files[name]
+        if self.directory is None:
+            raise FileNotFoundError("No such scratch artifact: {}".format(name))
+        with open(os.path.join(self.directory, *name.split("/")), 'rb') as f:
+            return f.read()
+
+    def download(self, blob, name, client=None):
+        """
+        Downloads a storage blob into the workspace.
+
+        :param blob: google.cloud.storage blob (or backends.Blob)
+        :param name: artifact name
+        :param client: storage client
+        :return: number of bytes downloaded
+        """
+        if blob.size is not None:
+            self._reserve(name, blob.size)  # fail before transferring anything
+        if self.in_memory and self.directory is None:
+            data = blob.download_as_bytes(client=client)
+            self.write(name, data)
+            return len(data)
+        file_path = self.path(*name.split("/"))
+        blob.download_to_filename(file_path, client=client)
+        size = os.path.getsize(file_path)
+        self._reserve(name, size)
+        return size
+
+    def upload(self, blob, name, client=None, content_type=None):
+        """
+        Uploads a workspace artifact to a storage blob.
+
+        :return: number of bytes uploaded
+        """
+        data = self.read(name)
+        blob.upload_from_string(data, content_type=content_type, client=client)
+        return len(data)
+
+
+def get_scratch_root(_globals=None):
+    """
+    :param _globals: deployment configuration dict
+    :return: SCRATCH_ROOT of the deployment config if set, otherwise tmpfs (/dev/shm) when writable, otherwise the
+             system temporary directory (TMPDIR)
+    """
+    if _globals and _globals.get('SCRATCH_ROOT'):
+        return _globals['SCRATCH_ROOT']
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return gettempdir()
+
+
+def get_scratch_space(_globals, in_memory=None, quota=None):
+    """
+    Returns a scratch workspace configured by the deployment config: SCRATCH_ROOT (see get_scratch_root()),
+    SCRATCH_QUOTA (bytes per workspace) and SCRATCH_IN_MEMORY. Use as a context manager.
+
+    :param _globals: deployment configuration dict
+    :param in_memory: keep artifacts in memory (small artifacts). Defaults to SCRATCH_IN_MEMORY, or False.
+    :param quota: overrides SCRATCH_QUOTA
+    :return: ScratchSpace
+    """
+    return ScratchSpace(root=get_scratch_root(_globals),
+                        quota=quota if quota is not None else _globals.get('SCRATCH_QUOTA'),
+                        in_memory=in_memory if in_memory is not None else _globals.get('SCRATCH_IN_MEMORY', False))
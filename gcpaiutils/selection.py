@@ -0,0 +1,174 @@
+from gcpaiutils.utils import get_model_path_from_info_path
+from gcpaiutils import tracing
+from pandas import read_csv
+from io import BytesIO
+from inspect import signature
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pickle
+import json
+import os
+
+
+INFO_KINDS = ["info", "stratified_info"]
+
+
+class SelectionError(ValueError):
+    """Raised when a selection strategy fails, whether it ran in the current process or in a worker process. The
+    selector exception is chained (__cause__).
+
+       Args:
+           - message: error message
+           - strategy: name of the failed strategy
+    """
+
+    def __init__(self, message, strategy=None):
+        super().__init__(message)
+        self.strategy = strategy
+
+
+class InfoDataset:
+    """In-memory view of the info files (info*, stratified_info*) of trained models. Files are parsed once and shared
+    by every selection strategy. Model ids are model paths as returned by get_model_path_from_info_path().
+
+       Args:
+           - files: dict of flat file names ('<job>_<info file name>', as found in selection dirs) as keys and raw
+                    file content (bytes) as value. JSON and CSV files are parsed.
+           - allow_pickle: also unpickle .pkl/.pickle files. Unpickling runs arbitrary code from the bucket: only
+                           enable for buckets whose writers are trusted (INFO_ALLOW_PICKLE in the deployment config).
+                           Otherwise these files are kept as raw bytes.
+
+        Main usage:
+           - model_ids: sorted list of model ids
+           - get(model_id, kind): parsed content of the model's info file (kind is 'info' or 'stratified_info')
+           - columns(kind): dict of field name as keys and array of field values (aligned with model_ids) as value.
+             Only scalar fields of dict-like info files are included.
+           - file_names(model_id): flat file names of a model
+           - materialize(directory): writes files back to directory (compatibility with selectors reading model_dir)
+    """
+
+    def __init__(self, files, allow_pickle=False):
+        self._files = files
+        self._content = {kind: {} for kind in INFO_KINDS}
+        self._names = {}
+        for name in sorted(files):
+            model_id = get_model_path_from_info_path(name)
+            kind = "stratified_info" if "stratified_info" in name else "info"
+            self._content[kind][model_id] = _parse_info_file(name, files[name], allow_pickle=allow_pickle)
+            self._names.setdefault(model_id, []).append(name)
+        self.model_ids = sorted(self._names)
+        self._columns = {}
+
+    def get(self, model_id, kind="info"):
+        return self._content[kind].get(model_id)
+
+    def file_names(self, model_id):
+        return self._names[model_id]
+
+    def columns(self, kind="info"):
+        if kind not in self._columns:
+            fields = []
+            for model_id in self.model_ids:
+                content = self._content[kind].get(model_id)
+                if isinstance(content, dict):
+                    fields += [key for key, value in content.items() if _is_scalar(value) and key not in fields]
+            self._columns[kind] = {field: np.asarray([_get_field(self._content[kind].get(model_id), field)
+                                                      for model_id in self.model_ids]) for field in fields}
+        return self._columns[kind]
+
+    def materialize(self, directory):
+        for name, data in self._files.items():
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+        return directory
+
+
+def _parse_info_file(name, data, allow_pickle=False):
+    extension = os.path.splitext(name)[1].lower()
+    if extension == ".json":
+        return json.loads(data.decode('utf-8'))
+    if extension == ".csv":
+        return read_csv(BytesIO(data))
+    if extension in [".pkl", ".pickle"] and allow_pickle:
+        return pickle.loads(data)
+    return data
+
+
+def _is_scalar(value):
+    return value is None or isinstance(value, (int, float, str, bool))
+
+
+def _get_field(content, field):
+    if isinstance(content, dict) and _is_scalar(content.get(field)):
+        return content.get(field)
+    return None
+
+
+def accepts_info_dataset(selector_class):
+    """
+    :param selector_class: BaseSelector subclass
+    :return: True if the selector can be given a shared InfoDataset (info_dataset constructor argument)
+    """
+    try:
+        return 'info_dataset' in signature(selector_class).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def run_selectors(deployment_config, selector_class_dict, info_dataset, info_dir, evaluation_metric, root_dest_uri,
+                  max_workers=1):
+    """
+    Runs every selection strategy on the same trained models. Strategies are CPU-bound and independent, so they can
+    run concurrently in a process pool (selector classes must then be importable, i.e. defined at module level).
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param selector_class_dict: dict of customized BaseSelector object. Dict keys are strategy names.
+    :param info_dataset: InfoDataset, passed to selectors accepting an info_dataset argument
+    :param info_dir: directory holding info files, passed as model_dir. Must be materialized (see
+                     InfoDataset.materialize()) when any selector does not accept info_dataset.
+    :param evaluation_metric: evaluation metric
+    :param root_dest_uri: URI under which each strategy writes its selection (one folder per strategy)
+    :param max_workers: number of processes. 1 runs strategies sequentially in the current process. Either way, a
+                        failed strategy raises SelectionError naming it (first failed strategy in selector_class_dict
+                        order when pooled).
+    :return: dict of strategy names as keys and selected info files as value, in selector_class_dict order
+    """
+    tasks = []
+    for key, d in selector_class_dict.items():
+        if 'kwargs' not in d.keys():
+            d['kwargs'] = {}
+        tasks.append((key, d['selector'], deployment_config, info_dataset if accepts_info_dataset(d['selector'])
+                      else None, info_dir, evaluation_metric, root_dest_uri + key + "/",  # dict key is strategy name
+                      d['validation_schema'], d['kwargs']))
+
+    selected_info = {}
+    if max_workers is None or max_workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            with tracing.span('selection.select', strategy=task[0]):
+                try:
+                    selected_info[task[0]] = _run_selector(*task)
+                except Exception as err:
+                    raise _selection_error(task[0], err) from err
+        return selected_info
+
+    with tracing.span('selection.select_parallel', strategies=len(tasks), workers=max_workers):
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+            futures = [executor.submit(_run_selector, *task) for task in tasks]
+            for task, future in zip(tasks, futures):  # submission order: deterministic result and error order
+                try:
+                    selected_info[task[0]] = future.result()
+                except Exception as err:  # name the strategy: the pool traceback does not
+                    raise _selection_error(task[0], err) from err
+    return selected_info
+
+
+def _selection_error(strategy, err):
+    return SelectionError("Selection strategy {} failed: {!r}".format(strategy, err), strategy=strategy)
+
+
+def _run_selector(key, selector_class, deployment_config, info_dataset, info_dir, evaluation_metric, dest_uri,
+                  validation_schema, select_kwargs):
+    selector_kwargs = {} if info_dataset is None else {'info_dataset': info_dataset}
+    S = selector_class(deployment_config=deployment_config, model_dir=info_dir, evaluation_metric=evaluation_metric,
+                       problem_type='classification', n_class=5, verbose=True, **selector_kwargs)
+    return S.select(destination_uri=dest_uri, validation_schema=validation_schema, **select_kwargs)
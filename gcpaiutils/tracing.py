@@ -0,0 +1,318 @@
+from random import getrandbits
+from time import time, perf_counter
+from threading import local, Lock
+import functools
+import json
+import os
+
+
+TRACE_FILE_ENV = "GCPAIUTILS_TRACE_FILE"
+
+_tracer = None
+_exporters = []  # exporters configured through configure_tracing()
+_hooks = []  # exporters installed by other modules (see add_hook()), kept when tracing is disabled
+_context = local()
+
+
+class _NullSpan:
+    """Span returned when tracing is disabled. Every operation is a no-op."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_requests(self, n=1):
+        pass
+
+    def add_bytes(self, n):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Timed section of work. Spans nest through a thread-local stack: a span opened while another one is active
+    becomes its child and shares its trace id.
+
+       Args:
+           - tracer: Tracer that owns the span
+           - name: span name (e.g. 'train.poll')
+           - attributes: dict of free-form span attributes
+    """
+
+    def __init__(self, tracer, name, attributes=None):
+        self._tracer = tracer
+        self.name = name
+        self.attributes = attributes or {}
+        self.span_id = '%016x' % getrandbits(64)
+        self.parent = None
+        self.trace_id = None
+        self.start_time = None
+        self.duration = None
+        self.requests = 0
+        self.bytes = 0
+        self.error = None
+        self._start_counter = None
+
+    def __enter__(self):
+        stack = _get_stack()
+        self.parent = stack[-1] if stack else None
+        self.trace_id = self.parent.trace_id if self.parent is not None else '%032x' % getrandbits(128)
+        self.start_time = time()
+        self._start_counter = perf_counter()
+        stack.append(self)
+        self._tracer.on_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration = perf_counter() - self._start_counter
+        if exc_type is not None:
+            self.error = "{}: {}".format(exc_type.__name__, exc_val)
+        stack = _get_stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if self.parent is not None:  # roll request and byte counts up to the parent span
+            self.parent.requests += self.requests
+            self.parent.bytes += self.bytes
+        self._tracer.on_end(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_requests(self, n=1):
+        self.requests += n
+
+    def add_bytes(self, n):
+        self.bytes += n or 0
+
+    def to_dict(self):
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent.span_id if self.parent is not None else None,
+                'start_time': self.start_time,
+                'duration': self.duration,
+                'requests': self.requests,
+                'bytes': self.bytes,
+                'error': self.error,
+                'attributes': self.attributes}
+
+
+class Tracer:
+    """Creates spans and forwards them to a list of exporters.
+
+       Args:
+           - exporters: list of objects implementing on_start(span) / on_end(span)
+    """
+
+    def __init__(self, exporters):
+        self.exporters = exporters
+
+    def start_span(self, name, attributes=None):
+        return Span(self, name, attributes)
+
+    def on_start(self, span):
+        for exporter in self.exporters:
+            exporter.on_start(span)
+
+    def on_end(self, span):
+        for exporter in self.exporters:
+            exporter.on_end(span)
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+class JsonLinesExporter:
+    """Appends one JSON document per finished span to a local file.
+
+       Args:
+           - file_path: path of the JSON-lines file
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = Lock()
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.file_path, 'a') as f:
+                f.write(line + '\n')
+
+    def shutdown(self):
+        pass
+
+
+class OpenTelemetryExporter:
+    """Mirrors spans into OpenTelemetry. Requires the opentelemetry-api package; configure the OpenTelemetry SDK
+    (tracer provider, span processors, exporters) as usual before enabling tracing.
+
+       Args:
+           - tracer_name: name of the OpenTelemetry tracer
+    """
+
+    def __init__(self, tracer_name='gcpaiutils'):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("OpenTelemetryExporter requires the opentelemetry-api package")
+        self._trace = trace
+        self._otel_tracer = trace.get_tracer(tracer_name)
+        self._otel_spans = {}
+
+    def on_start(self, span):
+        context = None
+        if span.parent is not None and span.parent.span_id in self._otel_spans:
+            context = self._trace.set_span_in_context(self._otel_spans[span.parent.span_id])
+        self._otel_spans[span.span_id] = self._otel_tracer.start_span(span.name, context=context,
+                                                                      start_time=int(span.start_time * 1e9))
+
+    def on_end(self, span):
+        otel_span = self._otel_spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        otel_span.set_attribute('requests', span.requests)
+        otel_span.set_attribute('bytes', span.bytes)
+        if span.error is not None:
+            otel_span.set_attribute('error', span.error)
+        otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+    def shutdown(self):
+        self._otel_spans = {}
+
+
+def _get_stack():
+    try:
+        return _context.stack
+    except AttributeError:
+        _context.stack = []
+        return _context.stack
+
+
+def configure_tracing(file_path=None, exporters=None):
+    """
+    Enables tracing. Spans are exported to a JSON-lines file, to custom exporters, or both.
+
+    :param file_path: path of a JSON-lines file receiving one line per finished span
+    :param exporters: list of additional exporters (e.g. OpenTelemetryExporter())
+    :return: the active Tracer
+    """
+    global _exporters
+    exporters = list(exporters or [])
+    if file_path is not None:
+        exporters.append(JsonLinesExporter(file_path))
+    if not exporters:
+        raise ValueError("Must specify file_path or at least one exporter to enable tracing.")
+    _exporters = exporters
+    _update_tracer()
+    return _tracer
+
+
+def disable_tracing():
+    global _exporters
+    for exporter in _exporters:
+        exporter.shutdown()
+    _exporters = []
+    _update_tracer()
+
+
+def is_enabled():
+    return bool(_exporters)
+
+
+def add_hook(exporter):
+    """
+    Installs an exporter receiving every span whether tracing is enabled or not (e.g. metrics.MetricsExporter).
+    Spans are recorded as long as at least one hook is installed.
+
+    :param exporter: object implementing on_start(span) / on_end(span) / shutdown()
+    """
+    if exporter not in _hooks:
+        _hooks.append(exporter)
+    _update_tracer()
+
+
+def remove_hook(exporter):
+    if exporter in _hooks:
+        _hooks.remove(exporter)
+    _update_tracer()
+
+
+def _update_tracer():
+    global _tracer
+    exporters = _exporters + _hooks
+    _tracer = Tracer(exporters) if exporters else None
+
+
+def span(name, **attributes):
+    """
+    Opens a span. When tracing is disabled a shared no-op span is returned.
+
+    :param name: span name
+    :param attributes: free-form span attributes
+    :return: context manager yielding the span
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.start_span(name, attributes)
+
+
+def traced(name):
+    """
+    Decorator wrapping each call of the decorated function in a span.
+
+    :param name: span name
+    :return: decorator
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.start_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    if _tracer is None:
+        return _NULL_SPAN
+    stack = _get_stack()
+    return stack[-1] if stack else _NULL_SPAN
+
+
+def add_requests(n=1):
+    """Adds n API requests to the innermost active span."""
+    if _tracer is not None:
+        current_span().add_requests(n)
+
+
+def add_bytes(n):
+    """Adds n transferred bytes to the innermost active span."""
+    if _tracer is not None:
+        current_span().add_bytes(n)
+
+
+def add_file_bytes(file_path):
+    """Adds the size of a local file (e.g. a just downloaded blob) to the innermost active span."""
+    if _tracer is not None:
+        current_span().add_bytes(os.path.getsize(file_path))
+
+
+if os.environ.get(TRACE_FILE_ENV):
+    configure_tracing(file_path=os.environ[TRACE_FILE_ENV])
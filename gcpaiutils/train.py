@@ -3,6 +3,7 @@ from gcpaiutils.handler import JobHandler, JobSpecHandler
 
 JOB_SPECS_GLOBAL_ARGS = ['scaleTier', 'region', 'modelDir']
 JOB_SPECS_DEFAULT_ARGS = ['trainFiles']
+JOB_SPECS_CLUSTER_POOLS = ['worker', 'parameterServer', 'evaluator']
 
 
 class TrainJobHandler(JobHandler):
@@ -16,8 +17,8 @@ class TrainJobHandler(JobHandler):
         Main usage:
            - submit_job(): returns the object. Sends the job request (async) with the specified parameters.
     """
-    def __init__(self, deployment_config, job_executor=None):
-        super().__init__(deployment_config, job_executor)
+    def __init__(self, deployment_config, job_executor=None, project_id=None):
+        super().__init__(deployment_config, job_executor, project_id)
         self.hypertune = False
 
     def translate_job_specs(self, job_spec=None):
@@ -27,7 +28,15 @@ class TrainJobHandler(JobHandler):
             self.hypertune = True
 
         # Map job_spec information to docker entrypoint kwargs
-        job_spec['trainingInput']['masterConfig'] = {'imageUri': job_spec['trainingInput'].pop('imageUri')}
+        image_uri = job_spec['trainingInput'].pop('imageUri')
+        job_spec['trainingInput']['masterConfig'] = {'imageUri': image_uri}
+        for pool in JOB_SPECS_CLUSTER_POOLS:  # every node of a distributed job runs the atom image
+            if job_spec['trainingInput'].get(pool + 'Count'):
+                job_spec['trainingInput'][pool + 'Count'] = str(job_spec['trainingInput'][pool + 'Count'])
+                job_spec['trainingInput'].setdefault(pool + 'Config', {'imageUri': image_uri})
+            else:
+                for key in [pool + 'Type', pool + 'Count', pool + 'Config']:
+                    job_spec['trainingInput'].pop(key, None)
         if 'args' not in job_spec['trainingInput'].keys() or job_spec['trainingInput']['args'] is None:
             job_spec['trainingInput']['args'] = []
         else:
@@ -48,7 +57,9 @@ class TrainJobSpecHandler(JobSpecHandler):
 
     Args:
         - project_name: GCP project name
-        - train_inputs: a dict specifying ()
+        - train_inputs: a dict specifying (). Distributed training: workerCount (and optionally parameterServerCount,
+          evaluatorCount) with matching <pool>Type; types default to the 'distributed' section of the atom in
+          defaults.yml. See utils.get_cluster_config().
 
     Main usage:
         - create_job_specs(): returns the object with the job_specs property properly configured for a GCP AI
@@ -90,6 +101,15 @@ class TrainJobSpecHandler(JobSpecHandler):
             else:
                 raise NotImplementedError("Unrecognized job spec argument %s" % item)
 
+        # Cast cluster pool machine types if not found
+        for pool in JOB_SPECS_CLUSTER_POOLS:
+            if self.inputs.get(pool + 'Count') and pool + 'Type' not in self.inputs:
+                try:
+                    distributed = self._defaults[self.algorithm]['distributed']
+                except KeyError:
+                    raise ValueError("Algorithm %s has no distributed training defaults" % self.algorithm)
+                self.inputs[pool + 'Type'] = distributed.get(pool + 'Type', distributed['workerType'])
+
         # Generate jobId
         job_id = self._generate_job_name(prefix='train')
         if self.append_job_id:
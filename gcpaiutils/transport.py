@@ -0,0 +1,220 @@
+from googleapiclient.discovery import Resource
+from googleapiclient.http import HttpRequest, BatchHttpRequest, build_http
+from googleapiclient import errors
+from google_auth_httplib2 import AuthorizedHttp
+from gcpaiutils import metrics
+from contextlib import contextmanager
+from threading import Lock, BoundedSemaphore
+from time import perf_counter
+import google.auth
+import re
+
+
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+MAX_CONNECTIONS = 10
+_POOLS = {}
+_POOLS_LOCK = Lock()
+_PROJECT_PATTERN = re.compile(r"/projects/([^/?:]+)")
+
+
+class HttpPool:
+    """Bounded pool of authorized httplib2 connections. httplib2.Http objects are not thread-safe: each one is lent to
+    a single thread at a time and returned to the pool afterwards, so that keep-alive connections (and access tokens)
+    are reused across requests while the number of open sockets never exceeds max_connections.
+
+       Args:
+           - credentials: google.auth credentials (defaults to application default credentials)
+           - max_connections: maximum number of connections (threads asking for more wait for one to be released)
+           - timeout: socket timeout (in seconds), None for the googleapiclient default
+
+        Main usage:
+           - with pool.connection() as http: request.execute(http=http)
+           - wrap(client): returns a thread-safe view of a discovery client (see PooledClient)
+    """
+
+    def __init__(self, credentials=None, max_connections=MAX_CONNECTIONS, timeout=None):
+        if max_connections < 1:
+            raise ValueError("max_connections must be positive.")
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=SCOPES)
+        self.credentials = credentials
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.created = 0
+        self._idle = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_connections)
+
+    def _new_connection(self):
+        http = build_http()
+        if self.timeout is not None:
+            http.timeout = self.timeout
+        return AuthorizedHttp(self.credentials, http=http)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                if self._idle:
+                    http = self._idle.pop()
+                else:
+                    http = None
+                    self.created += 1
+            if http is None:
+                http = self._new_connection()
+            try:
+                yield http
+            except errors.HttpError:  # error response was read in full: connection is reusable
+                with self._lock:
+                    self._idle.append(http)
+                raise
+            except BaseException:
+                _close(http)  # connection may be left half-read: do not reuse it
+                with self._lock:
+                    self.created -= 1
+                raise
+            with self._lock:
+                self._idle.append(http)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for http in self._idle:
+                _close(http)
+            self.created -= len(self._idle)
+            self._idle = []
+
+    def wrap(self, client):
+        return PooledClient(client, self)
+
+
+class PooledClient:
+    """Thread-safe view of a googleapiclient discovery client (or any of its resources): requests built through it
+    run on a connection borrowed from an HttpPool for the duration of execute(). Requests can therefore be built and
+    executed from any thread, with the same interface as the wrapped client.
+    """
+
+    def __init__(self, resource, pool):
+        self._resource = resource
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._resource, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return _wrap(attr(*_unwrap_all(args), **{k: _unwrap(v) for k, v in kwargs.items()}), self._pool)
+
+        return call
+
+
+class PooledRequest:
+    """HttpRequest (or BatchHttpRequest) executed on a connection borrowed from an HttpPool. Each execution is
+    recorded in the metrics registry when metrics are enabled (see metrics.py).
+    """
+
+    def __init__(self, request, pool):
+        self._request = request
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._request, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return attr(*_unwrap_all(args), **{k: _unwrap(v) for k, v in kwargs.items()})
+
+        return call
+
+    def execute(self, http=None, **kwargs):
+        start = perf_counter()
+        code = 'error'
+        try:
+            if http is not None:
+                response = self._request.execute(http=http, **kwargs)
+            else:
+                with self._pool.connection() as http:
+                    response = self._request.execute(http=http, **kwargs)
+            code = 200
+            return response
+        except errors.HttpError as err:
+            code = err.resp.status
+            raise
+        finally:
+            if metrics.is_enabled():
+                _record_request(self._request, code, perf_counter() - start)
+
+
+def _record_request(request, code, duration):
+    if not isinstance(request, BatchHttpRequest):
+        metrics.observe('gcpaiutils_mlapi_request_duration_seconds', duration, method=request.methodId)
+        metrics.inc_counter('gcpaiutils_mlapi_requests_total', method=request.methodId,
+                            project=_get_project(request), code=code)
+        return
+    metrics.observe('gcpaiutils_mlapi_request_duration_seconds', duration, method='batch')
+    responses = getattr(request, '_responses', {})
+    if not responses:  # the batch request itself failed
+        metrics.inc_counter('gcpaiutils_mlapi_requests_total', method='batch', project='', code=code)
+    for request_id, (resp, _) in responses.items():
+        sub_request = request._requests[request_id]
+        metrics.inc_counter('gcpaiutils_mlapi_requests_total', method=sub_request.methodId,
+                            project=_get_project(sub_request), code=resp.status)
+
+
+def _get_project(request):
+    match = _PROJECT_PATTERN.search(request.uri)
+    return match.group(1) if match else ''
+
+
+def _wrap(obj, pool):
+    if isinstance(obj, (HttpRequest, BatchHttpRequest)):
+        return PooledRequest(obj, pool)
+    if isinstance(obj, Resource):
+        return PooledClient(obj, pool)
+    return obj
+
+
+def _unwrap(obj):
+    if isinstance(obj, PooledRequest):
+        return obj._request
+    if isinstance(obj, PooledClient):
+        return obj._resource
+    return obj
+
+
+def _unwrap_all(args):
+    return [_unwrap(arg) for arg in args]
+
+
+def _close(http):
+    for connection in getattr(getattr(http, 'http', http), 'connections', {}).values():
+        connection.close()
+
+
+def _get_credentials_key(credentials):
+    if credentials is None:
+        return None
+    return type(credentials).__name__, getattr(credentials, 'service_account_email', None), \
+        getattr(credentials, 'project_id', None)
+
+
+def get_http_pool(_globals, credentials=None):
+    """
+    Returns the connection pool of an identity (MLAPI_MAX_CONNECTIONS and MLAPI_TIMEOUT in the deployment config).
+    Pools are shared within a process, so that all handlers and wrappers of a worker are bound by the same number
+    of sockets.
+
+    :param _globals: deployment configuration dict
+    :param credentials: google.auth credentials (defaults to application default credentials)
+    :return: HttpPool
+    """
+    key = (_globals.get('MLAPI_DISCOVERY_URL'), _get_credentials_key(credentials))
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = HttpPool(credentials, max_connections=_globals.get('MLAPI_MAX_CONNECTIONS', MAX_CONNECTIONS),
+                                   timeout=_globals.get('MLAPI_TIMEOUT'))
+        return _POOLS[key]
@@ -0,0 +1,47 @@
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+from gcpaiutils.wrappers import check_jobs, TIME_INTERVAL
+from gcpaiutils.utils import TERMINAL_STATES, FAILURE_STATES
+import asyncio
+
+
+class JobStatusTrigger(BaseTrigger):
+    """Deferrable trigger firing once GCP AI Platform jobs are done (or as soon as one fails). Runs in the Airflow
+    triggerer, so no worker slot is held while jobs run. Requires apache-airflow>=2.2.
+
+       Args:
+           - deployment_config: string specifying deployment configuration YAML file absolute path
+           - jobs: list of job names (e.g. job_id of handles pushed by submit_* wrappers)
+           - time_interval: interval (in seconds) between two consecutive checks
+           - fail_fast: fire as soon as one job failed
+           - projects: dict containing job names as keys and GCP project id as value (project_id of job handles), for
+                       jobs routed to other projects than PROJECT_ID
+
+        Event payload: {'status': dict containing job names as keys and job state as value, 'done': bool}
+    """
+
+    def __init__(self, deployment_config, jobs, time_interval=TIME_INTERVAL, fail_fast=True, projects=None):
+        super().__init__()
+        self.deployment_config = deployment_config
+        self.jobs = list(jobs)
+        self.time_interval = time_interval
+        self.fail_fast = fail_fast
+        self.projects = dict(projects or {})
+
+    def serialize(self):
+        return ("gcpaiutils.triggers.JobStatusTrigger", {'deployment_config': self.deployment_config,
+                                                         'jobs': self.jobs,
+                                                         'time_interval': self.time_interval,
+                                                         'fail_fast': self.fail_fast,
+                                                         'projects': self.projects})
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            status = await loop.run_in_executor(None, check_jobs, self.deployment_config, self.jobs,
+                                                self.projects)
+            done = all(state in TERMINAL_STATES for state in status.values())
+            failed = any(state in FAILURE_STATES for state in status.values())
+            if done or (self.fail_fast and failed):
+                yield TriggerEvent({'status': status, 'done': done})
+                return
+            await asyncio.sleep(self.time_interval)
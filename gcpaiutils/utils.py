@@ -5,17 +5,34 @@ from shutil import rmtree
 from pandas import read_csv
 from tempfile import TemporaryDirectory
 from google.cloud import storage
+from googleapiclient import discovery, errors
+from google.auth.credentials import AnonymousCredentials
 import string
 import logging
-from datetime import datetime as dt
+from datetime import datetime as dt, timezone
 from google.oauth2.service_account import Credentials
 import os
 import json
+from gcpaiutils.backends import LocalBackend, MemoryBackend
+from gcpaiutils.transport import get_http_pool
+from gcpaiutils.scratch import get_scratch_space
+from threading import Lock
+from gcpaiutils import tracing
 
 
 PATH = os.path.abspath(os.path.dirname(__file__))
-
-
+TERMINAL_STATES = ["SUCCEEDED", "FAILED", "CANCELLED"]
+FAILURE_STATES = ["FAILED", "CANCELLED"]
+_STORAGE_BACKENDS = {}
+_MLAPI_CLIENTS = {}
+_MLAPI_CLIENTS_LOCK = Lock()
+BATCH_SIZE = 100  # status requests per batch request
+MACHINE_MEMORY = {"n1-standard-4": 15, "n1-standard-8": 30, "n1-standard-16": 60, "n1-highmem-2": 13,
+                  "n1-highmem-4": 26, "n1-highmem-8": 52, "n1-highmem-16": 104, "n1-highcpu-16": 14.4,
+                  "standard_gpu": 30}  # GB
+
+
+@tracing.traced('utils.get_deployment_config')
 def get_deployment_config(file_path):
     if not (isinstance(file_path, str)):
         raise TypeError("deployment_config must be a string containing the absolute path to your "
@@ -25,6 +42,7 @@ def get_deployment_config(file_path):
     return v
 
 
+@tracing.traced('utils.get_deployment_constants')
 def get_deployment_constants(deployment_config):
     with open('{}/deployment.yml'.format(PATH), 'r') as f:
         data = f.read()
@@ -32,12 +50,14 @@ def get_deployment_constants(deployment_config):
     return safe_load(t.render(deployment_config))
 
 
+@tracing.traced('utils.get_defaults')
 def get_defaults():
     with open("{}/defaults.yml".format(PATH), 'r') as stream:
         defaults = safe_load(stream)
     return defaults
 
 
+@tracing.traced('utils.get_hyper')
 def get_hyper():
     with open("{}/hypertune.yml".format(PATH), 'r') as stream:
         hyper = safe_load(stream)
@@ -86,7 +106,7 @@ def get_hardware_config(atom=None, data_size=None, scoring=False):
         elif data_size <= 10:
             return "n1-highmem-8"
         else:
-            raise(ValueError, "Data size not handled: %s GB." % data_size)
+            raise ValueError("Data size not handled: %s GB." % data_size)
     elif atom == "aggregator":
         return "n1-highmem-2"
     elif atom in ["class_skl_logreg", "class_lda", "class_qda"]:
@@ -97,7 +117,7 @@ def get_hardware_config(atom=None, data_size=None, scoring=False):
         elif data_size <= 3:
             return "n1-standard-8" # "n1-standard-8"
         else:
-            raise(ValueError, "Data size not handled: %s GB." % data_size)
+            raise ValueError("Data size not handled: %s GB." % data_size)
     elif atom in ["class_dummy", "reg_dummy"]:
         if data_size <= 0.5:
             return "n1-highmem-2" # "n1-standard-4"
@@ -108,7 +128,7 @@ def get_hardware_config(atom=None, data_size=None, scoring=False):
         elif data_size <= 8:
             return "n1-highmem-8"
         else:
-            raise(ValueError, "Data size not handled: %s GB." % data_size)
+            raise ValueError("Data size not handled: %s GB." % data_size)
     elif atom in ["class_xgb", "class_lgbm", "class_rf", "cusreg_lgbm"]:
         if data_size <= 0.1:
             return "n1-highmem-2" # "n1-standard-4"
@@ -119,16 +139,95 @@ def get_hardware_config(atom=None, data_size=None, scoring=False):
         elif data_size <= 8:
             return "n1-highmem-16"
         else:
-            raise (ValueError, "Data size not handled: %s GB." % data_size)
+            raise ValueError("Data size not handled: %s GB." % data_size)
     elif atom in ["class_ffnn"]:
         if data_size <= 1:
             return "n1-standard-4"
         if data_size <= 3:
             return "n1-standard-8"  # "standard_gpu"
         else:
-            raise (ValueError, "Data size not handled: %s GB." % data_size)
+            raise ValueError("Data size not handled: %s GB." % data_size)
     else:
-        raise(NotImplementedError, "Unrecognized atom name: %s. Could not choose hardware settings." % atom)
+        raise NotImplementedError("Unrecognized atom name: %s. Could not choose hardware settings." % atom)
+
+
+def get_cluster_config(atom, data_size):
+    """
+    Multi-node training sizing rule. Atoms with a 'distributed' section in defaults.yml train on a cluster once data
+    exceeds its sizeThreshold (GB): data is spread over master and workers, each node handling at most nodeDataSize GB.
+
+    :param atom: algorithm name
+    :param data_size: data size in GB
+    :return: dict of cluster spec arguments (masterType, workerType, workerCount, ...), empty for single-node training
+    """
+    distributed = (get_defaults().get(atom) or {}).get('distributed')
+    if not distributed or data_size <= distributed['sizeThreshold']:
+        return {}
+    worker_count = -(-data_size // distributed['nodeDataSize']) - 1  # ceil, master is a node too
+    if worker_count > distributed['maxWorkerCount']:
+        raise ValueError("Data size not handled with %s workers: %s GB." % (distributed['maxWorkerCount'], data_size))
+    cluster_config = {'masterType': distributed['workerType'],
+                      'workerType': distributed['workerType'],
+                      'workerCount': int(worker_count)}
+    for pool in ['parameterServer', 'evaluator']:
+        if distributed.get(pool + 'Count'):
+            cluster_config[pool + 'Type'] = distributed.get(pool + 'Type', distributed['workerType'])
+            cluster_config[pool + 'Count'] = distributed[pool + 'Count']
+    return cluster_config
+
+
+def get_shard_count(atom, data_size, machine_type=None, max_shards=64):
+    """
+    Chooses the number of shards to split scoring data into, so that each shard fits the hardware ladder of
+    get_hardware_config() and, if given, the memory of the target machine type.
+
+    :param atom: algorithm name
+    :param data_size: data size in GB
+    :param machine_type: target per-shard machine type (None for any machine type handled by the atom)
+    :param max_shards: maximum number of shards
+    :return: number of shards
+    """
+    for n_shards in range(1, max_shards + 1):
+        try:
+            shard_machine_type = get_hardware_config(atom=atom, data_size=data_size / n_shards, scoring=True)
+        except ValueError:
+            continue
+        if machine_type is None or MACHINE_MEMORY.get(shard_machine_type, 0) <= MACHINE_MEMORY[machine_type]:
+            return n_shards
+    raise ValueError("Data size not handled with %s shards: %s GB." % (max_shards, data_size))
+
+
+def get_memory_headroom(machine_type, data_size, data_memory_factor=3, usable_memory_rate=0.8):
+    """
+    Estimates memory left on a machine once scoring data is loaded. Data footprint in memory is approximated as a
+    multiple of its size on storage (parsing, feature matrix and predictions).
+
+    :param machine_type: AI Platform machine type (see MACHINE_MEMORY)
+    :param data_size: data size in GB
+    :param data_memory_factor: in-memory size of data over its size on storage
+    :param usable_memory_rate: fraction of machine memory available to the atom
+    :return: memory headroom in GB (may be negative)
+    """
+    try:
+        memory = MACHINE_MEMORY[machine_type]
+    except KeyError:
+        raise ValueError("Unknown memory for machine type: %s" % machine_type)
+    return memory * usable_memory_rate - data_size * data_memory_factor
+
+
+def get_blob_fingerprints(gcs_client, uri):
+    """
+    Lists objects under a GCS prefix with the attributes identifying their content.
+
+    :param gcs_client: google.cloud.storage client
+    :param uri: 'gs://bucket/prefix' URI
+    :return: list of [name, size, generation, crc32c], sorted by name
+    """
+    bucket_name, _, prefix = uri[len("gs://"):].partition("/")
+    with tracing.span('gcs.list_blobs', prefix=prefix) as sp:
+        blobs = list(gcs_client.list_blobs(bucket_or_name=bucket_name, prefix=prefix))
+        sp.add_requests()
+    return sorted([[blob.name, blob.size, blob.generation, blob.crc32c] for blob in blobs])
 
 
 def get_user(kwargs):
@@ -143,6 +242,7 @@ def get_version(kwargs):
     return kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='version')
 
 
+@tracing.traced('utils.get_gcs_credentials')
 def get_gcs_credentials(_globals):
     try:
         return Credentials.from_service_account_file(_globals['AI_PLATFORM_SA'])
@@ -153,44 +253,148 @@ def get_gcs_credentials(_globals):
             return None
 
 
+def build_mlapi_client(_globals, credentials=None):
+    """
+    Returns an ML API (ml/v1) discovery client. MLAPI_DISCOVERY_URL in the deployment config points the client at
+    another discovery document, hence at another endpoint (e.g. the local fake server of fakeapi.py); without
+    credentials, such clients send anonymous requests.
+
+    Clients are thread-safe and shared within a process: requests run on connections borrowed from a bounded pool
+    (MLAPI_MAX_CONNECTIONS, see transport.py), so handlers and wrappers can be used from thread pools.
+
+    :param _globals: deployment configuration dict
+    :param credentials: google.auth credentials (defaults to application default credentials)
+    :return: ML API discovery client
+    """
+    discovery_url = _globals.get('MLAPI_DISCOVERY_URL')
+    if discovery_url:
+        credentials = credentials or AnonymousCredentials()
+    pool = get_http_pool(_globals, credentials)
+    with _MLAPI_CLIENTS_LOCK:
+        if pool not in _MLAPI_CLIENTS:
+            with tracing.span('mlapi.build_client'):
+                if discovery_url:
+                    client = discovery.build('ml', 'v1', credentials=pool.credentials,
+                                             discoveryServiceUrl=discovery_url, static_discovery=False,
+                                             cache_discovery=False)
+                else:
+                    client = discovery.build('ml', 'v1', credentials=pool.credentials, cache_discovery=False)
+            _MLAPI_CLIENTS[pool] = pool.wrap(client)
+        return _MLAPI_CLIENTS[pool]
+
+
+def get_jobs_info(mlapi, job_names, batch_size=BATCH_SIZE):
+    """
+    Fetches job descriptions with batch requests of batch_size status requests, one round trip each. Clients without a
+    batch endpoint (local job executor) are queried job by job.
+
+    :param mlapi: ML API discovery client (or local job executor)
+    :param job_names: list of full job names ('projects/<project id>/jobs/<job>')
+    :param batch_size: number of status requests per batch request
+    :return: tuple of job descriptions and errors, both dicts with job names as keys. A failed batch request reports
+             its error for every job it carried.
+    """
+    job_info, job_errors = {}, {}
+    if not hasattr(mlapi, 'new_batch_http_request'):
+        for name in job_names:
+            try:
+                tracing.add_requests()
+                job_info[name] = mlapi.projects().jobs().get(name=name).execute()
+            except errors.HttpError as err:
+                job_errors[name] = err
+        return job_info, job_errors
+
+    for start in range(0, len(job_names), batch_size):
+        chunk = job_names[start:start + batch_size]
+
+        def callback(request_id, response, exception, chunk=chunk):
+            if exception is not None:
+                job_errors[chunk[int(request_id)]] = exception
+            else:
+                job_info[chunk[int(request_id)]] = response
+
+        batch = mlapi.new_batch_http_request(callback=callback)
+        for index, name in enumerate(chunk):
+            batch.add(mlapi.projects().jobs().get(name=name), request_id=str(index))
+        try:
+            tracing.add_requests()
+            batch.execute()
+        except Exception as err:  # the batch request itself failed
+            for name in chunk:
+                if name not in job_info:
+                    job_errors.setdefault(name, err)
+    return job_info, job_errors
+
+
+def get_storage_client(_globals):
+    """
+    Builds the storage client selected by STORAGE_BACKEND in the deployment config:
+        - 'gcs' (default): google.cloud.storage client using AI Platform service account credentials
+        - 'local': LocalBackend rooted at STORAGE_ROOT (gs://bucket/... maps to STORAGE_ROOT/bucket/...)
+        - 'memory': MemoryBackend, with optional STORAGE_LATENCY (seconds) and STORAGE_ERROR_RATE (probability of
+          transient errors)
+    Local and memory backends are shared by the whole process, hence so are their stats.
+
+    :param _globals: deployment configuration dict
+    :return: storage client (google.cloud.storage.Client or StorageBackend)
+    """
+    backend = _globals.get('STORAGE_BACKEND', 'gcs')
+    if backend == 'gcs':
+        return storage.Client(project=_globals['PROJECT_ID'], credentials=get_gcs_credentials(_globals))
+    elif backend == 'local':
+        key = (backend, _globals['STORAGE_ROOT'])
+        if key not in _STORAGE_BACKENDS:
+            _STORAGE_BACKENDS[key] = LocalBackend(_globals['STORAGE_ROOT'])
+        return _STORAGE_BACKENDS[key]
+    elif backend == 'memory':
+        key = (backend, _globals.get('STORAGE_LATENCY', 0), _globals.get('STORAGE_ERROR_RATE', 0))
+        if key not in _STORAGE_BACKENDS:
+            _STORAGE_BACKENDS[key] = MemoryBackend(latency=key[1], error_rate=key[2])
+        return _STORAGE_BACKENDS[key]
+    else:
+        raise ValueError("Unknown storage backend: %s" % backend)
+
+
+@tracing.traced('utils.get_model_metadata')
 def get_model_metadata(_globals, kwargs):
 
     # Define metadata remote location & setup local dir
     model_metadata_uri = f"{get_user(kwargs)}/ACTIVE_MODELS/{get_problem(kwargs)}/"
 
     with TemporaryDirectory() as tmp_dir:
-        gcs_credentials = get_gcs_credentials(_globals)
-        gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+        gcs_client = get_storage_client(_globals)
         gcs_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
-        blob_list = list(gcs_bucket.list_blobs(prefix=model_metadata_uri))
+        with tracing.span('gcs.list_blobs', prefix=model_metadata_uri) as sp:
+            blob_list = list(gcs_bucket.list_blobs(prefix=model_metadata_uri))
+            sp.add_requests()
         trained_model_metadata = {}
         for blob in blob_list:
             if '/featimp_' in blob.name: # assume all models have featimp
                 file_name = f"{tmp_dir}/{blob.name.split('/')[-1]}"
-                blob.download_to_filename(file_name, client=gcs_client)
-                trained_model_metadata[blob.name.split('/')[-1]] = read_csv(file_name)
+                with tracing.span('gcs.download', blob=blob.name) as sp:
+                    blob.download_to_filename(file_name, client=gcs_client)
+                    sp.add_requests()
+                    sp.add_bytes(blob.size)
+                with tracing.span('utils.read_csv', file=file_name):
+                    trained_model_metadata[blob.name.split('/')[-1]] = read_csv(file_name)
 
     return trained_model_metadata
 
 
+@tracing.traced('utils.get_metadata')
 def get_metadata(_globals, dag_type, kwargs):
 
     # Define metadata remote location & setup local dir
     metadata_uri = f"{get_user(kwargs)}/{get_problem(kwargs)}/METADATA/metadata.json"
 
-    tmp_metadata_dir = make_temp_dir(os.getcwd())
-    metadata_local_filename = os.path.join(tmp_metadata_dir, 'metadata.json')
-
-    # Fetch metadata from GCS
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
-    blob = storage.Blob(metadata_uri, gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"]))
-    blob.download_to_filename(metadata_local_filename, client=gcs_client)
-
-    # Load in memory & clean-up
-    with open(metadata_local_filename, 'r') as f:
-        metadata_dict = json.load(f)
-    rmtree(tmp_metadata_dir)
+    # Fetch metadata from GCS & load in memory
+    gcs_client = get_storage_client(_globals)
+    with get_scratch_space(_globals, in_memory=True) as scratch:
+        with tracing.span('gcs.download', blob=metadata_uri) as sp:
+            blob = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"]).blob(metadata_uri)
+            sp.add_bytes(scratch.download(blob, 'metadata.json', client=gcs_client))
+            sp.add_requests(2)  # bucket lookup + download
+        metadata_dict = json.loads(scratch.read('metadata.json').decode('utf-8'))
 
     return metadata_dict
 
@@ -209,7 +413,16 @@ def get_timestamp_components():
     return year, month, day, hour, minute, second
 
 
+def parse_rfc3339(timestamp):
+    """Converts an RFC3339 UTC timestamp as returned by Google APIs (e.g. '2020-01-31T12:00:00.123Z') to epoch time."""
+    timestamp = timestamp.rstrip('Z')
+    seconds, _, fraction = timestamp.partition('.')
+    epoch = dt.strptime(seconds, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    return epoch + (float('0.' + fraction) if fraction else 0)
+
+
 def make_temp_dir(root):
+    """Creates a uniquely named directory under root. Callers must remove it: prefer get_scratch_space()."""
 
     year, month, day, hour, minute, second = get_timestamp_components()
 
@@ -223,31 +436,70 @@ def make_temp_dir(root):
     return tmp_dir
 
 
+class JobFailedError(ValueError):
+    """Raised when one or more GCP AI Platform jobs did not succeed.
+
+       Args:
+           - message: error message
+           - status: dict containing job names as keys and last known job state as value
+           - failed_jobs: list of jobs that failed (or were cancelled by someone else)
+           - cancelled_jobs: list of sibling jobs cancelled as a consequence of the failure
+    """
+
+    def __init__(self, message, status=None, failed_jobs=None, cancelled_jobs=None):
+        super().__init__(message)
+        self.status = status or {}
+        self.failed_jobs = failed_jobs or []
+        self.cancelled_jobs = cancelled_jobs or []
+
+
+class JobTimeoutError(JobFailedError):
+    """Raised when GCP AI Platform jobs did not finish before the polling deadline. failed_jobs lists unfinished
+    jobs."""
+    pass
+
+
 def get_job_assessment(status):
     successful_jobs = [job for job, s in status.items() if s == 'SUCCEEDED']
-    failed_jobs = [job for job, s in status.items() if s == 'FAILED']
+    failed_jobs = [job for job, s in status.items() if s in FAILURE_STATES]
     if len(failed_jobs) >= 1:
         for job in failed_jobs:
-            logging.error("Job failed: {}".format(job))
-        raise ValueError("One or more jobs failed")
+            logging.error("Job {}: {}".format(status[job].lower(), job))
+        raise JobFailedError("One or more jobs failed", status=status, failed_jobs=failed_jobs)
     return successful_jobs
 
 
-def get_selector(_globals, kwargs):
+@tracing.traced('utils.get_selector')
+def get_selector(_globals, kwargs, scratch=None):
+    """
+    Downloads selector outputs (one JSON file per selection strategy) into a scratch workspace.
+
+    :param _globals: deployment configuration dict
+    :param kwargs: Airflow context
+    :param scratch: ScratchSpace (see get_scratch_space()). Without it, files are downloaded into a new directory
+                    under the scratch root, which the caller must remove.
+    :return: list of artifact names ('<strategy>/<file>.json'), to read with scratch.read(). Without scratch: tuple of
+             the local directory and the list of local file paths.
+    """
+    if scratch is None:
+        scratch = get_scratch_space(_globals, in_memory=False)  # not context-managed: removed by the caller
+        names = get_selector(_globals, kwargs, scratch)
+        return scratch.path(), [scratch.path(*name.split("/")) for name in names]
 
     selector_blob = os.path.join(get_user(kwargs), "SELECTOR", get_problem(kwargs))
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
     gcs_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
-    gcs_blob_list = [blob for blob
-                     in list(gcs_bucket.list_blobs(prefix=selector_blob))
-                     if blob.name.endswith(".json")]
+    with tracing.span('gcs.list_blobs', prefix=selector_blob) as sp:
+        gcs_blob_list = [blob for blob
+                         in list(gcs_bucket.list_blobs(prefix=selector_blob))
+                         if blob.name.endswith(".json")]
+        sp.add_requests()
 
-    local_dir = make_temp_dir(os.getcwd())
     local_destination_list = []
     for blob in gcs_blob_list:  # allow multiple selection strategies
         shards = blob.name.split("/")
-        os.makedirs(os.path.join(local_dir, shards[-2]))
-        local_destination_list.append(os.path.join(local_dir, shards[-2], shards[-1]))
-        blob.download_to_filename(local_destination_list[-1], client=gcs_client)
-    return local_dir, local_destination_list
+        local_destination_list.append("/".join(shards[-2:]))
+        with tracing.span('gcs.download', blob=blob.name) as sp:
+            sp.add_bytes(scratch.download(blob, local_destination_list[-1], client=gcs_client))
+            sp.add_requests()
+    return local_destination_list
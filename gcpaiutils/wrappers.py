@@ -3,14 +3,28 @@ from gcpaiutils.predict import ScoreJobHandler, ScoreJobSpecHandler
 from gcpaiutils.postprocess import PostprocessJobHandler, PostprocessJobSpecHandler
 from gcpaiutils.preprocess import PreprocessJobHandler, PreprocessJobSpecHandler
 from gcpaiutils.utils import get_model_path_from_info_path, get_deployment_config, get_hardware_config,\
-    get_user, get_problem, get_version, get_gcs_credentials, make_temp_dir, get_job_assessment,\
-    get_selector, get_metadata, get_model_metadata
-from googleapiclient import discovery
-from google.cloud import storage
-from shutil import rmtree
+    get_user, get_problem, get_version, get_storage_client, get_job_assessment,\
+    get_selector, get_metadata, get_model_metadata, get_deployment_constants, get_blob_fingerprints, parse_rfc3339,\
+    get_memory_headroom, get_cluster_config, get_shard_count, JobFailedError, JobTimeoutError,\
+    TERMINAL_STATES, FAILURE_STATES, MACHINE_MEMORY
+from gcpaiutils.journal import get_submission_journal, submit_job_once
+from gcpaiutils.cache import get_training_cache, get_training_fingerprint, load_json_blob, store_json_blob,\
+    get_added_objects
+from gcpaiutils.aggregation import RunningAverage, get_output_size
+from gcpaiutils.prefetch import InfoPrefetcher, get_staging_dir, get_staged_files, get_model_prefix,\
+    remove_staging_dir, prune_staging_dirs
+from gcpaiutils.selection import InfoDataset, accepts_info_dataset, run_selectors
+from gcpaiutils.routing import get_job_router
+from gcpaiutils.poller import get_poller, get_status_client
+from gcpaiutils.scratch import get_scratch_space
+from gcpaiutils import tracing, metrics
+from googleapiclient import errors
+import httplib2
 import logging
-from google.oauth2.service_account import Credentials
-from time import sleep
+from time import sleep, time
+from statistics import median
+from collections import Counter
+from copy import deepcopy
 import os
 import json
 
@@ -19,55 +33,528 @@ logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
 TIME_INTERVAL = 60*1
+STREAM_AGGREGATE_SIZE = 100*1024**2  # bytes
+STREAM_AGGREGATE_FILE = "aggregate.csv"
 
 
-def poll(deployment_config, time_interval, jobs):
+def get_job_info(mlapi, project_id, job, retries=10):
     """
-    Monitors job status on GCP AI Platform.
+    Fetches job description from GCP AI Platform. Retries on transient errors (429, 5xx and transport errors); other
+    HTTP errors (e.g. 404 for a purged job) are raised at once.
+
+    :param mlapi: ML API discovery client
+    :param project_id: GCP project id
+    :param job: job name
+    :param retries: number of attempts before giving up
+    :return: dict containing job description (jobId, state, ...)
+    """
+    request = mlapi.projects().jobs().get(name='projects/' + project_id + '/jobs/' + job)
+    counter = 0
+    while True:
+        try:
+            tracing.add_requests()
+            return request.execute()
+        except Exception as err:
+            counter += 1
+            if counter >= retries or not is_transient_error(err):
+                raise
+            metrics.inc_counter('gcpaiutils_mlapi_retries_total', method='ml.projects.jobs.get', reason='error')
+            sleep(60)
+
+
+def get_reusable_job_state(mlapi, project_id, job):
+    """
+    Fetches the state of a job whose outputs may be reused (e.g. a training cache hit). Jobs that cannot be found
+    (404, e.g. purged) or read (403, e.g. in a project no longer accessible) are treated as missing.
+
+    :param mlapi: ML API discovery client
+    :param project_id: GCP project id
+    :param job: job name
+    :return: job state, None if the job is missing
+    """
+    try:
+        return get_job_info(mlapi, project_id, job)['state']
+    except errors.HttpError as err:
+        if err.resp.status not in [403, 404]:
+            raise
+        logging.warning("Job {} not available in project {}: {}".format(job, project_id, err._get_reason()))
+        return None
+
+
+def get_cached_job(mlapi, cache, fingerprint, project_id, ttl=None):
+    """
+    Looks up the training cache. Entries are stored at submission time, so an entry is only a hit once its job has
+    SUCCEEDED; entries of failed, cancelled, running or missing jobs are misses.
+
+    :param mlapi: ML API discovery client
+    :param cache: TrainingCache
+    :param fingerprint: training fingerprint (see get_training_fingerprint())
+    :param project_id: GCP project id of jobs whose cache entry does not record one
+    :param ttl: maximum age of the cache entry in seconds (no expiry if None)
+    :return: tuple of job name and project id of the job, (None, None) on cache miss
+    """
+    cached_job = cache.lookup(fingerprint, ttl=ttl)
+    if cached_job is None:
+        return None, None
+    cached_project_id = cache.projects.get(cached_job, project_id)
+    if get_reusable_job_state(mlapi, cached_project_id, cached_job) != 'SUCCEEDED':
+        logging.info("Training cache entry not reusable: {}".format(cached_job))
+        return None, None
+    return cached_job, cached_project_id
+
+
+def is_transient_error(err):
+    """:return: True if a failed API request is worth retrying (429, 5xx, transport errors)"""
+    if isinstance(err, errors.HttpError):
+        return err.resp.status == 429 or err.resp.status >= 500
+    return isinstance(err, (OSError, httplib2.HttpLib2Error))  # connection errors and socket timeouts included
+
+
+def cancel_jobs(mlapi, project_id, jobs):
+    """
+    Requests cancellation of jobs on GCP AI Platform. Jobs that cannot be cancelled (e.g. already finished) are skipped.
+
+    :param mlapi: ML API discovery client
+    :param project_id: GCP project id
+    :param jobs: list of job names
+    :return: list of job names whose cancellation was accepted
+    """
+    cancelled_jobs = []
+    for job in jobs:
+        try:
+            tracing.add_requests()
+            mlapi.projects().jobs().cancel(name='projects/' + project_id + '/jobs/' + job).execute()
+            cancelled_jobs.append(job)
+            logging.warning("Job cancelled: {}".format(job))
+        except errors.HttpError as err:
+            logging.warning("Unable to cancel job {}: {}".format(job, err._get_reason()))
+    return cancelled_jobs
+
+
+def cancel_routed_jobs(mlapi, projects, project_id, jobs):
+    """
+    Requests cancellation of jobs spread across projects (see cancel_jobs()).
+
+    :param mlapi: ML API discovery client
+    :param projects: dict containing job names as keys and GCP project id as value
+    :param project_id: GCP project id of jobs missing from projects
+    :param jobs: list of job names
+    :return: list of job names whose cancellation was accepted
+    """
+    jobs_by_project = {}
+    for job in jobs:
+        jobs_by_project.setdefault(projects.get(job, project_id), []).append(job)
+    cancelled_jobs = []
+    for job_project_id, project_jobs in jobs_by_project.items():
+        cancelled_jobs += cancel_jobs(mlapi, job_project_id, project_jobs)
+    return cancelled_jobs
+
+
+def get_job_duration(job_info, now=None):
+    """
+    Computes how long a job has been alive on GCP AI Platform, from creation (queueing and provisioning included) to
+    end time or, for unfinished jobs, to now.
+
+    :param job_info: job description as returned by get_job_info()
+    :param now: current epoch time (defaults to time())
+    :return: duration in seconds, None if creation time is unknown
+    """
+    if not job_info.get('createTime'):
+        return None
+    end_time = parse_rfc3339(job_info['endTime']) if job_info.get('endTime') else (now or time())
+    return end_time - parse_rfc3339(job_info['createTime'])
+
+
+def get_stragglers(jobs, job_info, expected_durations=None, straggler_factor=2.0, now=None):
+    """
+    Detects jobs running far longer than expected. A job is a straggler when its age exceeds straggler_factor times
+    its reference duration: the expected duration if one is given, otherwise the median duration of the sibling jobs
+    that already succeeded (only once at least half of the siblings succeeded).
+
+    :param jobs: list of unfinished jobs to assess
+    :param job_info: dict containing job names as keys and job descriptions (siblings included) as value
+    :param expected_durations: dict containing job names as keys and expected duration (in seconds) as value
+    :param straggler_factor: tolerance multiplier applied to the reference duration
+    :param now: current epoch time (defaults to time())
+    :return: list of stragglers
+    """
+    expected_durations = expected_durations or {}
+    completed_durations = [get_job_duration(info) for info in job_info.values() if info['state'] == 'SUCCEEDED']
+    completed_durations = [d for d in completed_durations if d is not None]
+    sibling_reference = None
+    if completed_durations and len(completed_durations) >= len(job_info) / 2:
+        sibling_reference = median(completed_durations)
+
+    stragglers = []
+    for job in jobs:
+        reference = expected_durations.get(job, sibling_reference)
+        duration = get_job_duration(job_info[job], now=now)
+        if reference is not None and duration is not None and duration > straggler_factor * reference:
+            stragglers.append(job)
+    return stragglers
+
+
+def get_mlapi_client(_globals):
+    """
+    Builds ML API discovery client using AI Platform service account credentials (defaults if not found), see
+    build_mlapi_client(). With JOB_EXECUTOR: 'local' in the deployment config, returns the local job executor instead
+    (see local.py).
+
+    :param _globals: deployment configuration dict
+    :return: ML API discovery client
+    """
+    return get_status_client(_globals)
+
+
+def get_job_handles(_globals, jobs, group=None):
+    """
+    Serializes submitted jobs to JSON-friendly handles that can be pushed to XCom and re-attached by any worker.
+
+    :param _globals: deployment configuration dict
+    :param jobs: list of job names
+    :param group: optional group identifier (e.g. index of the aggregation strategy)
+    :return: list of dicts with keys job_id, project_id (project the job was routed to; and group, if given)
+    """
+    router = get_job_router(_globals)
+    handles = []
+    for job in jobs:
+        handle = {'job_id': job, 'project_id': router.get_project(job, _globals["PROJECT_ID"])}
+        if group is not None:
+            handle['group'] = group
+        handles.append(handle)
+    return handles
+
+
+@tracing.traced('wrappers.check_jobs')
+def check_jobs(deployment_config, jobs, projects=None):
+    """
+    Checks job status on GCP AI Platform once, without waiting. Stateless: safe to call from a sensor poke or a
+    deferrable trigger. Served by the per-host poller daemon when it runs (see poller.py).
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param jobs: list of jobs to check
+    :param projects: dict containing job names as keys and GCP project id as value (e.g. from job handles). Jobs
+                     missing from it are looked up in the job router, then in PROJECT_ID.
+    :return: dict containing job names as keys and current job state as value
+    """
+    GLOBALS = get_deployment_config(deployment_config)
+    router = get_job_router(GLOBALS)
+    projects = {job: (projects or {}).get(job) or router.get_project(job, GLOBALS["PROJECT_ID"]) for job in jobs}
+    job_info = _get_watched_job_info(get_poller(GLOBALS), deployment_config, projects) or {}
+    mlapi = get_mlapi_client(GLOBALS) if len(job_info) < len(jobs) else None
+    return {job: (job_info[job] if job in job_info else get_job_info(mlapi, projects[job], job))['state']
+            for job in jobs}
+
+
+@tracing.traced('wrappers.poke_jobs')
+def poke_jobs(deployment_config, submit_task_id, fail_fast=True, cancel_on_failure=False, **kwargs):
+    """
+    Single-shot completion check of jobs pushed to XCom by a submit_* wrapper. Meant as python_callable of a
+    reschedule-mode PythonSensor: the worker slot is released between pokes and a worker restart does not lose track
+    of the jobs. Once every job is done, successful jobs are pushed to XCom (key 'successful_jobs') exactly as the
+    blocking wrappers do.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param submit_task_id: id of the task that submitted the jobs
+    :param fail_fast: raise JobFailedError as soon as one job failed
+    :param cancel_on_failure: when failing fast, cancel all jobs that are still running
+    :param kwargs:
+    :return: True when all jobs are done, False otherwise
+    """
+    handles = kwargs['task_instance'].xcom_pull(task_ids=submit_task_id, key='submitted_jobs')
+    jobs = [handle['job_id'] for handle in handles]
+    projects = {handle['job_id']: handle['project_id'] for handle in handles if handle.get('project_id')}
+    status = check_jobs(deployment_config, jobs, projects=projects)
+
+    failed_jobs = [job for job, state in status.items() if state in FAILURE_STATES]
+    if fail_fast and failed_jobs:
+        cancelled_jobs = []
+        if cancel_on_failure:
+            GLOBALS = get_deployment_config(deployment_config)
+            cancelled_jobs = cancel_routed_jobs(get_mlapi_client(GLOBALS), projects, GLOBALS["PROJECT_ID"],
+                                                [job for job, state in status.items() if state not in TERMINAL_STATES])
+            kwargs['task_instance'].xcom_push(key='cancelled_jobs', value=cancelled_jobs)
+        raise JobFailedError("Jobs failed: {}. Cancelled sibling jobs: {}".format(failed_jobs, cancelled_jobs),
+                             status=status, failed_jobs=failed_jobs, cancelled_jobs=cancelled_jobs)
+
+    if any(state not in TERMINAL_STATES for state in status.values()):
+        logging.info("Waiting for jobs:")
+        for job, state in status.items():
+            if state not in TERMINAL_STATES:
+                logging.info(job)
+        return False
+
+    if any('group' in handle for handle in handles):
+        groups = sorted(set(handle['group'] for handle in handles))
+        successful_jobs = [get_job_assessment({handle['job_id']: status[handle['job_id']] for handle in handles
+                                               if handle['group'] == group}) for group in groups]
+    else:
+        successful_jobs = get_job_assessment(status)
+    kwargs['task_instance'].xcom_push(key='successful_jobs', value=successful_jobs)
+    return True
+
+
+@tracing.traced('wrappers.poll')
+def poll(deployment_config, time_interval, jobs, fail_fast=False, cancel_on_failure=False, deadline=None,
+         expected_durations=None, straggler_factor=None, resubmit=None, on_complete=None):
+    """
+    Monitors job status on GCP AI Platform. Each job is checked in the project it was routed to (see routing.py).
+    When the per-host poller daemon runs (POLLER_SOCKET, see poller.py), statuses come from its shared sweep and
+    state changes are noticed without waiting for the end of time_interval.
+
+    Stragglers (see get_stragglers()) can be speculatively resubmitted: the copy keeps running alongside the original,
+    the first one to succeed wins and the other one is cancelled. Each job is resubmitted at most once.
 
     :param deployment_config: YAML file containing all deployment variables
     :param time_interval: interval (in seconds) between two consecutive checks
     :param jobs: list of jobs to monitor
-    :return: dict containing job names as keys and job status (SUCCEEDED, FAILED) as value
+    :param fail_fast: raise JobFailedError as soon as one job fails instead of waiting for all jobs to finish
+    :param cancel_on_failure: when failing fast or hitting the deadline, cancel all jobs that are still running
+    :param deadline: maximum time (in seconds) to wait. Raises JobTimeoutError when exceeded
+    :param expected_durations: dict containing job names as keys and expected duration (in seconds) as value
+    :param straggler_factor: enables straggler detection. Tolerance multiplier applied to expected durations
+    :param resubmit: dict containing job names as keys and a callable as value. The callable takes no argument,
+                     submits a fresh copy of the job and returns the new job name (None if submission failed)
+    :param on_complete: callable invoked once per job as soon as it is done, with arguments (job, effective job name,
+                        status). Lets callers process outputs while sibling jobs are still running.
+    :return: dict containing job names as keys and job status (SUCCEEDED, FAILED, CANCELLED) as value. When a
+             speculative copy wins, its name replaces the original one.
     """
 
     GLOBALS = get_deployment_config(deployment_config)
+    mlapi = get_mlapi_client(GLOBALS)
+    router = get_job_router(GLOBALS)
+    projects = router.projects
+    poller = get_poller(GLOBALS)
+
+    start_time = time()
+    resubmit = resubmit or {}
+    copies = {job: [job] for job in jobs}  # original job first, then its speculative copy (if any)
+    job_info = {}
+    status = {}
+    effective_jobs = {}
+    wait_time = 0  # first check is immediate
+    watched_jobs = metrics.StateGauge('gcpaiutils_poll_watched_jobs')
     try:
-        ai_credentials = Credentials.from_service_account_file(GLOBALS["AI_PLATFORM_SA"])
-    except:
-        ai_credentials = None
-
-    mlapi = discovery.build('ml', 'v1', credentials=ai_credentials, cache_discovery=False)
-
-    still_running = True
-    while still_running:
-        status = {}
-        states = 1
-        for job in jobs:
-            request = mlapi.projects().jobs().get(name='projects/' + GLOBALS["PROJECT_ID"] + '/jobs/' + job)
-            counter = 0
-            done = False
-            while counter < 10 and done is False:
-                try:
-                    jobs_info = request.execute()  # manage retries for HTTP errors. Should design a decorator.
-                    done = True
-                except:
-                    sleep(60)
-                    counter += 1
-            status[job] = jobs_info['state']
-            states *= (jobs_info['state'] in ["SUCCEEDED", "FAILED"])
-        if states:
-            still_running = False
-        else:
+        while True:
+            watched_info = {}
+            if poller is not None:
+                pending = [copy for job in jobs if job not in status for copy in copies[job]
+                           if job_info.get(copy, {}).get('state') not in TERMINAL_STATES]
+                watched_info = _get_watched_job_info(
+                    poller, deployment_config, {copy: projects.get(copy, GLOBALS["PROJECT_ID"]) for copy in pending},
+                    known={copy: job_info[copy]['state'] for copy in pending if copy in job_info}, timeout=wait_time)
+                if watched_info is None:
+                    poller, watched_info = None, {}
+            for job in jobs:
+                if job in status:
+                    continue  # finished jobs do not change state anymore
+                for copy in copies[job]:
+                    if copy not in job_info or job_info[copy]['state'] not in TERMINAL_STATES:
+                        job_info[copy] = watched_info[copy] if copy in watched_info else \
+                            get_job_info(mlapi, projects.get(copy, GLOBALS["PROJECT_ID"]), copy)
+                        if job_info[copy]['state'] in TERMINAL_STATES:
+                            router.release(copy)
+                            _observe_detection(job_info[copy], 'poller' if copy in watched_info else 'api')
+                copy_states = {copy: job_info[copy]['state'] for copy in copies[job]}
+                winners = [copy for copy, state in copy_states.items() if state == 'SUCCEEDED']
+                if winners:
+                    status[job], effective_jobs[job] = 'SUCCEEDED', winners[0]
+                    cancel_routed_jobs(mlapi, projects, GLOBALS["PROJECT_ID"],
+                                       [copy for copy, state in copy_states.items() if state not in TERMINAL_STATES])
+                elif all(state in TERMINAL_STATES for state in copy_states.values()):
+                    status[job], effective_jobs[job] = copy_states[job], job
+                if on_complete is not None and job in status:
+                    on_complete(job, effective_jobs[job], status[job])
+                if fail_fast and status.get(job) in FAILURE_STATES:
+                    logging.error("Job {}: {}".format(status[job].lower(), job))
+                    cancelled_jobs = []
+                    if cancel_on_failure:
+                        cancelled_jobs = cancel_routed_jobs(mlapi, projects, GLOBALS["PROJECT_ID"],
+                                                            _get_running_copies(copies, job_info))
+                    raise JobFailedError("Job {} failed. Cancelled sibling jobs: {}".format(job, cancelled_jobs),
+                                         status=_get_status(jobs, status, job_info), failed_jobs=[job],
+                                         cancelled_jobs=cancelled_jobs)
+            if len(status) == len(jobs):
+                return {effective_jobs[job]: status[job] for job in jobs}
+            watched_jobs.update(Counter(job_info[copy]['state'] for job in jobs if job not in status
+                                        for copy in copies[job] if job_info[copy]['state'] not in TERMINAL_STATES))
+
+            running_jobs = [job for job in jobs if job not in status]
+            if deadline is not None and time() - start_time > deadline:
+                logging.error("Deadline of {}s exceeded while waiting for jobs: {}".format(deadline, running_jobs))
+                cancelled_jobs = []
+                if cancel_on_failure:
+                    cancelled_jobs = cancel_routed_jobs(mlapi, projects, GLOBALS["PROJECT_ID"],
+                                                        _get_running_copies(copies, job_info))
+                raise JobTimeoutError("Deadline exceeded. Cancelled jobs: {}".format(cancelled_jobs),
+                                      status=_get_status(jobs, status, job_info), failed_jobs=running_jobs,
+                                      cancelled_jobs=cancelled_jobs)
+
+            if straggler_factor is not None:
+                for job in get_stragglers([job for job in running_jobs if len(copies[job]) == 1],
+                                          {job: job_info[job] for job in jobs},
+                                          expected_durations=expected_durations, straggler_factor=straggler_factor):
+                    logging.warning("Straggler detected: {}".format(job))
+                    if job in resubmit:
+                        copy = resubmit[job]()
+                        if copy is not None:
+                            copies[job].append(copy)
+                            logging.warning("Speculative copy of {} submitted: {}".format(job, copy))
+
             logging.info("Waiting for jobs:")
-            for key, value in status.items():
-                if value not in ["SUCCEEDED", "FAILED"]:
-                    logging.info(key)
-            sleep(time_interval)
-    return status
+            for job in running_jobs:
+                logging.info(job)
+            wait_time = time_interval
+            if deadline is not None:
+                wait_time = max(0, min(time_interval, deadline - (time() - start_time)))
+            if poller is None:
+                sleep(wait_time)  # otherwise the poller daemon waits for the next state change
+    finally:
+        watched_jobs.clear()
+
+
+def _get_watched_job_info(poller, deployment_config, projects, known=None, timeout=0):
+    # job descriptions from the poller daemon: {} without daemon, None once the daemon failed (callers poll directly)
+    if poller is None:
+        return {}
+    try:
+        return poller.get_job_info(deployment_config, projects, known=known, timeout=timeout)
+    except (OSError, ValueError) as err:
+        logging.warning("Poller daemon unavailable, polling directly: {}".format(err))
+        return None
+
+
+def _observe_detection(job_info, source):
+    # time between the end of a job and poll() noticing it (polling lag)
+    if metrics.is_enabled() and job_info.get('endTime'):
+        metrics.observe('gcpaiutils_poll_detection_seconds', max(0, time() - parse_rfc3339(job_info['endTime'])),
+                        source=source)
+
 
+def _get_running_copies(copies, job_info):
+    return [copy for job_copies in copies.values() for copy in job_copies
+            if job_info.get(copy, {}).get('state') not in TERMINAL_STATES]
 
-def train(deployment_config, atom=None, atom_params=None, hyperspace=None, **kwargs):
+
+def _get_status(jobs, status, job_info):
+    return {job: status.get(job, job_info.get(job, {}).get('state')) for job in jobs}
+
+
+def get_resubmitter(spec_handler_class, job_handler_class, deployment_config, **spec_kwargs):
+    """
+    Builds a callable that submits a fresh copy (new job name) of a job. Used for speculative resubmission in poll().
+
+    :param spec_handler_class: JobSpecHandler subclass used to build the original job
+    :param job_handler_class: JobHandler subclass used to submit the original job
+    :param deployment_config: YAML file containing all deployment variables
+    :param spec_kwargs: keyword arguments used to instantiate the original spec handler (copied, since handlers mutate
+                        their inputs)
+    :return: callable returning the new job name, None if submission failed
+    """
+    spec_kwargs = deepcopy(spec_kwargs)
+
+    def resubmit():
+        return submit_job_once(None, spec_handler_class, job_handler_class, deployment_config, **deepcopy(spec_kwargs))
+
+    return resubmit
+
+
+def get_score_packs(models, data_size, max_pack_size=1, model_memory_factor=2):
+    """
+    Packs models sharing a scoring image into as few score jobs as memory allows. Each pack runs on the largest
+    machine type required by its models; models are added to a pack while their in-memory footprint fits the memory
+    left once scoring data is loaded (see get_memory_headroom()).
+
+    :param models: list of dicts with keys image_uri, model_size (GB) and master_type
+    :param data_size: scoring data size in GB
+    :param max_pack_size: maximum number of models in a job (1 disables packing)
+    :param model_memory_factor: in-memory size of a model over its size on storage
+    :return: list of (master_type, list of models) tuples
+    """
+    groups = {}
+    for model in models:
+        groups.setdefault(model['image_uri'], []).append(model)
+
+    packs = []
+    for group in groups.values():
+        master_type = max((model['master_type'] for model in group), key=lambda m: MACHINE_MEMORY.get(m, 0))
+        headroom = get_memory_headroom(master_type, data_size) if max_pack_size > 1 else 0
+        pack, pack_memory = [], 0
+        for model in group:
+            model_memory = model['model_size'] * model_memory_factor
+            if pack and (len(pack) >= max_pack_size or pack_memory + model_memory > headroom):
+                packs.append((master_type if len(pack) > 1 else pack[0]['master_type'], pack))
+                pack, pack_memory = [], 0
+            pack.append(model)
+            pack_memory += model_memory
+        if pack:
+            packs.append((master_type if len(pack) > 1 else pack[0]['master_type'], pack))
+    return packs
+
+
+def wait_for_jobs(deployment_config, jobs, fail_fast=False, cancel_on_failure=False, deadline=None,
+                  expected_durations=None, straggler_factor=None, resubmit=None, on_complete=None, **kwargs):
+    """
+    Polls jobs until completion and returns successful ones. When a fail-fast poll cancels sibling jobs, their names
+    are pushed to XCom (key 'cancelled_jobs') before the error is re-raised.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param jobs: list of jobs to monitor
+    :param fail_fast: see poll()
+    :param cancel_on_failure: see poll()
+    :param deadline: see poll()
+    :param expected_durations: see poll()
+    :param straggler_factor: see poll()
+    :param resubmit: see poll()
+    :param on_complete: see poll()
+    :param kwargs:
+    :return: list of successful jobs
+    """
+    try:
+        status = poll(deployment_config, TIME_INTERVAL, jobs, fail_fast=fail_fast, cancel_on_failure=cancel_on_failure,
+                      deadline=deadline, expected_durations=expected_durations, straggler_factor=straggler_factor,
+                      resubmit=resubmit, on_complete=on_complete)
+    except JobFailedError as err:
+        if err.cancelled_jobs:
+            kwargs['task_instance'].xcom_push(key='cancelled_jobs', value=err.cancelled_jobs)
+        raise
+    return get_job_assessment(status)
+
+
+def wait_for_job_groups(deployment_config, groups, fail_fast=False, cancel_on_failure=False, deadline=None, **kwargs):
+    """
+    Polls several groups of jobs (e.g. one per aggregation strategy) in a single watch, so that waiting takes as long
+    as the slowest job rather than the sum over groups.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param groups: list of lists of jobs
+    :param fail_fast: see poll(). Applies across groups.
+    :param cancel_on_failure: see poll(). Applies across groups.
+    :param deadline: see poll()
+    :param kwargs:
+    :return: list of successful jobs for each group
+    """
+    jobs = [job for group in groups for job in group]
+    try:
+        status = poll(deployment_config, TIME_INTERVAL, jobs, fail_fast=fail_fast, cancel_on_failure=cancel_on_failure,
+                      deadline=deadline)
+    except JobFailedError as err:
+        if err.cancelled_jobs:
+            kwargs['task_instance'].xcom_push(key='cancelled_jobs', value=err.cancelled_jobs)
+        raise
+    effective_status = list(status.items())  # follows order of jobs
+    successful_jobs, position = [], 0
+    for group in groups:
+        successful_jobs.append(get_job_assessment(dict(effective_status[position:position + len(group)])))
+        position += len(group)
+    return successful_jobs
+
+
+@tracing.traced('wrappers.train')
+def train(deployment_config, atom=None, atom_params=None, hyperspace=None, fail_fast=False, deadline=None,
+          expected_duration=None, straggler_factor=None, speculative=False, use_cache=False, force_retrain=False,
+          cache_ttl=None, prefetch_info=False, **kwargs):
     """
     Submits train job to GCP AI Platform and waits for completion. Compute is done remotely.
 
@@ -75,9 +562,75 @@ def train(deployment_config, atom=None, atom_params=None, hyperspace=None, **kwa
     :param atom: algorithm name as tagged in Container Registry (atom)
     :param atom_params: user-specified parameters to configurate atom (useful to overwrite atom defaults with no tuning)
     :param hyperspace: hyper-parameter tuning configuration
+    :param fail_fast: raise as soon as a job fails (default: best-effort, wait for every job)
+    :param deadline: maximum time (in seconds) to wait for the train job
+    :param expected_duration: expected train job duration (in seconds), used for straggler detection
+    :param straggler_factor: flag the job as straggler once it runs longer than straggler_factor * expected_duration
+    :param speculative: resubmit a copy of a straggling job and keep whichever finishes first
+    :param use_cache: reuse the model of a previous successful job with identical atom, image, arguments,
+                      hyper-parameters, training data and machine type instead of training again
+    :param force_retrain: ignore cached models (the new model is still recorded in the cache)
+    :param cache_ttl: maximum age (in seconds) of a reusable cached model. None means no expiry.
+    :param prefetch_info: download info files of the job into the local staging area of the DAG run (see
+                          prefetch.py) as soon as it succeeds, so that selection tasks running on the same host start
+                          right away
+    :param kwargs:
+    :return:
+    """
+    submitted_jobs, resubmit = _submit_train(deployment_config, atom=atom, hyperspace=hyperspace,
+                                             speculative=speculative, use_cache=use_cache,
+                                             force_retrain=force_retrain, cache_ttl=cache_ttl, **kwargs)
+    expected_durations = None
+    if expected_duration is not None:
+        expected_durations = {job: expected_duration for job in submitted_jobs}
+    prefetcher = None
+    if prefetch_info:
+        _globals = get_deployment_config(deployment_config)
+        staging_dir = get_staging_dir(_globals, kwargs)
+        if staging_dir is None:
+            logging.warning("Info files are only prefetched within an Airflow DAG run.")
+        else:
+            prune_staging_dirs(_globals)
+            prefetcher = InfoPrefetcher(get_storage_client(_globals), _globals["MODEL_BUCKET_NAME"],
+                                        get_model_prefix(kwargs), staging_dir)
+    try:
+        successful_jobs = wait_for_jobs(deployment_config, submitted_jobs, fail_fast=fail_fast, deadline=deadline,
+                                        expected_durations=expected_durations, straggler_factor=straggler_factor,
+                                        resubmit=resubmit, on_complete=prefetcher.on_complete if prefetcher else None,
+                                        **kwargs)
+    except Exception:
+        if prefetcher is not None:
+            prefetcher.wait()
+            prefetcher.cleanup()  # selection may not run: do not leave staged files behind
+        raise
+    if prefetcher is not None:
+        prefetcher.wait()
+    kwargs['task_instance'].xcom_push(key='successful_jobs', value=successful_jobs)
+
+
+@tracing.traced('wrappers.submit_train')
+def submit_train(deployment_config, atom=None, atom_params=None, hyperspace=None, use_cache=False,
+                 force_retrain=False, cache_ttl=None, **kwargs):
+    """
+    Submits train job to GCP AI Platform without waiting for completion. Job handles are pushed to XCom (key
+    'submitted_jobs'); pair with poke_jobs() in a reschedule-mode sensor.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param atom: algorithm name as tagged in Container Registry (atom)
+    :param atom_params: user-specified parameters to configurate atom (useful to overwrite atom defaults with no tuning)
+    :param hyperspace: hyper-parameter tuning configuration
+    :param use_cache: see train()
+    :param force_retrain: see train()
+    :param cache_ttl: see train()
     :param kwargs:
     :return:
     """
+    _submit_train(deployment_config, atom=atom, hyperspace=hyperspace, use_cache=use_cache,
+                  force_retrain=force_retrain, cache_ttl=cache_ttl, **kwargs)
+
+
+def _submit_train(deployment_config, atom=None, hyperspace=None, speculative=False, use_cache=False,
+                  force_retrain=False, cache_ttl=None, **kwargs):
     _globals = get_deployment_config(deployment_config)
     use_hyperspace = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='use_hyperspace')
     hypertune = hyperspace is not None and use_hyperspace == 'True'
@@ -101,9 +654,16 @@ def train(deployment_config, atom=None, atom_params=None, hyperspace=None, **kwa
     metadata = get_metadata(_globals, 'TRAIN', kwargs)
 
     submitted_jobs = []
+    resubmit = {}
     hardware_config = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='hardware_config')
+    cluster_config = {}
     if hardware_config is None or 'dummy' in atom:
-        trainingInput["masterType"] = get_hardware_config(atom=atom, data_size=metadata['size'], scoring=False)
+        cluster_config = get_cluster_config(atom=atom, data_size=metadata['size'])
+        if cluster_config:
+            logging.info("Distributed training on {} workers.".format(cluster_config['workerCount']))
+            trainingInput.update(cluster_config)
+        else:
+            trainingInput["masterType"] = get_hardware_config(atom=atom, data_size=metadata['size'], scoring=False)
     else:
         trainingInput["masterType"] = hardware_config
 
@@ -111,157 +671,115 @@ def train(deployment_config, atom=None, atom_params=None, hyperspace=None, **kwa
         trainingInput["hyperparameters"] = hyperspace[atom]
         trainingInput["hypertuneLoss"] = hyperspace[atom]["hyperparameterMetricTag"]
 
-    S = TrainJobSpecHandler(deployment_config=deployment_config, algorithm=atom, inputs=trainingInput,
-                            hypertune=hypertune, request_ids={'user': get_user(kwargs),
-                                                              'problem': get_problem(kwargs),
-                                                              'version': get_version(kwargs)})
-    S.create_job_specs()
-    T = TrainJobHandler(deployment_config=deployment_config, job_executor='mlapi')
-    T.submit_job(S.job_specs)
-    if T.success:
-        submitted_jobs.append(S.job_specs['jobId'])
-        logging.info("Train request successful: {}".format(S.job_specs['jobId']))
+    if use_cache:
+        cache = get_training_cache(_globals, kwargs)
+        fingerprint = get_training_fingerprint(atom, get_deployment_constants(_globals)['ATOMS'][atom][0],
+                                               trainingInput.get('args'), trainingInput.get('hyperparameters'),
+                                               get_blob_fingerprints(cache.gcs_client, train_files),
+                                               [trainingInput["masterType"], cluster_config] if cluster_config else
+                                               trainingInput["masterType"])
+        cached_job, cached_project_id = (None, None) if force_retrain else \
+            get_cached_job(get_mlapi_client(_globals), cache, fingerprint, _globals["PROJECT_ID"], ttl=cache_ttl)
+        if cached_job is not None:
+            get_job_router(_globals).register(cached_job, cached_project_id)
+            logging.info("Training cache hit, reusing model trained by: {}".format(cached_job))
+            kwargs['task_instance'].xcom_push(key='submitted_jobs', value=get_job_handles(_globals, [cached_job]))
+            return [cached_job], {}
+
+    spec_kwargs = {'algorithm': atom, 'inputs': trainingInput, 'hypertune': hypertune,
+                   'request_ids': {'user': get_user(kwargs), 'problem': get_problem(kwargs),
+                                   'version': get_version(kwargs)}}
+    if speculative:
+        resubmitter = get_resubmitter(TrainJobSpecHandler, TrainJobHandler, deployment_config, **spec_kwargs)
+    job_id = submit_job_once(get_submission_journal(_globals, kwargs), TrainJobSpecHandler, TrainJobHandler,
+                             deployment_config, **spec_kwargs)
+    if job_id is not None:
+        submitted_jobs.append(job_id)
+        logging.info("Train request successful: {}".format(job_id))
+        if use_cache:
+            cache.store(fingerprint, job_id, project_id=get_job_router(_globals).get_project(job_id))
+        if speculative:
+            resubmit[job_id] = resubmitter
     else:
         raise ValueError("Unable to submit train job.")
 
-    status = poll(deployment_config, TIME_INTERVAL, submitted_jobs)
-    kwargs['task_instance'].xcom_push(key='successful_jobs', value=get_job_assessment(status))
+    kwargs['task_instance'].xcom_push(key='submitted_jobs', value=get_job_handles(_globals, submitted_jobs))
+    return submitted_jobs, resubmit
 
 
-def new_selection_from_folder(deployment_config=None, selector_class_dict=None, **kwargs):
+@tracing.traced('wrappers.new_selection_from_folder')
+def new_selection_from_folder(deployment_config=None, selector_class_dict=None, max_workers=None, **kwargs):
     """
     Selects among trained models found in MODELS folder those that will make it to production. Compute is done locally.
 
     :param deployment_config: YAML file containing all deployment variables
     :param selector_class_dict: dict of customized BaseSelector object. Dict keys are strategy names.
+    :param max_workers: number of processes evaluating strategies concurrently. Defaults to SELECTION_WORKERS
+                        (deployment config) or 1.
     :param kwargs:
     :return:
     """
     _globals = get_deployment_config(deployment_config)
 
-    evaluation_metric = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='evaluation_metric')
-
     # Retrieve blob list from MODELS folder
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'])
+    gcs_client = get_storage_client(_globals)
     gcs_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
 
     # Import from GCS
     path_prefix = os.path.join(get_user(kwargs), "ACTIVE_MODELS", get_problem(kwargs))
-    gcs_all_blobs = list(gcs_bucket.list_blobs(prefix=path_prefix))
-    gcs_info_blob_list = [item for item in gcs_all_blobs if item.name.split("/")[-1].startswith("info")]
-    gcs_stratified_info_blob_list = [item for item in gcs_all_blobs if item.name.split("/")[-1].startswith("stratified_info")]
-    gcs_blob_list = gcs_info_blob_list + gcs_stratified_info_blob_list
-
-    # Call a selection method
-    job_list = set([item.name.split("/")[-2] for item in gcs_blob_list])
-    info_dir = make_temp_dir(os.getcwd())
-    for job in job_list:
-        # download in dir with job name
-        tmp_dir_name = "{}/{}".format(info_dir, job)
-        os.mkdir(tmp_dir_name)
-
-        for gcs_source_blob in [blob for blob in gcs_blob_list if job in blob.name]:
-            local_destination = os.path.join(tmp_dir_name, gcs_source_blob.name.split("/")[-1])
-            gcs_source_blob.download_to_filename(local_destination, client=gcs_client)  # TODO: make this multithread
-
-        # concatenate file name to match GCS flat namespace
-        for file in [f for f in os.listdir(tmp_dir_name) if os.path.isfile(os.path.join(tmp_dir_name, f))]:
-            os.rename(os.path.join(tmp_dir_name, file),
-                      os.path.join(info_dir, '_'.join([job, file])))
-
-        # remove dir
-        rmtree(tmp_dir_name)
-
-    # make sure selector_class_dict is imported in this module
-    root_dest_uri = f"gs://{_globals['MODEL_BUCKET_NAME']}/{get_user(kwargs)}/SELECTOR/{get_problem(kwargs)}/"
-
-    selected_info = {}
-    for key, d in selector_class_dict.items():
-        S = d['selector'](deployment_config=deployment_config, model_dir=info_dir, evaluation_metric=evaluation_metric,
-                          problem_type='classification', n_class=5, verbose=True)
-        dest_uri = root_dest_uri + key + "/"  # dict key is strategy name
-        if 'kwargs' not in d.keys():
-            d['kwargs'] = {}
-        selected_info[key] = S.select(destination_uri=dest_uri, validation_schema=d['validation_schema'], **d['kwargs'])
-    rmtree(info_dir)
+    with tracing.span('gcs.list_blobs', prefix=path_prefix) as sp:
+        gcs_all_blobs = list(gcs_bucket.list_blobs(prefix=path_prefix))
+        sp.add_requests()
 
+    selected_info = _select(deployment_config, _globals, selector_class_dict, gcs_client,
+                            _group_info_blobs(gcs_all_blobs), kwargs, max_workers=max_workers)
     kwargs['task_instance'].xcom_push(key='selected_info', value=selected_info)
 
 
-def selection_from_folder(deployment_config, selector_class_dict=None, **kwargs):
+@tracing.traced('wrappers.selection_from_folder')
+def selection_from_folder(deployment_config, selector_class_dict=None, max_workers=None, **kwargs):
     """
     Selects among trained models found in MODELS folder those that will make it to production. Compute is done locally.
 
     :param deployment_config: YAML file containing all deployment variables
     :param selector_class_dict: dict of customized BaseSelector object. Dict keys are strategy names.
+    :param max_workers: number of processes evaluating strategies concurrently. Defaults to SELECTION_WORKERS
+                        (deployment config) or 1.
     :param kwargs:
     :return:
     """
     _globals = get_deployment_config(deployment_config)
 
-    evaluation_metric = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='evaluation_metric')
-
     # Retrieve blob list from MODELS folder
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
     gcs_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
 
     # Import from GCS
     path_prefix = os.path.join(get_user(kwargs), get_problem(kwargs), get_version(kwargs), "MODELS")
-    gcs_all_blobs = list(gcs_bucket.list_blobs(prefix=path_prefix))
-    gcs_info_blob_list = [item for item in gcs_all_blobs if item.name.split("/")[-1].startswith("info")]
-    gcs_stratified_info_blob_list = [item for item in gcs_all_blobs if item.name.split("/")[-1].startswith("stratified_info")]
-    gcs_blob_list = gcs_info_blob_list + gcs_stratified_info_blob_list
-
-    # Call a selection method
-    job_list = set([item.name.split("/")[-2] for item in gcs_blob_list])
-    info_dir = make_temp_dir(os.getcwd())
-    for job in job_list:
-        # download in dir with job name
-        tmp_dir_name = "{}/{}".format(info_dir, job)
-        os.mkdir(tmp_dir_name)
-
-        for gcs_source_blob in [blob for blob in gcs_blob_list if job in blob.name]:
-            local_destination = os.path.join(tmp_dir_name, gcs_source_blob.name.split("/")[-1])
-            gcs_source_blob.download_to_filename(local_destination, client=gcs_client)  # TODO: make this multithread
-
-        # concatenate file name to match GCS flat namespace
-        for file in [f for f in os.listdir(tmp_dir_name) if os.path.isfile(os.path.join(tmp_dir_name, f))]:
-            os.rename(os.path.join(tmp_dir_name, file),
-                      os.path.join(info_dir, '_'.join([job, file])))
-
-        # remove dir
-        rmtree(tmp_dir_name)
-
-    # make sure selector_class_dict is imported in this module
-    root_dest_uri = f"gs://{_globals['MODEL_BUCKET_NAME']}/{get_user(kwargs)}/SELECTOR/{get_problem(kwargs)}/"
+    with tracing.span('gcs.list_blobs', prefix=path_prefix) as sp:
+        gcs_all_blobs = list(gcs_bucket.list_blobs(prefix=path_prefix))
+        sp.add_requests()
 
-    selected_info = {}
-    for key, d in selector_class_dict.items():
-        S = d['selector'](deployment_config=deployment_config, model_dir=info_dir, evaluation_metric=evaluation_metric,
-                problem_type='classification', n_class=5, verbose=True)
-        dest_uri = root_dest_uri + key + "/"  # dict key is strategy name
-        if 'kwargs' not in d.keys():
-            d['kwargs'] = {}
-        selected_info[key] = S.select(destination_uri=dest_uri, validation_schema=d['validation_schema'], **d['kwargs'])
-    rmtree(info_dir)
+    selected_info = _select(deployment_config, _globals, selector_class_dict, gcs_client,
+                            _group_info_blobs(gcs_all_blobs), kwargs, max_workers=max_workers)
     kwargs['task_instance'].xcom_push(key='selected_info', value=selected_info)
 
 
-def selection(deployment_config, train_task_ids=None, selector_class_dict=None, **kwargs):
+@tracing.traced('wrappers.selection')
+def selection(deployment_config, train_task_ids=None, selector_class_dict=None, max_workers=None, **kwargs):
     """
     Selects among trained models those that will make it to production. Compute is done locally.
 
     :param deployment_config: YAML file containing all deployment variables
     :param train_task_ids: list of training tasks that represent the universe on which selection takes place
     :param selector_class_dict: dict of customized BaseSelector object. Dict keys are strategy names.
+    :param max_workers: number of processes evaluating strategies concurrently. Defaults to SELECTION_WORKERS
+                        (deployment config) or 1.
     :param kwargs:
     :return:
     """
     _globals = get_deployment_config(deployment_config)
 
-    evaluation_metric = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='evaluation_metric')
-
     successful_train_jobs = []
     for train_task in train_task_ids:
         current_train_job = kwargs['task_instance'].xcom_pull(task_ids=train_task, key='successful_jobs')
@@ -270,63 +788,326 @@ def selection(deployment_config, train_task_ids=None, selector_class_dict=None,
         successful_train_jobs.append(current_train_job)
     successful_train_jobs = [item for sublist in successful_train_jobs for item in sublist]  # flatten
 
-    # Call a selection method
-    info_dir = make_temp_dir(os.getcwd())
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
     gcs_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
 
-    for job in successful_train_jobs:
-        # download in dir with job name
-        tmp_dir_name = "{}/{}".format(info_dir, job.replace("train_", ""))
-        os.mkdir(tmp_dir_name)
+    staging_dir = get_staging_dir(_globals, kwargs)
+    try:
+        job_blobs = {}
+        for job in successful_train_jobs:
+            if get_staged_files(staging_dir, job) is not None:
+                job_blobs[job.replace("train_", "")] = []  # prefetched by train task
+                continue
+
+            # Import from GCS (same folder as prefetch)
+            path_prefix = get_model_prefix(kwargs) + job.replace("train_", "")
+            with tracing.span('gcs.list_blobs', prefix=path_prefix) as sp:
+                gcs_info_blob_list = list(gcs_bucket.list_blobs(prefix=os.path.join(path_prefix, "info")))
+                gcs_stratified_info_blob_list = list(gcs_bucket.list_blobs(prefix=os.path.join(path_prefix,
+                                                                                               "stratified_info")))
+                sp.add_requests(2)
+            job_blobs[job.replace("train_", "")] = gcs_info_blob_list + gcs_stratified_info_blob_list
+
+        selected_info = _select(deployment_config, _globals, selector_class_dict, gcs_client, job_blobs, kwargs,
+                                max_workers=max_workers)
+    finally:
+        remove_staging_dir(staging_dir)  # selection is the last reader of the staged files of the run
+    kwargs['task_instance'].xcom_push(key='selected_info', value=selected_info)
 
-        # Import from GCS
-        path_prefix = os.path.join(get_user(kwargs), get_problem(kwargs), get_version(kwargs), "MODELS",
-                                   job.replace("train_", ""))
-        gcs_info_blob_list = list(gcs_bucket.list_blobs(prefix=os.path.join(path_prefix, "info")))
-        gcs_stratified_info_blob_list = list(gcs_bucket.list_blobs(prefix=os.path.join(path_prefix, "stratified_info")))
-        gcs_blob_list = gcs_info_blob_list + gcs_stratified_info_blob_list
 
-        for gcs_source_blob in gcs_blob_list:
-            local_destination = os.path.join(info_dir, job.replace("train_", ""), gcs_source_blob.name.split("/")[-1])
-            gcs_source_blob.download_to_filename(local_destination, client=gcs_client)  # TODO: make this multithread
+def _group_info_blobs(gcs_all_blobs):
+    job_blobs = {}
+    for blob in gcs_all_blobs:
+        if blob.name.split("/")[-1].startswith(("info", "stratified_info")):
+            job_blobs.setdefault(blob.name.split("/")[-2], []).append(blob)
+    return job_blobs
 
-        # concatenate file name to match GCS flat namespace
-        for file in [f for f in os.listdir(tmp_dir_name) if os.path.isfile(os.path.join(tmp_dir_name, f))]:
-            os.rename(os.path.join(tmp_dir_name, file),
-                      os.path.join(info_dir, '_'.join([job.replace("train_", ""), file])))
 
-        # remove dir
-        rmtree(tmp_dir_name)
+def _select(deployment_config, _globals, selector_class_dict, gcs_client, job_blobs, kwargs, max_workers=None):
+    """
+    Gathers info files of trained models (from the local staging area when prefetched, from GCS otherwise), parses
+    them once into an InfoDataset and runs every selection strategy on it.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param _globals: deployment configuration dict
+    :param selector_class_dict: dict of customized BaseSelector object. Dict keys are strategy names.
+    :param gcs_client: google.cloud.storage client
+    :param job_blobs: dict of job folder names as keys and list of info blobs as value
+    :param kwargs: Airflow context
+    :param max_workers: see run_selectors(). Defaults to SELECTION_WORKERS (deployment config) or 1.
+    :return: dict of strategy names as keys and selected info files as value
+    """
+    evaluation_metric = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='evaluation_metric')
+
+    # file names are prefixed with job name to match GCS flat namespace
+    staging_dir = get_staging_dir(_globals, kwargs)
+    files = {}
+    for job, blobs in job_blobs.items():
+        staged_files = get_staged_files(staging_dir, job)
+        if staged_files is not None:  # prefetched by train task
+            for file in staged_files:
+                with open(file, 'rb') as f:
+                    files['_'.join([job, os.path.basename(file)])] = f.read()
+            continue
+        for gcs_source_blob in blobs:
+            with tracing.span('gcs.download', blob=gcs_source_blob.name) as sp:
+                file_name = '_'.join([job, gcs_source_blob.name.split("/")[-1]])
+                files[file_name] = gcs_source_blob.download_as_string(client=gcs_client)  # TODO: make this multithread
+                sp.add_requests()
+                sp.add_bytes(gcs_source_blob.size)
+
+    with tracing.span('selection.parse_info', files=len(files)):
+        info_dataset = InfoDataset(files, allow_pickle=_globals.get('INFO_ALLOW_PICKLE', False))
 
     # make sure selector_class_dict is imported in this module
     root_dest_uri = f"gs://{_globals['MODEL_BUCKET_NAME']}/{get_user(kwargs)}/SELECTOR/{get_problem(kwargs)}/"
 
-    selected_info = {}
-    for key, d in selector_class_dict.items():
-        S = d['selector'](deployment_config=deployment_config, model_dir=info_dir, evaluation_metric=evaluation_metric,
-                problem_type='classification', n_class=5, verbose=True)
-        dest_uri = root_dest_uri + key + "/"  # dict key is strategy name
-        if 'kwargs' not in d.keys():
-            d['kwargs'] = {}
-        selected_info[key] = S.select(destination_uri=dest_uri, validation_schema=d['validation_schema'], **d['kwargs'])
-    rmtree(info_dir)
-    kwargs['task_instance'].xcom_push(key='selected_info', value=selected_info)
+    with get_scratch_space(_globals) as scratch:
+        info_dir = scratch.path()
+        if not all(accepts_info_dataset(d['selector']) for d in selector_class_dict.values()):
+            info_dataset.materialize(info_dir)  # compatibility with selectors reading model_dir
+            scratch.check_quota()
+        return run_selectors(deployment_config, selector_class_dict, info_dataset, info_dir, evaluation_metric,
+                             root_dest_uri, max_workers=max_workers or _globals.get('SELECTION_WORKERS', 1))
 
 
-def score(deployment_config, use_proba=None, **kwargs):
+@tracing.traced('wrappers.score')
+def score(deployment_config, use_proba=None, fail_fast=True, cancel_on_failure=True, deadline=None,
+          straggler_factor=None, speculative=False, max_pack_size=1, shard_machine_type=None, stream_aggregate=False,
+          max_stream_size=STREAM_AGGREGATE_SIZE, **kwargs):
     """
-    Submits score job(s) to GCP AI Platform and waits for completion. Compute is done remotely.
+    Submits score job(s) to GCP AI Platform and waits for completion. Compute is done remotely. Data too large for
+    the scoring atoms is split into shards scored by separate jobs; shard outputs are then merged under
+    RESULTS_STAGING (see merge_score_shards()).
 
     :param deployment_config: YAML file containing all deployment variables
     :param score_dir: URI where to write results
     :param use_proba: (string). 0 = No / 1 = Yes
     :param master_type: GCP VM type to use during scoring
+    :param fail_fast: raise as soon as one scoring job fails
+    :param cancel_on_failure: cancel the remaining scoring jobs when failing fast
+    :param deadline: maximum time (in seconds) to wait for scoring jobs
+    :param straggler_factor: flag jobs running longer than straggler_factor * median duration of finished siblings
+    :param speculative: resubmit a copy of straggling jobs and keep whichever copy finishes first. The original job
+                        and its copy write to their own dirs under SCORE_ATTEMPTS; the winner's output is then moved
+                        to the model folder (see promote_score_outputs()) and the rest removed.
+    :param max_pack_size: score up to max_pack_size models sharing a scoring image in one job, memory headroom
+                          permitting (see get_score_packs()). Requires scoring atoms accepting comma-separated
+                          --model-file/--output-dir lists.
+    :param shard_machine_type: largest machine type a shard may require (None for any machine type handled by the
+                               atom). Lower values yield more, smaller shards.
+    :param stream_aggregate: average score outputs locally as score jobs complete and write the aggregate of each
+                             strategy under output_uri. Streamed strategies are pushed to XCom (key
+                             'streamed_strategies') and skipped by aggregate(score_task_id=...).
+    :param max_stream_size: largest score output (in bytes) averaged locally. Strategies with larger outputs are left
+                            to aggregate().
     :param kwargs:
     :return:
     """
 
+    submitted_scoring_jobs, resubmit, shard_outputs, job_outputs, attempt_outputs = \
+        _submit_score(deployment_config, use_proba=use_proba, speculative=speculative, max_pack_size=max_pack_size,
+                      shard_machine_type=shard_machine_type, **kwargs)
+    _globals = get_deployment_config(deployment_config)
+    gcs_client = get_storage_client(_globals)
+
+    if stream_aggregate:
+        averages = {strategy: RunningAverage(gcs_client) for outputs in job_outputs.values() for strategy, _ in outputs}
+        n_outputs = {strategy: sum(1 for outputs in job_outputs.values() for item in outputs if item[0] == strategy)
+                     for strategy in averages}
+
+    def process_outputs(job, effective_job, state):
+        if state == 'SUCCEEDED' and job in attempt_outputs:
+            attempt = 0 if effective_job == job else 1  # original job or its speculative copy
+            promote_score_outputs(gcs_client, attempt_outputs[job][attempt], [item[1] for item in job_outputs[job]])
+        if not stream_aggregate:
+            return
+        for strategy, output_dir in job_outputs[job]:
+            if strategy not in averages:
+                continue  # strategy left to aggregate()
+            try:
+                if state != 'SUCCEEDED' or get_output_size(gcs_client, [output_dir]) > max_stream_size:
+                    raise ValueError("Score output not streamable: {}".format(output_dir))
+                averages[strategy].fold_uri(output_dir)
+            except Exception as err:
+                logging.warning("Streaming aggregation of {} disabled: {}".format(strategy, err))
+                averages.pop(strategy)
+
+    # Retrieve scoring
+    try:
+        successful_jobs = wait_for_jobs(deployment_config, submitted_scoring_jobs, fail_fast=fail_fast,
+                                        cancel_on_failure=cancel_on_failure, deadline=deadline,
+                                        straggler_factor=straggler_factor, resubmit=resubmit,
+                                        on_complete=process_outputs if stream_aggregate or attempt_outputs else None,
+                                        **kwargs)
+    finally:
+        if attempt_outputs:
+            remove_score_attempts(gcs_client, _globals["MODEL_BUCKET_NAME"], kwargs)
+    if shard_outputs:
+        _merge_score_shards(_globals, shard_outputs, kwargs)
+
+    if stream_aggregate:
+        root_output_dir = kwargs['task_instance'].xcom_pull(task_ids='retrieve_params', key='output_uri')
+        streamed_strategies = []
+        for strategy, average in averages.items():
+            if average.n_outputs < n_outputs[strategy]:
+                continue
+            average.write(root_output_dir + strategy + "/" + STREAM_AGGREGATE_FILE)
+            streamed_strategies.append(strategy)
+            logging.info("Streamed aggregation of {} score outputs: {}".format(average.n_outputs, strategy))
+        kwargs['task_instance'].xcom_push(key='streamed_strategies', value=streamed_strategies)
+    kwargs['task_instance'].xcom_push(key='successful_jobs', value=successful_jobs)
+
+
+@tracing.traced('wrappers.submit_score')
+def submit_score(deployment_config, use_proba=None, max_pack_size=1, shard_machine_type=None, **kwargs):
+    """
+    Submits score job(s) to GCP AI Platform without waiting for completion. Job handles are pushed to XCom (key
+    'submitted_jobs'); pair with poke_jobs() in a reschedule-mode sensor. When data is sharded, run
+    merge_score_shards() once jobs are done.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param use_proba: (string). 0 = No / 1 = Yes
+    :param max_pack_size: see score()
+    :param shard_machine_type: see score()
+    :param kwargs:
+    :return:
+    """
+    _submit_score(deployment_config, use_proba=use_proba, max_pack_size=max_pack_size,
+                  shard_machine_type=shard_machine_type, **kwargs)
+
+
+@tracing.traced('wrappers.merge_score_shards')
+def merge_score_shards(deployment_config, submit_task_id, **kwargs):
+    """
+    Moves per-shard score outputs pushed to XCom (key 'score_shards') by submit_score() into their model folder under
+    RESULTS_STAGING and removes shard data. No-op when scoring was not sharded.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param submit_task_id: id of the task that submitted the score jobs
+    :param kwargs:
+    :return:
+    """
+    shard_outputs = kwargs['task_instance'].xcom_pull(task_ids=submit_task_id, key='score_shards')
+    if shard_outputs:
+        _merge_score_shards(get_deployment_config(deployment_config), shard_outputs, kwargs)
+
+
+def _merge_score_shards(_globals, shard_outputs, kwargs):
+    gcs_client = get_storage_client(_globals)
+    bucket = gcs_client.bucket(_globals["MODEL_BUCKET_NAME"])
+    for output_dir, shard_dirs in shard_outputs.items():
+        output_prefix = output_dir[len("gs://"):].partition("/")[2]
+        for shard_index, shard_dir in enumerate(shard_dirs):
+            shard_prefix = shard_dir[len("gs://"):].partition("/")[2]
+            with tracing.span('gcs.list_blobs', prefix=shard_prefix) as sp:
+                blobs = list(gcs_client.list_blobs(bucket_or_name=bucket.name, prefix=shard_prefix))
+                sp.add_requests()
+            with tracing.span('gcs.rename', blobs=len(blobs)) as sp:
+                for blob in blobs:
+                    # part files sit side by side in the model folder, as if scored by a single job
+                    part_name = f"part-{shard_index:05d}-" + blob.name[len(shard_prefix):].replace("/", "_")
+                    bucket.rename_blob(blob, output_prefix + part_name)
+                    sp.add_requests(2)  # server-side copy + delete
+        logging.info("Merged {} shards into {}".format(len(shard_dirs), output_dir))
+
+    shard_root = "{}/{}/SCORE_SHARDS/".format(get_user(kwargs), get_problem(kwargs))
+    with tracing.span('gcs.delete', prefix=shard_root) as sp:
+        for blob in gcs_client.list_blobs(bucket_or_name=bucket.name, prefix=shard_root):
+            blob.delete()
+            sp.add_requests()
+
+
+def get_attempt_dir(output_dir, attempt):
+    """
+    :param output_dir: 'gs://bucket/user/problem/path/' URI of a score output dir
+    :param attempt: 0 for the original score job, 1 for its speculative copy
+    :return: 'gs://bucket/user/problem/SCORE_ATTEMPTS/attempt/path/' URI where that attempt writes its output
+    """
+    bucket_name, _, prefix = output_dir[len("gs://"):].partition("/")
+    user, problem, path = prefix.split("/", 2)
+    return "gs://{}/{}/{}/SCORE_ATTEMPTS/{}/{}".format(bucket_name, user, problem, attempt, path)
+
+
+def promote_score_outputs(gcs_client, attempt_dirs, output_dirs):
+    """
+    Moves the output of the winning attempt of a speculative score job into the job's output dirs, replacing whatever
+    they held (e.g. partial output of a previous task attempt). Objects are renamed server-side.
+
+    :param gcs_client: google.cloud.storage client
+    :param attempt_dirs: list of 'gs://bucket/prefix/' URIs written by the winning attempt (see get_attempt_dir())
+    :param output_dirs: list of 'gs://bucket/prefix/' URIs of the job, in the same order
+    """
+    for attempt_dir, output_dir in zip(attempt_dirs, output_dirs):
+        bucket_name, _, attempt_prefix = attempt_dir[len("gs://"):].partition("/")
+        output_prefix = output_dir[len("gs://"):].partition("/")[2]
+        bucket = gcs_client.bucket(bucket_name)
+        with tracing.span('gcs.list_blobs', prefix=output_prefix) as sp:
+            stale_blobs = list(gcs_client.list_blobs(bucket_or_name=bucket_name, prefix=output_prefix))
+            blobs = list(gcs_client.list_blobs(bucket_or_name=bucket_name, prefix=attempt_prefix))
+            sp.add_requests(2)
+        with tracing.span('gcs.delete', blobs=len(stale_blobs)) as sp:
+            for blob in stale_blobs:
+                blob.delete()
+                sp.add_requests()
+        with tracing.span('gcs.rename', blobs=len(blobs)) as sp:
+            for blob in blobs:
+                bucket.rename_blob(blob, output_prefix + blob.name[len(attempt_prefix):])
+                sp.add_requests(2)  # server-side copy + delete
+        logging.info("Promoted score output {} to {}".format(attempt_dir, output_dir))
+
+
+def remove_score_attempts(gcs_client, bucket_name, kwargs):
+    """Removes what is left of speculative score attempts (output of losers, see get_attempt_dir())."""
+    attempt_root = "{}/{}/SCORE_ATTEMPTS/".format(get_user(kwargs), get_problem(kwargs))
+    with tracing.span('gcs.delete', prefix=attempt_root) as sp:
+        for blob in gcs_client.list_blobs(bucket_or_name=bucket_name, prefix=attempt_root):
+            blob.delete()
+            sp.add_requests()
+
+
+def split_score_dir(gcs_client, score_dir, shard_root, n_shards):
+    """
+    Splits objects under score_dir into n_shards prefixes of similar size. Objects are copied server-side (no data
+    goes through the worker), largest first onto the lightest shard.
+
+    :param gcs_client: google.cloud.storage client
+    :param score_dir: 'gs://bucket/prefix/' URI of scoring data
+    :param shard_root: 'gs://bucket/prefix/' URI where to write shards
+    :param n_shards: number of shards
+    :return: list of (shard URI, shard size in GB) tuples, empty shards excluded
+    """
+    source_bucket_name, _, source_prefix = score_dir[len("gs://"):].partition("/")
+    source_bucket = gcs_client.bucket(source_bucket_name)
+    shard_bucket_name, _, shard_prefix = shard_root[len("gs://"):].partition("/")
+    shard_bucket = gcs_client.bucket(shard_bucket_name)
+    blobs = sorted([blob for blob in gcs_client.list_blobs(bucket_or_name=source_bucket_name, prefix=source_prefix)
+                    if not blob.name.endswith("/")], key=lambda b: b.name)
+    tracing.add_requests()
+
+    shard_sizes = [0] * n_shards
+    shard_blobs = [[] for _ in range(n_shards)]
+    for blob in sorted(blobs, key=lambda b: -(b.size or 0)):  # stable: deterministic across retries
+        shard_index = shard_sizes.index(min(shard_sizes))
+        shard_sizes[shard_index] += blob.size or 0
+        shard_blobs[shard_index].append(blob)
+
+    shards = []
+    with tracing.span('gcs.copy', blobs=len(blobs)) as sp:
+        for shard_index, items in enumerate(shard_blobs):
+            if not items:
+                continue
+            prefix = shard_prefix + f"shard_{shard_index}/"
+            for blob in items:
+                source_bucket.copy_blob(blob, shard_bucket, prefix + blob.name[len(source_prefix):].lstrip("/"))
+                sp.add_requests()
+            shards.append(("gs://{}/{}".format(shard_bucket_name, prefix), shard_sizes[shard_index] / 1024**3))
+    return shards
+
+
+def _submit_score(deployment_config, use_proba=None, speculative=False, max_pack_size=1, shard_machine_type=None,
+                  **kwargs):
+
     _globals = get_deployment_config(deployment_config)
 
     # Get metadata file
@@ -340,21 +1121,16 @@ def score(deployment_config, use_proba=None, **kwargs):
         "scaleTier": "CUSTOM"
     }
 
-    local_dir, local_destinations = get_selector(_globals, kwargs)
-
     selected_info = {}
-    for destination in local_destinations:
-
-        with open(destination, 'r') as f:
-            selector_dict = json.load(f)
-        selected_info[destination.split("/")[-2]] = selector_dict['selection']  # key == strategy name
+    with get_scratch_space(_globals, in_memory=True) as scratch:
+        for destination in get_selector(_globals, kwargs, scratch):
+            selector_dict = json.loads(scratch.read(destination).decode('utf-8'))
+            selected_info[destination.split("/")[-2]] = selector_dict['selection']  # key == strategy name
 
-    rmtree(local_dir)
-
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
     gcs_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
-    submitted_scoring_jobs = {}
+    deployment = get_deployment_constants(_globals)
+    models = []
     for strategy_name, value in selected_info.items():
         if strategy_name != 'Top4MostStrata_StratifiedKFold':
             continue # reduce scoring to relevant strategy
@@ -366,64 +1142,153 @@ def score(deployment_config, use_proba=None, **kwargs):
                 logger.warning(f"Skipping model {model_path.split('/')[-1]} because currert data is insufficient to yield useful predictions.")
                 continue # skip model if current available data is insufficient to yield useful predictions
 
-            currentInput = scoreInput.copy()
             algo = '_'.join(model_path.split("/")[0].split("_")[4:])
-            blobs = list(gcs_bucket.list_blobs(prefix=os.path.join(get_user(kwargs), "ACTIVE_MODELS",
-                                                                   get_problem(kwargs), model_path)))  # unique id
+            with tracing.span('gcs.list_blobs', prefix=model_path) as sp:
+                blobs = list(gcs_bucket.list_blobs(prefix=os.path.join(get_user(kwargs), "ACTIVE_MODELS",
+                                                                       get_problem(kwargs), model_path)))  # unique id
+                sp.add_requests()
             if len(blobs) == 1:
                 # model is a file
-                currentInput["modelFile"] = os.path.join(_globals["MODEL_BUCKET_ADDRESS"], blobs[0].name)
+                model_file = os.path.join(_globals["MODEL_BUCKET_ADDRESS"], blobs[0].name)
             elif len(blobs) > 1:
                 # model is not a file but a folder (multiple files)
-                currentInput["modelFile"] = os.path.join(_globals["MODEL_BUCKET_ADDRESS"],
-                                                         '/'.join(blobs[0].name.split("/")[0:-1]))
+                model_file = os.path.join(_globals["MODEL_BUCKET_ADDRESS"], '/'.join(blobs[0].name.split("/")[0:-1]))
             else:
                 raise FileNotFoundError("Could not find any blob matching %s" % os.path.join(model_path))
 
-            currentInput["outputDir"] = f"gs://{_globals['MODEL_BUCKET_NAME']}/{get_user(kwargs)}/{get_problem(kwargs)}/RESULTS_STAGING/{strategy_name}/{model_path.split('.')[0]}/"
-
-            currentInput["masterType"] = get_hardware_config(atom=algo, data_size=metadata['size'], scoring=True)
-
-            S = ScoreJobSpecHandler(algorithm=algo,
-                                    deployment_config=deployment_config,
-                                    inputs=currentInput, request_ids={'user': get_user(kwargs),
-                                                                      'problem': get_problem(kwargs),
-                                                                      'version': ''})
-            S.create_job_specs()
-            T = ScoreJobHandler(deployment_config=deployment_config, job_executor='mlapi')
-            T.submit_job(S.job_specs)
-            if T.success:
-                submitted_scoring_jobs[S.job_specs['jobId']] = model_path.split("/")[0]  # corresponding train job id
-                logging.info("Score request successful: {}".format(S.job_specs['jobId']))
-            else:
-                raise ValueError("Unable to submit score job.")
+            try:
+                image_uri = deployment['SCORING'][algo][0]
+            except KeyError:
+                raise ValueError("Unknown algorithm")
+            models.append({'algorithm': algo,
+                           'image_uri': image_uri,
+                           'model_file': model_file,
+                           'model_size': sum(blob.size or 0 for blob in blobs) / 1024**3,  # GB
+                           'output_dir': f"gs://{_globals['MODEL_BUCKET_NAME']}/{get_user(kwargs)}/{get_problem(kwargs)}/RESULTS_STAGING/{strategy_name}/{model_path.split('.')[0]}/",
+                           'train_job': model_path.split("/")[0],
+                           'strategy': strategy_name})
+
+    # Split data beyond the hardware ladder of any selected atom into shards scored by separate jobs
+    n_shards = max([get_shard_count(model['algorithm'], metadata['size'], machine_type=shard_machine_type)
+                    for model in models] + [1])
+    if n_shards > 1:
+        shard_root = f"gs://{_globals['MODEL_BUCKET_NAME']}/{get_user(kwargs)}/{get_problem(kwargs)}/SCORE_SHARDS/"
+        shards = split_score_dir(gcs_client, score_dir, shard_root, n_shards)
+        shard_size = max(size for _, size in shards)
+        logging.info("Scoring {} GB in {} shards.".format(metadata['size'], len(shards)))
+    else:
+        shards = [(score_dir, metadata['size'])]
+        shard_size = metadata['size']
+    for model in models:
+        model['master_type'] = get_hardware_config(atom=model['algorithm'], data_size=shard_size, scoring=True)
+
+    journal = get_submission_journal(_globals, kwargs)
+    submitted_scoring_jobs = {}
+    resubmit = {}
+    shard_outputs = {}
+    job_outputs = {}
+    attempt_outputs = {}
+    packs = get_score_packs(models, shard_size, max_pack_size=max_pack_size)
+    for shard_index, shard_dir, master_type, pack in [(shard_index, shard_dir, master_type, pack)
+                                                      for shard_index, (shard_dir, _) in enumerate(shards)
+                                                      for master_type, pack in packs]:
+
+        output_dirs = [model['output_dir'] for model in pack]
+        version = ''
+        if len(shards) > 1:
+            output_dirs = [output_dir + f"shard_{shard_index}/" for output_dir in output_dirs]
+            for model, output_dir in zip(pack, output_dirs):
+                shard_outputs.setdefault(model['output_dir'], []).append(output_dir)
+            version = f"shard{shard_index}"  # keeps job ids of sibling shards distinct
+
+        currentInput = scoreInput.copy()
+        currentInput["scoreDir"] = shard_dir
+        if len(pack) == 1:
+            currentInput["modelFile"] = pack[0]['model_file']
+        else:
+            currentInput["modelFile"] = [model['model_file'] for model in pack]
+            logging.info("Packing {} models in one score job.".format(len(pack)))
+        currentInput["masterType"] = master_type
+
+        # Speculative attempts (original job and its copy) each write to their own dirs, so that a cancelled loser
+        # never leaves partial output behind; the winner's output is promoted once it succeeds (see score())
+        attempt_dirs = [[get_attempt_dir(output_dir, attempt) for output_dir in output_dirs]
+                        for attempt in range(2)] if speculative else [output_dirs]
+        spec_kwargs = []
+        for dirs in attempt_dirs:
+            spec_kwargs.append({'algorithm': pack[0]['algorithm'],
+                                'inputs': dict(currentInput, outputDir=dirs[0] if len(pack) == 1 else dirs),
+                                'request_ids': {'user': get_user(kwargs), 'problem': get_problem(kwargs),
+                                                'version': version}})
+        if speculative:
+            resubmitter = get_resubmitter(ScoreJobSpecHandler, ScoreJobHandler, deployment_config, **spec_kwargs[1])
+        job_id = submit_job_once(journal, ScoreJobSpecHandler, ScoreJobHandler, deployment_config, **spec_kwargs[0])
+        if job_id is not None:
+            # corresponding train job id(s)
+            submitted_scoring_jobs[job_id] = pack[0]['train_job'] if len(pack) == 1 else \
+                [model['train_job'] for model in pack]
+            job_outputs[job_id] = [(model['strategy'], output_dir) for model, output_dir in zip(pack, output_dirs)]
+            if speculative:
+                resubmit[job_id] = resubmitter
+                attempt_outputs[job_id] = attempt_dirs
+            logging.info("Score request successful: {}".format(job_id))
+        else:
+            raise ValueError("Unable to submit score job.")
 
     if not submitted_scoring_jobs:
         raise ValueError("No jobs selected for scoring.")
 
-    # Retrieve scoring
-    status = poll(deployment_config, TIME_INTERVAL, submitted_scoring_jobs)
-    kwargs['task_instance'].xcom_push(key='successful_jobs', value=get_job_assessment(status))
+    kwargs['task_instance'].xcom_push(key='submitted_jobs', value=get_job_handles(_globals, submitted_scoring_jobs))
+    kwargs['task_instance'].xcom_push(key='score_shards', value=shard_outputs)
+    return submitted_scoring_jobs, resubmit, shard_outputs, job_outputs, attempt_outputs
 
 
-def aggregate(deployment_config, neutralized=False, **kwargs):
+@tracing.traced('wrappers.aggregate')
+def aggregate(deployment_config, neutralized=False, fail_fast=False, cancel_on_failure=False, score_task_id=None,
+              **kwargs):
     """
     Aggregate model scoring. Compute is done remotely.
 
     :param deployment_config:
+    :param fail_fast: raise as soon as one postprocess job fails
+    :param cancel_on_failure: cancel the remaining postprocess jobs when failing fast
+    :param score_task_id: id of the score task. Strategies it already aggregated (see score(stream_aggregate=True))
+                          are skipped.
     :param kwargs:
     :return:
     """
 
-    _globals = get_deployment_config(deployment_config)
-    local_dir, local_destinations = get_selector(_globals, kwargs)
+    submitted_postprocess_jobs_list = _submit_aggregate(deployment_config, neutralized=neutralized,
+                                                        score_task_id=score_task_id, **kwargs)
+
+    # Retrieve scoring
+    status_list = wait_for_job_groups(deployment_config, [list(item) for item in submitted_postprocess_jobs_list],
+                                      fail_fast=fail_fast, cancel_on_failure=cancel_on_failure, **kwargs)
+    kwargs['task_instance'].xcom_push(key='successful_jobs', value=status_list)
 
+
+@tracing.traced('wrappers.submit_aggregate')
+def submit_aggregate(deployment_config, neutralized=False, score_task_id=None, **kwargs):
+    """
+    Submits aggregation job(s) to GCP AI Platform without waiting for completion. Job handles are pushed to XCom (key
+    'submitted_jobs'), one group per strategy; pair with poke_jobs() in a reschedule-mode sensor.
+
+    :param deployment_config:
+    :param score_task_id: see aggregate()
+    :param kwargs:
+    :return:
+    """
+    _submit_aggregate(deployment_config, neutralized=neutralized, score_task_id=score_task_id, **kwargs)
+
+
+def _submit_aggregate(deployment_config, neutralized=False, score_task_id=None, **kwargs):
+
+    _globals = get_deployment_config(deployment_config)
     selected_info = {}
-    for destination in local_destinations:
-        with open(destination, 'r') as f:
-            selector_dict = json.load(f)
-        selected_info[destination.split("/")[-2]] = selector_dict
-    rmtree(local_dir)
+    with get_scratch_space(_globals, in_memory=True) as scratch:
+        for destination in get_selector(_globals, kwargs, scratch):
+            selector_dict = json.loads(scratch.read(destination).decode('utf-8'))
+            selected_info[destination.split("/")[-2]] = selector_dict
 
     # Get metadata file
     metadata = get_metadata(_globals, 'SCORE', kwargs)
@@ -439,12 +1304,21 @@ def aggregate(deployment_config, neutralized=False, **kwargs):
         root_output_dir = root_output_dir.replace("RESULTS", "NEUTRALIZED_RESULTS")
         staging_dir = "NEUTRALIZED_RESULTS_STAGING"
 
+    streamed_strategies = []
+    if score_task_id is not None and not neutralized:
+        streamed_strategies = kwargs['task_instance'].xcom_pull(task_ids=score_task_id,
+                                                                key='streamed_strategies') or []
+
+    journal = get_submission_journal(_globals, kwargs)
     submitted_postprocess_jobs_list = []
     for strategy_name, value in selected_info.items():
         if strategy_name != 'Top4MostStrata_StratifiedKFold':
             continue # reduce scoring to relevant strategy
         if not value['selection']:
             continue
+        if strategy_name in streamed_strategies:
+            logging.info("Aggregation already streamed by score task: {}".format(strategy_name))
+            continue
         if value['aggregation'] == 'average':
 
             current_score_input = scoreInput.copy()
@@ -455,18 +1329,15 @@ def aggregate(deployment_config, neutralized=False, **kwargs):
             version = 'eternal'
             if neutralized:
                 version = 'eternalneutralized'
-            S = PostprocessJobSpecHandler(algorithm='aggregator',
-                                          deployment_config=deployment_config,
-                                          inputs=current_score_input, request_ids={'user': get_user(kwargs),
-                                                                                   'problem': get_problem(kwargs),
-                                                                                   'version': version})
-            S.create_job_specs()
-            T = PostprocessJobHandler(deployment_config=deployment_config, job_executor='mlapi')
-            T.submit_job(S.job_specs)
+            job_id = submit_job_once(journal, PostprocessJobSpecHandler, PostprocessJobHandler, deployment_config,
+                                     algorithm='aggregator',
+                                     inputs=current_score_input, request_ids={'user': get_user(kwargs),
+                                                                              'problem': get_problem(kwargs),
+                                                                              'version': version})
             submitted_postprocess_jobs = {}
-            if T.success:
-                submitted_postprocess_jobs[S.job_specs['jobId']] = S.job_specs['jobId']  # corresponding train job id
-                logging.info("Postprocess request successful: {}".format(S.job_specs['jobId']))
+            if job_id is not None:
+                submitted_postprocess_jobs[job_id] = job_id  # corresponding train job id
+                logging.info("Postprocess request successful: {}".format(job_id))
             else:
                 raise ValueError("Unable to submit postprocess job.")
 
@@ -474,12 +1345,10 @@ def aggregate(deployment_config, neutralized=False, **kwargs):
         else:
             raise NotImplementedError("Only supported aggregation is: 'average'")
 
-    # Retrieve scoring
-    status_list = []
-    for item in submitted_postprocess_jobs_list:
-        status = poll(deployment_config, TIME_INTERVAL, item)
-        status_list.append(get_job_assessment(status))
-    kwargs['task_instance'].xcom_push(key='successful_jobs', value=status_list)
+    kwargs['task_instance'].xcom_push(key='submitted_jobs',
+                                      value=[handle for group, item in enumerate(submitted_postprocess_jobs_list)
+                                             for handle in get_job_handles(_globals, item, group=group)])
+    return submitted_postprocess_jobs_list
 
 
 def algorithm_routing(deployment_config, algorithm_space, **kwargs):
@@ -506,27 +1375,31 @@ def algorithm_routing(deployment_config, algorithm_space, **kwargs):
     return tasks_to_trigger
 
 
+@tracing.traced('wrappers.clear_results')
 def clear_results(deployment_config, **kwargs):
 
     _globals = get_deployment_config(deployment_config)
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
 
     gcs_blob_list = list(gcs_client.list_blobs(bucket_or_name=_globals["MODEL_BUCKET_NAME"],
-                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "RESULTS_STAGING"))) + \
+                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "RESULTS_STAGING", ""))) + \
                     list(gcs_client.list_blobs(bucket_or_name=_globals["MODEL_BUCKET_NAME"],
-                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "NEUTRALIZED_RESULTS_STAGING"))) + \
+                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "NEUTRALIZED_RESULTS_STAGING", ""))) + \
                     list(gcs_client.list_blobs(bucket_or_name=_globals["MODEL_BUCKET_NAME"],
-                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "RESULTS"))) + \
+                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "RESULTS", ""))) + \
                     list(gcs_client.list_blobs(bucket_or_name=_globals["MODEL_BUCKET_NAME"],
-                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "UPLOAD"))) + \
+                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "UPLOAD", ""))) + \
                     list(gcs_client.list_blobs(bucket_or_name=_globals["MODEL_BUCKET_NAME"],
-                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "NEUTRALIZED_UPLOAD")))
+                                               prefix=os.path.join(get_user(kwargs), get_problem(kwargs), "NEUTRALIZED_UPLOAD", "")))
 
-    for blob in gcs_blob_list:
-        blob.delete()
+    tracing.add_requests(5)
+    with tracing.span('gcs.delete', blobs=len(gcs_blob_list)) as sp:
+        for blob in gcs_blob_list:
+            blob.delete()
+            sp.add_requests()
 
 
+@tracing.traced('wrappers.metadata_check')
 def metadata_check(deployment_config, information_loss_tolerance=0.1, **kwargs):
 
     _globals = get_deployment_config(deployment_config)
@@ -536,13 +1409,14 @@ def metadata_check(deployment_config, information_loss_tolerance=0.1, **kwargs):
 
     # Check if metadata linked to trained models matches metadata from current data
     missing_features_pct = {}
-    for key, model_featimp in trained_model_metadata.items():
-        relevant_features = list(model_featimp.loc[model_featimp['feature_importance'] > 0]['feature_name'])
-        missing_importance = 0
-        for feature in relevant_features:
-            if current_data_metadata['missing_data_rate'][feature] > 0:
-                missing_importance += model_featimp.loc[model_featimp['feature_name'] == feature]['feature_importance']
-        missing_features_pct[key.replace("featimp", "model").replace(".csv", "")] = missing_importance
+    with tracing.span('metadata_check.compare', models=len(trained_model_metadata)):
+        for key, model_featimp in trained_model_metadata.items():
+            relevant_features = list(model_featimp.loc[model_featimp['feature_importance'] > 0]['feature_name'])
+            missing_importance = 0
+            for feature in relevant_features:
+                if current_data_metadata['missing_data_rate'][feature] > 0:
+                    missing_importance += model_featimp.loc[model_featimp['feature_name'] == feature]['feature_importance']
+            missing_features_pct[key.replace("featimp", "model").replace(".csv", "")] = missing_importance
 
     data_consistent_models = []
     for model, pct in missing_features_pct.items():
@@ -552,7 +1426,46 @@ def metadata_check(deployment_config, information_loss_tolerance=0.1, **kwargs):
     kwargs['task_instance'].xcom_push(key='data_consistent_models', value=data_consistent_models)
 
 
-def data_evaluation(deployment_config, data_uri, user, problem, **kwargs):
+@tracing.traced('wrappers.data_evaluation')
+def data_evaluation(deployment_config, data_uri, user, problem, skip_unchanged=False, incremental=False, **kwargs):
+    """
+    Evaluates data (metadata.json) on GCP AI Platform and waits for completion. Compute is done remotely.
+
+    :param deployment_config: YAML file containing all deployment variables
+    :param data_uri: URI of the data to evaluate
+    :param user: user name
+    :param problem: problem name
+    :param skip_unchanged: do not submit any job when objects under data_uri did not change since the last successful
+                           evaluation. XCom key 'data_unchanged' tells whether the evaluation was skipped. When both
+                           skip_unchanged and incremental are off, data_uri is not fingerprinted.
+    :param incremental: when objects were only added, evaluate new objects only and merge the result into the
+                        existing metadata. Requires a data_evaluator atom supporting --merge-metadata/--include-files.
+    :param kwargs:
+    :return:
+    """
+
+    submitted_preprocess_jobs = _submit_data_evaluation(deployment_config, data_uri, user, problem,
+                                                        skip_unchanged=skip_unchanged, incremental=incremental,
+                                                        **kwargs)
+
+    # Retrieve scoring
+    kwargs['task_instance'].xcom_push(key='successful_jobs',
+                                      value=wait_for_jobs(deployment_config, submitted_preprocess_jobs, **kwargs))
+
+
+@tracing.traced('wrappers.submit_data_evaluation')
+def submit_data_evaluation(deployment_config, data_uri, user, problem, skip_unchanged=False, incremental=False,
+                           **kwargs):
+    """
+    Submits data evaluation job to GCP AI Platform without waiting for completion. Job handles are pushed to XCom (key
+    'submitted_jobs'); pair with poke_jobs() in a reschedule-mode sensor. See data_evaluation() for arguments.
+    """
+    _submit_data_evaluation(deployment_config, data_uri, user, problem, skip_unchanged=skip_unchanged,
+                            incremental=incremental, **kwargs)
+
+
+def _submit_data_evaluation(deployment_config, data_uri, user, problem, skip_unchanged=False, incremental=False,
+                            **kwargs):
 
     _globals = get_deployment_config(deployment_config)
     model_dir = "gs://{}/{}/{}/METADATA/".format(_globals["MODEL_BUCKET_NAME"], user, problem)
@@ -563,32 +1476,60 @@ def data_evaluation(deployment_config, data_uri, user, problem, **kwargs):
                         'masterType': 'n1-highmem-8' # 8 vCPUs / 52 GB RAM  --- 'n1-highmem-4'  # 4 vCPUs / 26 GB RAM
                         }
 
-    S = PreprocessJobSpecHandler(deployment_config=deployment_config,
-                                 algorithm='data_evaluator',
-                                 append_job_id=False,  # ensure you overwrite same destination
-                                 inputs=preprocess_input,
-                                 request_ids={'user': user, 'problem': problem, 'version': ''})
-    S.create_job_specs()
-    T = PreprocessJobHandler(deployment_config=deployment_config, job_executor='mlapi')
-    T.submit_job(S.job_specs)
+    # Compare input objects with those of the last evaluation (fingerprint stored next to metadata.json)
+    gcs_client = get_storage_client(_globals)
+    use_fingerprints = skip_unchanged or incremental
+    data_fingerprints = get_blob_fingerprints(gcs_client, data_uri) if use_fingerprints else None
+    previous_evaluation = None
+    if use_fingerprints:
+        previous_evaluation = load_json_blob(gcs_client, model_dir + 'fingerprint.json')
+    if previous_evaluation is not None and \
+            get_blob_fingerprints(gcs_client, model_dir + 'metadata.json') and \
+            get_reusable_job_state(get_mlapi_client(_globals),
+                                   previous_evaluation.get('project_id', _globals["PROJECT_ID"]),
+                                   previous_evaluation['job_id']) == 'SUCCEEDED':
+        added_objects = get_added_objects(previous_evaluation['objects'], data_fingerprints)
+        if skip_unchanged and added_objects == []:
+            logging.info("Data unchanged since evaluation {}. Reusing metadata.".format(previous_evaluation['job_id']))
+            kwargs['task_instance'].xcom_push(key='data_unchanged', value=True)
+            kwargs['task_instance'].xcom_push(key='submitted_jobs', value=[])
+            return {}
+        if incremental and added_objects:
+            bucket_name = data_uri[len("gs://"):].split("/")[0]
+            logging.info("Evaluating {} new objects only.".format(len(added_objects)))
+            preprocess_input['args'] = ['merge-metadata', model_dir + 'metadata.json',
+                                        'include-files', ','.join(f"gs://{bucket_name}/{name}"
+                                                                  for name in added_objects)]
+    kwargs['task_instance'].xcom_push(key='data_unchanged', value=False)
+
+    job_id = submit_job_once(get_submission_journal(_globals, kwargs), PreprocessJobSpecHandler,
+                             PreprocessJobHandler, deployment_config,
+                             algorithm='data_evaluator',
+                             append_job_id=False,  # ensure you overwrite same destination
+                             inputs=preprocess_input,
+                             request_ids={'user': user, 'problem': problem, 'version': ''})
     submitted_preprocess_jobs = {}
-    if T.success:
-        submitted_preprocess_jobs[S.job_specs['jobId']] = S.job_specs['jobId']  # corresponding train job id
-        logging.info("Preprocess request successful: {}".format(S.job_specs['jobId']))
+    if job_id is not None:
+        submitted_preprocess_jobs[job_id] = job_id  # corresponding train job id
+        logging.info("Preprocess request successful: {}".format(job_id))
     else:
         raise ValueError("Unable to submit preprocess job.")
 
-    # Retrieve scoring
-    status = poll(deployment_config, TIME_INTERVAL, submitted_preprocess_jobs)
-    kwargs['task_instance'].xcom_push(key='successful_jobs', value=get_job_assessment(status))
+    # Reused by the next evaluation only if this job succeeds
+    if use_fingerprints:
+        store_json_blob(gcs_client, model_dir + 'fingerprint.json',
+                        {'objects': data_fingerprints, 'job_id': job_id,
+                         'project_id': get_job_router(_globals).get_project(job_id, _globals["PROJECT_ID"])})
+
+    kwargs['task_instance'].xcom_push(key='submitted_jobs', value=get_job_handles(_globals, submitted_preprocess_jobs))
+    return submitted_preprocess_jobs
 
 
 def wait_dag_status(deployment_config, dag_type, conf, **kwargs):
 
     _globals = get_deployment_config(deployment_config)
 
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
 
     while True:
         sleep(60)
@@ -609,8 +1550,7 @@ def wait_dag_status(deployment_config, dag_type, conf, **kwargs):
 def clear_dag_status(deployment_config, dag_type, conf, **kwargs):
 
     _globals = get_deployment_config(deployment_config)
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
+    gcs_client = get_storage_client(_globals)
 
     gcs_blob_list = list(gcs_client.list_blobs(bucket_or_name=_globals["MODEL_BUCKET_NAME"],
                                                prefix=os.path.join(conf['user'], conf['problem'], "STATUS")))
@@ -619,38 +1559,38 @@ def clear_dag_status(deployment_config, dag_type, conf, **kwargs):
         blob.delete()
 
 
+@tracing.traced('wrappers.notify_dag_status')
 def notify_dag_status(deployment_config, dag_type, status, **kwargs):
 
     _globals = get_deployment_config(deployment_config)
-
-    status_dir = make_temp_dir(os.getcwd())
-    gcs_credentials = get_gcs_credentials(_globals)
-    gcs_client = storage.Client(project=_globals['PROJECT_ID'], credentials=gcs_credentials)
-
-    local_status_file = os.path.join(status_dir, '{}.json'.format(status))
-    with open(local_status_file, 'w') as f:
-        json.dump('0', f)
-
-    gcs_destination_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
-    if dag_type == 'TRAIN':
-        gcs_destination_blob = '/'.join([get_user(kwargs), "ACTIVE_MODELS", get_problem(kwargs)
-                                            , "STATUS", local_status_file.split("/")[-1]])
-    elif dag_type == 'SCORE':
-        gcs_destination_blob = '/'.join([get_user(kwargs), get_problem(kwargs)
-                                        , "STATUS", local_status_file.split("/")[-1]])
-    else:
-        raise ValueError(f"dag_type {dag_type} not recognized. Must be either TRAIN or SCORE.")
-    b = storage.blob.Blob(gcs_destination_blob, gcs_destination_bucket)
-    b.upload_from_filename(local_status_file, client=gcs_client)
-
-    client_output_uri = kwargs['task_instance'].xcom_pull(task_ids=['retrieve_params'], key='output_uri')[0]
-    if client_output_uri is not None:
-        # Notify client
-        client_output_uri_shards = client_output_uri.split("/")
-        client_bucket_name = client_output_uri_shards[2]
-        gcs_client_destination_bucket = gcs_client.get_bucket(client_bucket_name)
-        gcs_destination_blob = '/'.join(client_output_uri_shards[3:-1] + [local_status_file.split("/")[-1]])
-        b = storage.blob.Blob(gcs_destination_blob, gcs_client_destination_bucket)
-        b.upload_from_filename(local_status_file, client=gcs_client)
-
-    rmtree(status_dir)
+    gcs_client = get_storage_client(_globals)
+
+    with get_scratch_space(_globals, in_memory=True) as scratch:
+        status_file = '{}.json'.format(status)
+        scratch.write(status_file, json.dumps('0'))
+
+        gcs_destination_bucket = gcs_client.get_bucket(_globals["MODEL_BUCKET_NAME"])
+        if dag_type == 'TRAIN':
+            gcs_destination_blob = '/'.join([get_user(kwargs), "ACTIVE_MODELS", get_problem(kwargs)
+                                                , "STATUS", status_file])
+        elif dag_type == 'SCORE':
+            gcs_destination_blob = '/'.join([get_user(kwargs), get_problem(kwargs)
+                                            , "STATUS", status_file])
+        else:
+            raise ValueError(f"dag_type {dag_type} not recognized. Must be either TRAIN or SCORE.")
+        with tracing.span('gcs.upload', blob=gcs_destination_blob) as sp:
+            b = gcs_destination_bucket.blob(gcs_destination_blob)
+            sp.add_bytes(scratch.upload(b, status_file, client=gcs_client, content_type='application/json'))
+            sp.add_requests()
+
+        client_output_uri = kwargs['task_instance'].xcom_pull(task_ids=['retrieve_params'], key='output_uri')[0]
+        if client_output_uri is not None:
+            # Notify client
+            client_output_uri_shards = client_output_uri.split("/")
+            client_bucket_name = client_output_uri_shards[2]
+            gcs_client_destination_bucket = gcs_client.get_bucket(client_bucket_name)
+            gcs_destination_blob = '/'.join(client_output_uri_shards[3:-1] + [status_file])
+            with tracing.span('gcs.upload', blob=gcs_destination_blob) as sp:
+                b = gcs_client_destination_bucket.blob(gcs_destination_blob)
+                sp.add_bytes(scratch.upload(b, status_file, client=gcs_client, content_type='application/json'))
+                sp.add_requests()
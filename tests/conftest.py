@@ -0,0 +1,32 @@
+from gcpaiutils.backends import MemoryBackend
+from gcpaiutils.fakeapi import FakeJobsServer
+import pytest
+import yaml
+
+
+@pytest.fixture
+def fake_server():
+    """Fake AI Platform jobs API. Jobs run for one minute unless a test changes their timeline."""
+    with FakeJobsServer(run_duration=60) as server:
+        yield server
+
+
+@pytest.fixture
+def gcs_client():
+    return MemoryBackend()
+
+
+@pytest.fixture
+def deployment_config(tmp_path, fake_server):
+    """Deployment config file pointing at the fake jobs API and the in-memory storage backend."""
+    _globals = {'PROJECT_ID': 'home-project',
+                'CONTAINERS_ROOT_URL': 'gcr.io',
+                'MODEL_BUCKET_NAME': 'models',
+                'MODEL_BUCKET_ADDRESS': 'gs://models/',
+                'region': 'us-central1',
+                'MLAPI_DISCOVERY_URL': fake_server.discovery_url,
+                'STORAGE_BACKEND': 'memory'}
+    path = tmp_path / "deployment_config.yml"
+    with open(path, 'w') as f:
+        yaml.safe_dump(_globals, f)
+    return str(path)
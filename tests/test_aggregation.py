@@ -0,0 +1,49 @@
+from gcpaiutils.aggregation import RunningAverage, get_output_size
+from pandas import DataFrame, read_csv
+from io import BytesIO
+import pytest
+
+
+def _upload(gcs_client, name, rows):
+    data = "id,prediction\n" + "".join("{},{}\n".format(row_id, value) for row_id, value in rows)
+    gcs_client.bucket("models").blob(name).upload_from_string(data)
+
+
+def test_sharded_output_counts_once(gcs_client):
+    _upload(gcs_client, "RESULTS/model_1/part-00000.csv", [(0, 0.2), (1, 0.4)])
+    _upload(gcs_client, "RESULTS/model_1/part-00001.csv", [(2, 0.6)])
+    _upload(gcs_client, "RESULTS/model_2/part-00000.csv", [(0, 0.4), (1, 0.8), (2, 1.0)])
+
+    average = RunningAverage(gcs_client)
+    average.fold_uri("gs://models/RESULTS/model_1/")
+    average.fold_uri("gs://models/RESULTS/model_2/")
+    assert average.n_outputs == 2  # one per score output dir, not per part file
+    assert average.result()['prediction'].round(6).to_dict() == {0: 0.3, 1: 0.6, 2: 0.8}
+
+
+def test_missing_rows_average_over_scoring_models(gcs_client):
+    average = RunningAverage(gcs_client)
+    average.fold(DataFrame({'prediction': [0.2, 0.4]}, index=[0, 1]))
+    average.fold(DataFrame({'prediction': [0.6]}, index=[1]))
+    assert average.n_outputs == 2
+    assert average.result()['prediction'].round(6).to_dict() == {0: 0.2, 1: 0.5}
+
+
+def test_empty_output_dir_is_not_counted(gcs_client):
+    average = RunningAverage(gcs_client)
+    with pytest.raises(ValueError):
+        average.fold_uri("gs://models/RESULTS/missing/")
+    assert average.n_outputs == 0
+    with pytest.raises(ValueError):
+        average.result()
+
+
+def test_write_and_output_size(gcs_client):
+    _upload(gcs_client, "RESULTS/model_1/part-00000.csv", [(0, 0.5)])
+    average = RunningAverage(gcs_client)
+    average.fold_uri("gs://models/RESULTS/model_1/")
+    average.write("gs://models/AGGREGATE/aggregate.csv")
+
+    data = gcs_client.bucket("models").blob("AGGREGATE/aggregate.csv").download_as_string(client=gcs_client)
+    assert read_csv(BytesIO(data), index_col=0)['prediction'].to_dict() == {0: 0.5}
+    assert get_output_size(gcs_client, ["gs://models/RESULTS/"]) > 0
@@ -0,0 +1,62 @@
+from gcpaiutils.aio import AsyncJobHandler, async_poll
+from gcpaiutils.utils import JobFailedError
+from googleapiclient import errors
+from time import time
+import asyncio
+import pytest
+
+
+def _create_jobs(fake_server, n, end=None, prefix='aio_job'):
+    jobs = ['{}_{}'.format(prefix, i) for i in range(n)]
+    for job in jobs:
+        fake_server.create_job('home-project', {'jobId': job, 'trainingInput': {}})
+        if end is not None:
+            fake_server.jobs[('home-project', job)]['_timeline']['end'] = end
+    return jobs
+
+
+def _state(fake_server, job):
+    return fake_server.get_job('home-project', job)[1]['state']
+
+
+def _poll(deployment_config, jobs, fail_fast=False, cancel=(), **handler_kwargs):
+    async def run():
+        handler = AsyncJobHandler(deployment_config, time_interval=0.05, **handler_kwargs)
+        try:
+            for job in cancel:
+                handler.watch(job).cancel()
+            return await async_poll(deployment_config, 0.05, jobs, fail_fast=fail_fast, handler=handler)
+        finally:
+            await asyncio.sleep(0.1)  # lets cancellations triggered by cancelled futures go through
+            await handler.close()
+    return asyncio.run(run())
+
+
+def test_sweeps_use_batch_requests(fake_server, deployment_config):
+    jobs = _create_jobs(fake_server, 5, end=0)
+    fake_server.reset_stats()
+    assert _poll(deployment_config, jobs, batch_size=2) == {job: 'SUCCEEDED' for job in jobs}
+    assert fake_server.stats['batch'] == 3
+    assert fake_server.stats['get'] == fake_server.stats['batched'] == 5
+
+
+def test_cancelled_future_reports_job_cancelled(fake_server, deployment_config):
+    succeeded, running = _create_jobs(fake_server, 2, prefix='aio_cancel')
+    fake_server.jobs[('home-project', succeeded)]['_timeline']['end'] = time() + 0.2
+    status = _poll(deployment_config, [succeeded, running], cancel=[running])
+    assert status == {succeeded: 'SUCCEEDED', running: 'CANCELLED'}
+    assert _state(fake_server, running) == 'CANCELLED'
+
+
+def test_cancelled_future_fails_fast(fake_server, deployment_config):
+    running, cancelled = _create_jobs(fake_server, 2, prefix='aio_fail_fast')
+    with pytest.raises(JobFailedError) as err:
+        _poll(deployment_config, [running, cancelled], fail_fast=True, cancel=[cancelled])
+    assert err.value.failed_jobs == [cancelled]
+
+
+def test_status_errors_raise_after_retries(fake_server, deployment_config):
+    fake_server.reset_stats()
+    with pytest.raises(errors.HttpError):
+        _poll(deployment_config, ['aio_missing'], retries=2)
+    assert fake_server.stats['get'] == 2
@@ -0,0 +1,151 @@
+from gcpaiutils.cache import TrainingCache, get_training_fingerprint
+from gcpaiutils import cache as cache_module
+from gcpaiutils.utils import build_mlapi_client, get_blob_fingerprints, get_deployment_config, get_storage_client
+from gcpaiutils import wrappers
+from googleapiclient import errors
+from time import time
+from uuid import uuid4
+import pytest
+
+
+@pytest.fixture
+def mlapi(fake_server):
+    return build_mlapi_client({'MLAPI_DISCOVERY_URL': fake_server.discovery_url})
+
+
+@pytest.fixture
+def cache(gcs_client):
+    return TrainingCache(gcs_client, 'models', 'TRAINING_CACHE/', 'user/problem/MODELS/')
+
+
+def _add_model(gcs_client, job_id):
+    model_dir = 'user/problem/MODELS/' + '_'.join(job_id.split("_")[1:]) + '/'
+    gcs_client.bucket('models').blob(model_dir + 'model.bin').upload_from_string(b'model', client=gcs_client)
+
+
+def _finish_job(fake_server, project, job, fail=False):
+    fake_server.jobs[(project, job)]['_timeline'].update(end=0, fail=fail)
+
+
+def _fingerprint(gcs_client, data_uri):
+    return get_training_fingerprint('class_lgbm', 'gcr.io/atoms:class_lgbm', ['--n-folds', '5'], None,
+                                    get_blob_fingerprints(gcs_client, data_uri), 'n1-standard-8')
+
+
+def test_lookup_expires_entries_after_ttl(gcs_client, cache, monkeypatch):
+    cache.store('fingerprint', 'train_job')
+    _add_model(gcs_client, 'train_job')
+    assert cache.lookup('fingerprint', ttl=3600) == 'train_job'
+    monkeypatch.setattr(cache_module, 'time', lambda: time() + 3601)
+    assert cache.lookup('fingerprint', ttl=3600) is None
+    assert cache.lookup('fingerprint') == 'train_job'  # no expiry without ttl
+
+
+def test_lookup_misses_when_model_folder_is_gone(gcs_client, cache):
+    cache.store('fingerprint', 'train_job', project_id='project')
+    assert cache.lookup('fingerprint') is None
+    assert cache.lookup('other_fingerprint') is None
+    _add_model(gcs_client, 'train_job')
+    assert cache.lookup('fingerprint') == 'train_job'
+    assert cache.projects == {'train_job': 'project'}
+
+
+def test_fingerprint_ignores_listing_order(gcs_client, monkeypatch):
+    bucket = gcs_client.bucket('data')
+    for i in range(3):
+        bucket.blob('DATA/part-{:05d}.csv'.format(i)).upload_from_string(str(i).encode())
+    fingerprint = _fingerprint(gcs_client, "gs://data/DATA/")
+    list_blobs = gcs_client.list_blobs
+    monkeypatch.setattr(gcs_client, 'list_blobs', lambda **kwargs: reversed(list(list_blobs(**kwargs))))
+    assert _fingerprint(gcs_client, "gs://data/DATA/") == fingerprint
+
+
+def test_fingerprint_changes_with_blob_generation(gcs_client):
+    blob = gcs_client.bucket('data').blob('DATA/part-00000.csv')
+    blob.upload_from_string(b'a,b\n1,2\n')
+    fingerprint = _fingerprint(gcs_client, "gs://data/DATA/")
+    assert _fingerprint(gcs_client, "gs://data/DATA/") == fingerprint
+    blob.upload_from_string(b'a,b\n1,2\n')  # same content rewritten: new generation
+    assert _fingerprint(gcs_client, "gs://data/DATA/") != fingerprint
+
+
+def test_missing_job_is_not_retried(fake_server, mlapi, monkeypatch):
+    monkeypatch.setattr(wrappers, 'sleep', lambda seconds: pytest.fail("404 retried"))
+    with pytest.raises(errors.HttpError):
+        wrappers.get_job_info(mlapi, 'project', 'train_purged')
+    assert wrappers.get_reusable_job_state(mlapi, 'project', 'train_purged') is None
+    assert fake_server.stats['get'] == 2
+
+
+def test_throttled_request_is_retried(fake_server, mlapi, monkeypatch):
+    fake_server.create_job('project', {'jobId': 'train_job'})
+    fake_server.throttle_rate = 1
+    monkeypatch.setattr(wrappers, 'sleep', lambda seconds: setattr(fake_server, 'throttle_rate', 0))
+    assert wrappers.get_job_info(mlapi, 'project', 'train_job')['jobId'] == 'train_job'
+    assert fake_server.stats['throttled'] == 1
+
+
+@pytest.mark.parametrize("fail, hit", [(False, True), (True, False)])
+def test_only_succeeded_cached_jobs_are_hits(fake_server, mlapi, gcs_client, cache, fail, hit):
+    fake_server.create_job('project', {'jobId': 'train_job'})
+    cache.store('fingerprint', 'train_job', project_id='project')
+    _add_model(gcs_client, 'train_job')
+    assert wrappers.get_cached_job(mlapi, cache, 'fingerprint', 'home-project') == (None, None)  # still running
+
+    _finish_job(fake_server, 'project', 'train_job', fail=fail)
+    expected = ('train_job', 'project') if hit else (None, None)
+    assert wrappers.get_cached_job(mlapi, cache, 'fingerprint', 'home-project') == expected
+
+
+def test_purged_cached_job_is_a_miss(mlapi, gcs_client, cache):
+    cache.store('fingerprint', 'train_purged')
+    _add_model(gcs_client, 'train_purged')
+    assert wrappers.get_cached_job(mlapi, cache, 'fingerprint', 'home-project') == (None, None)
+
+
+
+class _TaskInstance:
+
+    def __init__(self):
+        self.xcom = {}
+
+    def xcom_push(self, key, value):
+        self.xcom[key] = value
+
+
+def _evaluate(deployment_config, data_uri, user, **kwargs):
+    task_instance = _TaskInstance()
+    submitted_jobs = wrappers._submit_data_evaluation(deployment_config, data_uri, user, 'problem',
+                                                      task_instance=task_instance, **kwargs)
+    return list(submitted_jobs), task_instance.xcom
+
+
+def test_data_evaluation_reuses_succeeded_evaluation_only(fake_server, deployment_config):
+    gcs_client = get_storage_client(get_deployment_config(deployment_config))
+    user = 'u' + uuid4().hex[:8]  # in-memory storage is shared by the process
+    data_bucket = gcs_client.bucket('models')
+    data_uri = "gs://models/{}/DATA/".format(user)
+    data_bucket.blob(user + '/DATA/part-00000.csv').upload_from_string(b'a,b\n1,2\n')
+    data_bucket.blob(user + '/problem/METADATA/metadata.json').upload_from_string(b'{}')
+
+    submitted_jobs, xcom = _evaluate(deployment_config, data_uri, user, skip_unchanged=True, incremental=True)
+    assert len(submitted_jobs) == 1 and xcom['data_unchanged'] is False
+
+    _finish_job(fake_server, 'home-project', submitted_jobs[0], fail=True)
+    submitted_jobs, xcom = _evaluate(deployment_config, data_uri, user, skip_unchanged=True)
+    assert len(submitted_jobs) == 1 and xcom['data_unchanged'] is False  # failed evaluation is not reused
+
+    _finish_job(fake_server, 'home-project', submitted_jobs[0])
+    submitted_jobs, xcom = _evaluate(deployment_config, data_uri, user, skip_unchanged=True)
+    assert submitted_jobs == [] and xcom['data_unchanged'] is True
+
+    fake_server.jobs.clear()  # purged evaluation job: not retried, evaluated again
+    submitted_jobs, xcom = _evaluate(deployment_config, data_uri, user, skip_unchanged=True)
+    assert len(submitted_jobs) == 1 and xcom['data_unchanged'] is False
+    _finish_job(fake_server, 'home-project', submitted_jobs[0])
+
+    data_bucket.blob(user + '/DATA/part-00001.csv').upload_from_string(b'a,b\n3,4\n')
+    submitted_jobs, xcom = _evaluate(deployment_config, data_uri, user, skip_unchanged=True, incremental=True)
+    args = fake_server.jobs[('home-project', submitted_jobs[0])]['trainingInput']['args']
+    assert [arg for arg in args if 'part-0000' in arg] == ["gs://models/{}/DATA/part-00001.csv".format(user)]
+    assert xcom['data_unchanged'] is False
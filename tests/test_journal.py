@@ -0,0 +1,71 @@
+from gcpaiutils.journal import SubmissionJournal, submit_job_once, get_spec_hash
+from gcpaiutils.train import TrainJobHandler, TrainJobSpecHandler
+from copy import deepcopy
+from time import sleep
+
+
+SPEC_KWARGS = {'algorithm': 'class_lgbm', 'inputs': {'scaleTier': 'CUSTOM', 'masterType': 'n1-standard-4'},
+               'request_ids': {'user': 'user', 'problem': 'problem', 'version': 'v1'}}
+
+
+def _submit(journal, deployment_config):
+    return submit_job_once(journal, TrainJobSpecHandler, TrainJobHandler, deployment_config, **deepcopy(SPEC_KWARGS))
+
+
+def test_journal_persists_entries(tmp_path, gcs_client):
+    for uri in [str(tmp_path / "journal.json"), "gs://models/JOURNAL/journal.json"]:
+        journal = SubmissionJournal(uri, gcs_client=gcs_client)
+        journal.record("key", {'jobId': 'train_1'})
+        assert SubmissionJournal(uri, gcs_client=gcs_client).get("key") == {'jobId': 'train_1'}
+        journal.discard("key")
+        assert SubmissionJournal(uri, gcs_client=gcs_client).get("key") is None
+
+
+def test_spec_hash_is_order_independent():
+    assert get_spec_hash('A', {'a': 1, 'b': 2}) == get_spec_hash('A', {'b': 2, 'a': 1})
+    assert get_spec_hash('A', {'a': 1}) != get_spec_hash('B', {'a': 1})
+
+
+def test_retry_reattaches_to_journaled_job(tmp_path, fake_server, deployment_config):
+    journal_file = str(tmp_path / "journal.json")
+    job = _submit(SubmissionJournal(journal_file), deployment_config)
+    assert job is not None
+
+    # Retried task: fresh journal instance, same specification
+    assert _submit(SubmissionJournal(journal_file), deployment_config) == job
+    assert fake_server.stats['created_jobs'] == 1
+
+
+def test_conflicting_job_id_fails_without_reattach(fake_server, deployment_config):
+    job = _submit(None, deployment_config)
+    S = TrainJobSpecHandler(deployment_config=deployment_config, **deepcopy(SPEC_KWARGS))
+    S.create_job_specs()
+    S.job_specs['jobId'] = job
+
+    T = TrainJobHandler(deployment_config=deployment_config)
+    T.submit_job(deepcopy(S.job_specs))  # handlers translate specs in place
+    assert not T.success
+    assert T.error.resp.status == 409
+
+    T.submit_job(deepcopy(S.job_specs), reattach=True)
+    assert T.success
+    assert fake_server.stats['created_jobs'] == 1
+
+
+def test_failed_journaled_job_is_resubmitted(tmp_path, fake_server, deployment_config):
+    journal_file = str(tmp_path / "journal.json")
+    job = _submit(SubmissionJournal(journal_file), deployment_config)
+    fake_server.jobs[('home-project', job)]['_timeline'].update(end=0, fail=True)
+    sleep(1.1)  # job names have a one second resolution
+
+    new_job = _submit(SubmissionJournal(journal_file), deployment_config)
+    assert new_job not in [None, job]
+    assert fake_server.stats['created_jobs'] == 2
+    assert list(SubmissionJournal(journal_file)._entries.values())[0]['jobId'] == new_job
+
+
+def test_new_job_name_collision_is_renamed(fake_server, deployment_config):
+    jobs = [_submit(None, deployment_config) for _ in range(2)]  # same specification, same second
+    assert None not in jobs
+    assert jobs[0] != jobs[1]
+    assert fake_server.stats['created_jobs'] == 2
@@ -0,0 +1,161 @@
+from gcpaiutils.local import LocalJobExecutor, TERMINAL_STATES
+from gcpaiutils import local
+from googleapiclient import errors
+from time import sleep, time
+import subprocess
+import signal
+import pytest
+import sys
+import os
+
+
+ENTRY_POINTS = '''
+import os
+import time
+
+
+def succeed(args):
+    pass
+
+
+def fail(args):
+    raise RuntimeError("failed")
+
+
+def crash(args):
+    os._exit(1)
+
+
+def wait(args):
+    time.sleep(float(args[0]))
+'''
+
+
+@pytest.fixture
+def executor(tmp_path, monkeypatch):
+    (tmp_path / "entry_points.py").write_text(ENTRY_POINTS)
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(tmp_path), root_dir]))  # inherited by job runners
+    entry_points = {tag: "entry_points:" + tag for tag in ["succeed", "fail", "crash", "wait"]}
+    return LocalJobExecutor(str(tmp_path / "jobs"), entry_points=entry_points, max_workers=1)
+
+
+def _create(executor, job, tag, args=()):
+    body = {'jobId': job, 'trainingInput': {'masterConfig': {'imageUri': 'gcr.io/atoms:' + tag}, 'args': list(args)}}
+    return executor.projects().jobs().create(body=body, parent='projects/local').execute()
+
+
+def _get(executor, job):
+    return executor.projects().jobs().get(name='projects/local/jobs/' + job).execute()
+
+
+def _wait(executor, job, states=TERMINAL_STATES, timeout=30):
+    deadline = time() + timeout
+    while _get(executor, job)['state'] not in states:
+        assert time() < deadline, "job {} still {}".format(job, _get(executor, job)['state'])
+        sleep(0.1)
+    return _get(executor, job)
+
+
+def test_job_outcomes(executor):
+    for job, tag in [('job_ok', 'succeed'), ('job_ko', 'fail'), ('job_crash', 'crash')]:
+        assert _create(executor, job, tag)['state'] == 'QUEUED'
+    assert _wait(executor, 'job_ok')['state'] == 'SUCCEEDED'
+    assert 'failed' in _wait(executor, 'job_ko')['errorMessage']
+    assert 'died' in _wait(executor, 'job_crash')['errorMessage']  # runner gone without recording an outcome
+
+    # Another process of the host (e.g. a sensor task) sees the same states
+    other = LocalJobExecutor(executor.state_dir)
+    assert [_get(other, job)['state'] for job in ['job_ok', 'job_ko', 'job_crash']] == \
+        ['SUCCEEDED', 'FAILED', 'FAILED']
+
+
+def test_duplicate_and_unknown_jobs(executor):
+    _create(executor, 'job_1', 'succeed')
+    with pytest.raises(errors.HttpError) as err:
+        _create(executor, 'job_1', 'succeed')
+    assert err.value.resp.status == 409
+    with pytest.raises(errors.HttpError) as err:
+        _get(executor, 'job_2')
+    assert err.value.resp.status == 404
+    with pytest.raises(errors.HttpError) as err:
+        _create(executor, 'job_3', 'unregistered')
+    assert err.value.resp.status == 400
+    _wait(executor, 'job_1')
+
+
+def test_cancel_queued_and_running_jobs(executor):
+    _create(executor, 'job_running', 'wait', ['30'])
+    _wait(executor, 'job_running', states=['RUNNING'])
+    _create(executor, 'job_queued', 'succeed')  # waits for the only worker slot
+
+    executor.projects().jobs().cancel(name='projects/local/jobs/job_queued').execute()
+    assert _wait(executor, 'job_queued')['state'] == 'CANCELLED'
+    executor.projects().jobs().cancel(name='projects/local/jobs/job_running').execute()
+    assert _wait(executor, 'job_running')['state'] == 'CANCELLED'
+    with pytest.raises(errors.HttpError) as err:
+        executor.projects().jobs().cancel(name='projects/local/jobs/job_running').execute()
+    assert err.value.resp.status == 400
+
+
+CALLS = []
+
+
+def _record(args):
+    CALLS.append(args)
+
+
+@pytest.fixture
+def runner(tmp_path):
+    """Runs _run_job in this process (as the runner would) on a QUEUED job, restoring the SIGTERM handler after."""
+    state_dir = str(tmp_path / "jobs")
+    os.makedirs(state_dir)
+    handler = signal.getsignal(signal.SIGTERM)
+    del CALLS[:]
+
+    def run(job):
+        local._write_state(state_dir, job, {'jobId': job, 'state': 'QUEUED'})
+        local._run_job(state_dir, job, "{}:_record".format(__name__), ['--arg'], max_workers=1)
+        return local._read_state(state_dir, job)
+
+    yield state_dir, run
+    signal.signal(signal.SIGTERM, handler)
+
+
+def test_cancel_during_slot_handover(runner, monkeypatch):
+    state_dir, run = runner
+    acquire_slot = local._acquire_slot
+
+    def _acquire_then_cancel(state_dir, job, max_workers):
+        slot = acquire_slot(state_dir, job, max_workers)
+        open(local._get_cancel_file(state_dir, job), 'w').close()  # cancel lands right after the slot is taken
+        return slot
+
+    monkeypatch.setattr(local, '_acquire_slot', _acquire_then_cancel)
+    assert run('job_1')['state'] == 'CANCELLED'
+    assert CALLS == []
+    assert run('job_2')['state'] == 'CANCELLED'  # slot released for the next job
+
+
+def test_sigterm_before_running_cancels(runner, monkeypatch):
+    state_dir, run = runner
+
+    def _acquire_then_signal(state_dir, job, max_workers):
+        os.kill(os.getpid(), signal.SIGTERM)
+        return None
+
+    monkeypatch.setattr(local, '_acquire_slot', _acquire_then_signal)
+    assert run('job_1')['state'] == 'CANCELLED'
+    assert CALLS == []
+
+
+def test_runner_records_success(runner):
+    state_dir, run = runner
+    job_info = run('job_1')
+    assert job_info['state'] == 'SUCCEEDED' and 'endTime' in job_info
+    assert CALLS == [['--arg']]
+
+
+def test_core_modules_import_without_fcntl():
+    code = "import sys; sys.modules['fcntl'] = None; import gcpaiutils.handler, gcpaiutils.poller, gcpaiutils.wrappers"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
@@ -0,0 +1,38 @@
+from gcpaiutils.wrappers import get_score_packs
+
+
+def _models(n, model_size=0.1, image_uri='gcr.io/scorer:scorer_lgbm', master_type='n1-highmem-8'):
+    return [{'name': 'model_{}'.format(i), 'image_uri': image_uri, 'model_size': model_size,
+             'master_type': master_type} for i in range(n)]
+
+
+def _pack_sizes(packs):
+    return [len(pack) for _, pack in packs]
+
+
+def test_packs_hold_at_most_max_pack_size_models():
+    packs = get_score_packs(_models(7), data_size=1, max_pack_size=3)
+    assert _pack_sizes(packs) == [3, 3, 1]
+    assert [model['name'] for _, pack in packs for model in pack] == ['model_{}'.format(i) for i in range(7)]
+
+
+def test_packing_disabled_by_default():
+    models = _models(2) + _models(1, master_type='n1-standard-8')
+    packs = get_score_packs(models, data_size=1)
+    assert _pack_sizes(packs) == [1, 1, 1]
+    assert [master_type for master_type, _ in packs] == ['n1-highmem-8', 'n1-highmem-8', 'n1-standard-8']
+
+
+def test_packs_fit_memory_left_by_scoring_data():
+    # n1-highmem-8: 52 GB * 0.8 usable - 1 GB of data * 3 = 38.6 GB for models, loaded at twice their size
+    assert _pack_sizes(get_score_packs(_models(5, model_size=9), data_size=1, max_pack_size=10)) == [2, 2, 1]
+    assert _pack_sizes(get_score_packs(_models(3, model_size=10), data_size=1, max_pack_size=10)) == [1, 1, 1]
+    assert _pack_sizes(get_score_packs(_models(3, model_size=30), data_size=1, max_pack_size=10)) == [1, 1, 1]
+
+
+def test_packs_split_by_image_and_run_on_largest_machine():
+    models = _models(2, master_type='n1-standard-8') + _models(1, master_type='n1-highmem-8') + \
+        _models(2, image_uri='gcr.io/scorer:scorer_xgb', master_type='n1-standard-8')
+    packs = get_score_packs(models, data_size=1, max_pack_size=10)
+    assert [(master_type, len(pack), pack[0]['image_uri']) for master_type, pack in packs] == \
+        [('n1-highmem-8', 3, 'gcr.io/scorer:scorer_lgbm'), ('n1-standard-8', 2, 'gcr.io/scorer:scorer_xgb')]
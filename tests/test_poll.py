@@ -0,0 +1,97 @@
+from gcpaiutils.utils import JobFailedError, JobTimeoutError
+from gcpaiutils.wrappers import get_stragglers, poll
+from datetime import datetime as dt, timezone
+from time import time
+import pytest
+
+
+def _create_job(fake_server, job, end=None, fail=False):
+    fake_server.create_job('home-project', {'jobId': job, 'trainingInput': {}})
+    if end is not None:
+        fake_server.jobs[('home-project', job)]['_timeline'].update(end=end, fail=fail)
+    return job
+
+
+def _state(fake_server, job):
+    return fake_server.get_job('home-project', job)[1]['state']
+
+
+def _job_info(state, created, ended=None):
+    def format_time(epoch):
+        return dt.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    job_info = {'state': state, 'createTime': format_time(created)}
+    if ended is not None:
+        job_info['endTime'] = format_time(ended)
+    return job_info
+
+
+@pytest.mark.parametrize("cancel_on_failure", [False, True])
+def test_fail_fast(fake_server, deployment_config, cancel_on_failure):
+    failed = _create_job(fake_server, 'fail_fast_failed', end=0, fail=True)
+    running = _create_job(fake_server, 'fail_fast_running')
+    with pytest.raises(JobFailedError) as err:
+        poll(deployment_config, 0.05, [running, failed], fail_fast=True, cancel_on_failure=cancel_on_failure)
+    assert err.value.failed_jobs == [failed]
+    assert err.value.status == {running: 'RUNNING', failed: 'FAILED'}
+    assert err.value.cancelled_jobs == ([running] if cancel_on_failure else [])
+    assert _state(fake_server, running) == ('CANCELLED' if cancel_on_failure else 'RUNNING')
+
+
+def test_without_fail_fast_waits_for_siblings(fake_server, deployment_config):
+    failed = _create_job(fake_server, 'no_fail_fast_failed', end=0, fail=True)
+    succeeded = _create_job(fake_server, 'no_fail_fast_succeeded', end=time() + 0.2)
+    assert poll(deployment_config, 0.05, [failed, succeeded]) == {failed: 'FAILED', succeeded: 'SUCCEEDED'}
+
+
+@pytest.mark.parametrize("cancel_on_failure", [False, True])
+def test_deadline_raises_timeout(fake_server, deployment_config, cancel_on_failure):
+    succeeded = _create_job(fake_server, 'deadline_succeeded', end=0)
+    running = _create_job(fake_server, 'deadline_running')
+    start_time = time()
+    with pytest.raises(JobTimeoutError) as err:
+        poll(deployment_config, 0.05, [succeeded, running], deadline=0.2, cancel_on_failure=cancel_on_failure)
+    assert time() - start_time < 5
+    assert err.value.failed_jobs == [running]
+    assert err.value.status == {succeeded: 'SUCCEEDED', running: 'RUNNING'}
+    assert err.value.cancelled_jobs == ([running] if cancel_on_failure else [])
+    assert _state(fake_server, running) == ('CANCELLED' if cancel_on_failure else 'RUNNING')
+
+
+def test_stragglers_against_expected_durations():
+    now = time()
+    job_info = {'slow': _job_info('RUNNING', now - 100), 'fast': _job_info('RUNNING', now - 10),
+                'unknown': {'state': 'QUEUED'}}
+    expected_durations = {'slow': 40, 'fast': 40, 'unknown': 1}
+    assert get_stragglers(list(job_info), job_info, expected_durations=expected_durations, now=now) == ['slow']
+    assert get_stragglers(list(job_info), job_info, expected_durations=expected_durations, straggler_factor=3,
+                          now=now) == []
+
+
+def test_stragglers_against_succeeded_siblings():
+    now = time()
+    job_info = {'sibling_{}'.format(i): _job_info('SUCCEEDED', now - 100, now - 100 + 10 * (i + 1))
+                for i in range(3)}  # median duration of 20s
+    job_info.update(straggler=_job_info('RUNNING', now - 50), running=_job_info('RUNNING', now - 30))
+    assert get_stragglers(['straggler', 'running'], job_info, now=now) == ['straggler']
+
+    job_info.update(sibling_3=_job_info('RUNNING', now - 50), sibling_4=_job_info('RUNNING', now - 50))
+    assert get_stragglers(['straggler', 'running'], job_info, now=now) == []  # fewer than half of siblings done
+
+
+def test_speculative_copy_wins_and_original_is_cancelled(fake_server, deployment_config):
+    original = _create_job(fake_server, 'speculative_original')
+    sibling = _create_job(fake_server, 'speculative_sibling', end=time() + 0.3)
+    copies = []
+
+    def resubmit():
+        copies.append(_create_job(fake_server, 'speculative_copy', end=0))
+        return copies[-1]
+
+    completed = []
+    status = poll(deployment_config, 0.05, [original, sibling], expected_durations={original: 1e-3, sibling: 60},
+                  straggler_factor=1, resubmit={original: resubmit},
+                  on_complete=lambda job, effective_job, state: completed.append((job, effective_job, state)))
+    assert copies == ['speculative_copy']  # resubmitted once
+    assert status == {'speculative_copy': 'SUCCEEDED', sibling: 'SUCCEEDED'}
+    assert (original, 'speculative_copy', 'SUCCEEDED') in completed
+    assert _state(fake_server, original) == 'CANCELLED'
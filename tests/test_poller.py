@@ -0,0 +1,100 @@
+from gcpaiutils.poller import PollerDaemon, PollerClient, get_poller
+from gcpaiutils.utils import get_deployment_config
+from gcpaiutils import wrappers
+from time import time
+import subprocess
+import pytest
+import stat
+import yaml
+import sys
+import os
+
+
+@pytest.fixture
+def poller_config(tmp_path, deployment_config):
+    _globals = dict(get_deployment_config(deployment_config), POLLER_SOCKET=str(tmp_path / "poller.sock"))
+    path = tmp_path / "poller_config.yml"
+    with open(path, 'w') as f:
+        yaml.safe_dump(_globals, f)
+    return str(path)
+
+
+@pytest.fixture
+def daemon(poller_config):
+    with PollerDaemon(get_deployment_config(poller_config)['POLLER_SOCKET'], time_interval=0.1) as daemon:
+        yield daemon
+
+
+def _create_jobs(fake_server, n, run_duration=None):
+    jobs = ['job_{}'.format(i) for i in range(n)]
+    for job in jobs:
+        fake_server.create_job('home-project', {'jobId': job, 'trainingInput': {}})
+        if run_duration is not None:
+            fake_server.jobs[('home-project', job)]['_timeline']['end'] = time() + run_duration
+    return jobs
+
+
+def test_wait_returns_unwatched_jobs(fake_server, poller_config, daemon):
+    jobs = _create_jobs(fake_server, 3)
+    job_info = PollerClient(daemon.socket_path).get_job_info(poller_config, {job: 'home-project' for job in jobs})
+    assert {job: info['state'] for job, info in job_info.items()} == {job: 'RUNNING' for job in jobs}
+
+
+def test_wait_times_out_without_state_change(fake_server, poller_config, daemon):
+    jobs = _create_jobs(fake_server, 2)
+    client = PollerClient(daemon.socket_path)
+    client.get_job_info(poller_config, {job: 'home-project' for job in jobs})
+
+    start_time = time()
+    job_info = client.get_job_info(poller_config, {job: 'home-project' for job in jobs},
+                                   known={job: 'RUNNING' for job in jobs}, timeout=0.5)
+    assert 0.5 <= time() - start_time < 5
+    assert {info['state'] for info in job_info.values()} == {'RUNNING'}
+
+
+def test_wait_returns_on_state_change(fake_server, poller_config, daemon):
+    jobs = _create_jobs(fake_server, 2)
+    fake_server.jobs[('home-project', jobs[0])]['_timeline']['end'] = time() + 0.5
+
+    start_time = time()
+    job_info = PollerClient(daemon.socket_path).get_job_info(
+        poller_config, {job: 'home-project' for job in jobs}, known={job: 'RUNNING' for job in jobs}, timeout=30)
+    assert time() - start_time < 5
+    assert job_info[jobs[0]]['state'] == 'SUCCEEDED'
+    assert job_info[jobs[1]]['state'] == 'RUNNING'
+
+
+def test_poll_and_check_jobs_use_daemon(fake_server, poller_config, daemon):
+    jobs = _create_jobs(fake_server, 4, run_duration=0.3)
+    assert wrappers.poll(poller_config, 0.1, jobs) == {job: 'SUCCEEDED' for job in jobs}
+    assert wrappers.check_jobs(poller_config, jobs) == {job: 'SUCCEEDED' for job in jobs}
+    assert daemon.stats['waits'] > 0
+    assert fake_server.stats['get'] == fake_server.stats['batched']  # all from batch requests of the daemon
+
+
+def test_stopped_daemon_is_not_used(fake_server, poller_config):
+    _globals = get_deployment_config(poller_config)
+    assert get_poller(_globals) is None
+    with PollerDaemon(_globals['POLLER_SOCKET']) as daemon:
+        assert get_poller(_globals).is_alive()
+        with pytest.raises(ValueError):
+            PollerDaemon(daemon.socket_path).start()
+    assert get_poller(_globals) is None
+
+    jobs = _create_jobs(fake_server, 2, run_duration=0.2)
+    assert wrappers.poll(poller_config, 0.1, jobs) == {job: 'SUCCEEDED' for job in jobs}  # direct API polling
+
+
+def test_socket_is_private_to_the_owner(poller_config):
+    umask = os.umask(0)  # most permissive: the socket file would be world writable
+    try:
+        with PollerDaemon(get_deployment_config(poller_config)['POLLER_SOCKET']) as daemon:
+            assert stat.S_IMODE(os.stat(daemon.socket_path).st_mode) == 0o600
+            assert PollerClient(daemon.socket_path).is_alive()
+    finally:
+        os.umask(umask)
+
+
+def test_wrappers_import_without_unix_socket_servers():
+    code = "import socketserver, sys; del socketserver.ThreadingUnixStreamServer; import gcpaiutils.wrappers"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
@@ -0,0 +1,53 @@
+from gcpaiutils.prefetch import InfoPrefetcher, get_model_prefix, get_staging_dir, get_staged_files, \
+    remove_staging_dir, prune_staging_dirs
+from types import SimpleNamespace
+import os
+
+
+KWARGS = {'task_instance': SimpleNamespace(dag_id='dag', xcom_pull=lambda task_ids=None, key=None: {
+    'user': 'user', 'problem': 'problem', 'version': 'v1'}[key]), 'run_id': 'run_1'}
+
+
+def test_model_prefix_matches_selection_source():
+    assert get_model_prefix(KWARGS) == "user/problem/v1/MODELS/"
+
+
+def test_prefetch_marks_complete_jobs_only(tmp_path, gcs_client):
+    prefix = get_model_prefix(KWARGS)
+    bucket = gcs_client.bucket("models")
+    bucket.blob(prefix + "job_1/info_00000.json").upload_from_string('{"accuracy": 0.5}')
+    bucket.blob(prefix + "job_1/stratified_info_00000.json").upload_from_string('{"accuracy": 0.5}')
+    bucket.blob(prefix + "job_1/model_00000.pkl").upload_from_string('model')
+    bucket.blob(prefix + "job_2/model_00000.pkl").upload_from_string('model')
+
+    staging_dir = get_staging_dir({'STAGING_DIR': str(tmp_path)}, KWARGS)
+    prefetcher = InfoPrefetcher(gcs_client, "models", prefix, staging_dir)
+    prefetcher.on_complete("train_job_1", "train_job_1", 'SUCCEEDED')
+    prefetcher.on_complete("train_job_2", "train_job_2", 'SUCCEEDED')
+    prefetcher.on_complete("train_job_3", "train_job_3", 'FAILED')
+    assert prefetcher.wait() == ["train_job_1"]
+
+    assert [os.path.basename(f) for f in get_staged_files(staging_dir, "train_job_1")] == \
+        ["info_00000.json", "stratified_info_00000.json"]
+    assert get_staged_files(staging_dir, "train_job_2") is None  # no info files: no marker
+    assert get_staged_files(staging_dir, "train_job_3") is None
+    assert get_staged_files(None, "train_job_1") is None
+
+    remove_staging_dir(staging_dir)
+    assert not os.path.exists(staging_dir)
+
+
+def test_staging_dir_requires_dag_run(tmp_path):
+    assert get_staging_dir({'STAGING_DIR': str(tmp_path)}, {}) is None
+
+
+def test_prune_removes_stale_runs_only(tmp_path):
+    _globals = {'STAGING_DIR': str(tmp_path)}
+    stale_dir, fresh_dir = tmp_path / "dag" / "run_0", tmp_path / "dag" / "run_1"
+    stale_dir.mkdir(parents=True)
+    fresh_dir.mkdir()
+    os.utime(stale_dir, (0, 0))
+
+    prune_staging_dirs(_globals, ttl=60)
+    assert not stale_dir.exists()
+    assert fresh_dir.exists()
@@ -0,0 +1,84 @@
+from gcpaiutils.routing import JobRouter, get_job_targets
+from gcpaiutils.utils import build_mlapi_client
+import pytest
+
+
+TARGETS = [{'project_id': 'project', 'region': 'us-central1'},
+           {'project_id': 'project', 'region': 'europe-west1'}]
+
+
+@pytest.fixture
+def mlapi(fake_server):
+    return build_mlapi_client({'MLAPI_DISCOVERY_URL': fake_server.discovery_url})
+
+
+def _load(router):
+    return {region: router._load[('project', region)] for region in ['us-central1', 'europe-west1']}
+
+
+def test_least_loaded_counts_active_jobs_per_region(fake_server, mlapi):
+    for i in range(2):
+        fake_server.create_job('project', {'jobId': 'us_{}'.format(i), 'trainingInput': {'region': 'us-central1'}})
+    fake_server.create_job('project', {'jobId': 'eu_0', 'trainingInput': {'region': 'europe-west1'}})
+
+    router = JobRouter(TARGETS, strategy="least_loaded", mlapi=mlapi)
+    assert router.choose()['region'] == 'europe-west1'
+    assert _load(router) == {'us-central1': 2, 'europe-west1': 1}
+
+
+def test_release_updates_the_target_of_the_job(mlapi):
+    router = JobRouter(TARGETS, strategy="least_loaded", mlapi=mlapi)
+    us_target, eu_target = router.targets
+    router.choose()
+    router.assign('job_us', us_target)
+    router.assign('job_eu', eu_target)
+    router.assign('job_eu', eu_target)  # re-attached job does not count twice
+    router.exhaust(eu_target)
+    assert _load(router) == {'us-central1': 1, 'europe-west1': 1}
+    assert router.choose()['region'] == 'us-central1'  # europe-west1 out of rotation
+
+    router.release('job_eu')
+    router.release('job_eu')
+    assert _load(router) == {'us-central1': 1, 'europe-west1': 0}
+    assert router.choose()['region'] == 'europe-west1'
+    assert router.get_project('job_eu') == 'project'
+
+
+def test_registered_jobs_do_not_count(mlapi):
+    router = JobRouter(TARGETS, strategy="least_loaded", mlapi=mlapi)
+    router.choose()
+    router.register('old_job', 'project')
+    router.release('old_job')
+    assert _load(router) == {'us-central1': 0, 'europe-west1': 0}
+    assert router.get_project('old_job') == 'project'
+
+
+def test_round_robin_follows_weights_and_exhaustion():
+    router = JobRouter([dict(TARGETS[0], weight=2), TARGETS[1]])
+    assert [router.choose()['region'] for _ in range(3)].count('us-central1') == 2
+
+    router.assign('job_1', router.targets[0])
+    router.exhaust(router.targets[0])
+    assert {router.choose()['region'] for _ in range(3)} == {'europe-west1'}
+    assert router.choose(exclude=router.targets) is None
+    router.release('job_1')  # polled again: back in rotation
+    assert 'us-central1' in {router.choose()['region'] for _ in range(3)}
+
+
+def test_quota_aware_skips_full_targets(mlapi):
+    router = JobRouter([dict(TARGETS[0], max_jobs=1), dict(TARGETS[1], weight=0.1)], strategy="quota_aware",
+                       mlapi=mlapi)
+    assert router.choose()['region'] == 'us-central1'
+    router.assign('job_1', router.targets[0])
+    assert router.choose()['region'] == 'europe-west1'
+
+
+def test_targets_validation():
+    with pytest.raises(ValueError):
+        JobRouter([])
+    with pytest.raises(ValueError):
+        JobRouter(TARGETS, strategy="random")
+    with pytest.raises(ValueError):
+        JobRouter([TARGETS[0], {'project_id': 'project'}])
+    assert get_job_targets({'PROJECT_ID': 'home', 'region': 'us-central1'}) == \
+        [{'project_id': 'home', 'region': 'us-central1', 'weight': 1}]
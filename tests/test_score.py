@@ -0,0 +1,36 @@
+from gcpaiutils.wrappers import get_attempt_dir, promote_score_outputs, remove_score_attempts
+from types import SimpleNamespace
+
+
+OUTPUT_DIR = "gs://models/user/problem/RESULTS_STAGING/strategy/job/model_00000/"
+KWARGS = {'task_instance': SimpleNamespace(xcom_pull=lambda task_ids=None, key=None: {
+    'user': 'user', 'problem': 'problem'}[key])}
+
+
+def _names(gcs_client, prefix):
+    return [blob.name for blob in gcs_client.list_blobs(bucket_or_name="models", prefix=prefix)]
+
+
+def test_attempt_dirs_are_outside_results():
+    assert get_attempt_dir(OUTPUT_DIR, 0) == \
+        "gs://models/user/problem/SCORE_ATTEMPTS/0/RESULTS_STAGING/strategy/job/model_00000/"
+    assert get_attempt_dir(OUTPUT_DIR, 1) != get_attempt_dir(OUTPUT_DIR, 0)
+
+
+def test_winner_output_replaces_partial_output(gcs_client):
+    bucket = gcs_client.bucket("models")
+    output_prefix = OUTPUT_DIR[len("gs://models/"):]
+    bucket.blob(output_prefix + "part-00009.csv").upload_from_string("partial")  # left by a previous attempt
+    for attempt in range(2):
+        attempt_prefix = get_attempt_dir(OUTPUT_DIR, attempt)[len("gs://models/"):]
+        for part in range(2):
+            bucket.blob(attempt_prefix + "part-{:05d}.csv".format(part)).upload_from_string(str(attempt))
+
+    promote_score_outputs(gcs_client, [get_attempt_dir(OUTPUT_DIR, 1)], [OUTPUT_DIR])
+    assert _names(gcs_client, output_prefix) == [output_prefix + "part-00000.csv", output_prefix + "part-00001.csv"]
+    assert {bucket.blob(name).download_as_string(client=gcs_client) for name in _names(gcs_client, output_prefix)} \
+        == {b"1"}
+
+    remove_score_attempts(gcs_client, "models", KWARGS)  # loser output
+    assert _names(gcs_client, "user/problem/SCORE_ATTEMPTS/") == []
+    assert len(_names(gcs_client, output_prefix)) == 2
@@ -0,0 +1,111 @@
+from gcpaiutils.utils import get_deployment_config, get_selector, get_storage_client
+from gcpaiutils.scratch import ScratchQuotaError, ScratchSpace
+from types import SimpleNamespace
+from shutil import rmtree
+from uuid import uuid4
+import pytest
+import os
+
+
+@pytest.fixture
+def selector_context(deployment_config, tmp_path):
+    _globals = dict(get_deployment_config(deployment_config), SCRATCH_ROOT=str(tmp_path / "scratch"))
+    user = 'u' + uuid4().hex[:8]  # in-memory storage is shared by the process
+    bucket = get_storage_client(_globals).bucket('models')
+    for strategy in ['StrategyA', 'StrategyB']:
+        bucket.blob("{}/SELECTOR/problem/{}/selection.json".format(user, strategy)).upload_from_string(
+            '{{"strategy": "{}"}}'.format(strategy))
+    kwargs = {'task_instance': SimpleNamespace(xcom_pull=lambda task_ids=None, key=None: {
+        'user': user, 'problem': 'problem'}[key])}
+    return _globals, kwargs
+
+
+def test_get_selector_reads_into_scratch(selector_context):
+    _globals, kwargs = selector_context
+    with ScratchSpace(root=_globals['SCRATCH_ROOT'], in_memory=True) as scratch:
+        names = get_selector(_globals, kwargs, scratch)
+        assert sorted(names) == ['StrategyA/selection.json', 'StrategyB/selection.json']
+        assert scratch.read('StrategyA/selection.json') == b'{"strategy": "StrategyA"}'
+        assert scratch.directory is None  # nothing spilled to disk
+
+
+def test_get_selector_without_scratch_returns_local_paths(selector_context):
+    _globals, kwargs = selector_context
+    local_dir, local_paths = get_selector(_globals, kwargs)
+    try:
+        assert local_dir.startswith(_globals['SCRATCH_ROOT'])
+        assert sorted(os.path.relpath(path, local_dir) for path in local_paths) == \
+            [os.path.join('StrategyA', 'selection.json'), os.path.join('StrategyB', 'selection.json')]
+        with open(local_paths[0], 'r') as f:
+            assert f.read().startswith('{"strategy": ')
+    finally:
+        rmtree(local_dir)
+
+
+class _Blob:
+    """Storage blob stand-in recording downloads."""
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.downloads = 0
+
+    def download_as_bytes(self, client=None):
+        self.downloads += 1
+        return self.data
+
+    def download_to_filename(self, file_path, client=None):
+        self.downloads += 1
+        with open(file_path, 'wb') as f:
+            f.write(self.data)
+
+
+def test_quota_is_enforced_on_write(tmp_path):
+    with ScratchSpace(root=str(tmp_path), quota=10, in_memory=True) as scratch:
+        scratch.write('a.json', b'12345')
+        scratch.write('a.json', b'1234567890')  # rewritten artifact counts once
+        with pytest.raises(ScratchQuotaError):
+            scratch.write('b.json', b'1')
+        assert scratch.size == 10
+
+
+def test_quota_is_checked_for_files_written_through_path(tmp_path):
+    with ScratchSpace(root=str(tmp_path), quota=10) as scratch:
+        with open(scratch.path('dir', 'file.bin'), 'wb') as f:
+            f.write(b'x' * 11)
+        with pytest.raises(ScratchQuotaError):
+            scratch.check_quota()
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_download_reserves_blob_size_before_transfer(tmp_path, in_memory):
+    blob = _Blob(b'x' * 11)
+    with ScratchSpace(root=str(tmp_path), quota=10, in_memory=in_memory) as scratch:
+        with pytest.raises(ScratchQuotaError):
+            scratch.download(blob, 'model.bin')
+        assert blob.downloads == 0
+        assert scratch.download(_Blob(b'x' * 10), 'model.bin') == 10
+
+
+def test_in_memory_artifacts_spill_when_a_path_is_needed(tmp_path):
+    with ScratchSpace(root=str(tmp_path), in_memory=True) as scratch:
+        scratch.write('strategy/selection.json', '{}')
+        assert scratch.directory is None and os.listdir(str(tmp_path)) == []
+        directory = scratch.path()
+        with open(os.path.join(directory, 'strategy', 'selection.json'), 'rb') as f:
+            assert f.read() == b'{}'
+        assert scratch.read('strategy/selection.json') == b'{}'
+        scratch.write('other.json', '[]')  # written to disk once spilled
+        assert os.path.exists(os.path.join(directory, 'other.json'))
+
+
+def test_workspace_is_removed_on_exception(tmp_path):
+    with pytest.raises(RuntimeError):
+        with ScratchSpace(root=str(tmp_path)) as scratch:
+            scratch.write('a.json', b'{}')
+            directory = scratch.directory
+            raise RuntimeError("task failed")
+    assert not os.path.exists(directory)
+    assert scratch.directory is None
+    with pytest.raises(FileNotFoundError):
+        scratch.read('a.json')
@@ -0,0 +1,54 @@
+from gcpaiutils.selection import InfoDataset, SelectionError, run_selectors
+import pytest
+import pickle
+
+
+class TopSelector:
+    """Selection strategy returning a fixed selection (module level: picklable for the process pool)."""
+
+    def __init__(self, deployment_config, model_dir, evaluation_metric, problem_type, n_class, verbose):
+        self.model_dir = model_dir
+
+    def select(self, destination_uri, validation_schema=None):
+        return [destination_uri]
+
+
+class FailingSelector(TopSelector):
+
+    def select(self, destination_uri, validation_schema=None):
+        raise KeyError("accuracy")
+
+
+def _selectors(*classes):
+    return {'Strategy{}'.format(i): {'selector': selector, 'validation_schema': None}
+            for i, selector in enumerate(classes)}
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_selectors_run_in_strategy_order(max_workers):
+    selected_info = run_selectors(None, _selectors(TopSelector, TopSelector), None, "/tmp/info", "accuracy",
+                                  "gs://models/SELECTOR/", max_workers=max_workers)
+    assert selected_info == {'Strategy0': ["gs://models/SELECTOR/Strategy0/"],
+                             'Strategy1': ["gs://models/SELECTOR/Strategy1/"]}
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_failed_strategy_raises_selection_error(max_workers):
+    with pytest.raises(SelectionError) as err:
+        run_selectors(None, _selectors(TopSelector, FailingSelector, FailingSelector), None, "/tmp/info",
+                      "accuracy", "gs://models/SELECTOR/", max_workers=max_workers)
+    assert err.value.strategy == 'Strategy1'
+    assert isinstance(err.value.__cause__, KeyError)
+    assert "Strategy1" in str(err.value)
+
+
+def test_info_dataset_unpickles_only_when_allowed():
+    files = {'train_job_info_00000.json': b'{"accuracy": 0.9}',
+             'train_job_stratified_info_00000.pkl': pickle.dumps({'accuracy': [0.8, 1.0]})}
+    info_dataset = InfoDataset(files)
+    model_id = info_dataset.model_ids[0]
+    assert info_dataset.get(model_id) == {'accuracy': 0.9}
+    assert info_dataset.get(model_id, "stratified_info") == files['train_job_stratified_info_00000.pkl']  # raw bytes
+
+    info_dataset = InfoDataset(files, allow_pickle=True)
+    assert info_dataset.get(model_id, "stratified_info") == {'accuracy': [0.8, 1.0]}
@@ -0,0 +1,57 @@
+from gcpaiutils.utils import get_shard_count, get_storage_client
+from gcpaiutils.wrappers import _merge_score_shards, split_score_dir
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+
+
+def test_shard_count_at_top_of_hardware_ladder():
+    assert get_shard_count('class_lgbm', 10) == 1  # largest size handled by n1-highmem-8
+    assert get_shard_count('class_lgbm', 10.5) == 2
+    assert get_shard_count('class_lgbm', 25) == 3
+
+
+def test_shard_count_with_machine_type_limit():
+    assert get_shard_count('class_lgbm', 1, machine_type='n1-highmem-8') == 1
+    assert get_shard_count('class_lgbm', 1, machine_type='n1-standard-8') == 10  # shards of 0.1 GB
+
+
+def test_shard_count_beyond_max_shards():
+    with pytest.raises(ValueError):
+        get_shard_count('class_lgbm', 1000)
+    assert get_shard_count('class_lgbm', 1000, max_shards=100) == 100
+
+
+def test_split_and_merge_round_trip():
+    _globals = {'STORAGE_BACKEND': 'memory', 'MODEL_BUCKET_NAME': 'models'}
+    gcs_client = get_storage_client(_globals)  # shared by the process, as used by _merge_score_shards()
+    user = 'u' + uuid4().hex[:8]
+    bucket = gcs_client.bucket('models')
+    sizes = [50, 40, 30, 20, 10, 10]
+    for i, size in enumerate(sizes):
+        bucket.blob("{}/problem/DATA/part-{:05d}.csv".format(user, i)).upload_from_string(b'x' * size)
+
+    shards = split_score_dir(gcs_client, "gs://models/{}/problem/DATA/".format(user),
+                             "gs://models/{}/problem/SCORE_SHARDS/".format(user), 2)
+    assert [size * 1024**3 for _, size in shards] == [80, 80]  # largest first onto the lightest shard
+    shard_names = [sorted(blob.name.split("/")[-1] for blob in gcs_client.list_blobs(
+        bucket_or_name='models', prefix=shard_dir[len("gs://models/"):])) for shard_dir, _ in shards]
+    assert sorted(name for names in shard_names for name in names) == \
+        ["part-{:05d}.csv".format(i) for i in range(len(sizes))]
+
+    # each shard job scores its data into its own folder under the model output folder
+    output_dir = "gs://models/{}/problem/RESULTS_STAGING/strategy/job/model_00000/".format(user)
+    shard_outputs = {output_dir: [output_dir + "shard_{}/".format(i) for i in range(len(shards))]}
+    for shard_output, names in zip(shard_outputs[output_dir], shard_names):
+        for name in names:
+            bucket.blob(shard_output[len("gs://models/"):] + name).upload_from_string(name)
+
+    kwargs = {'task_instance': SimpleNamespace(xcom_pull=lambda task_ids=None, key=None: {
+        'user': user, 'problem': 'problem'}[key])}
+    _merge_score_shards(_globals, shard_outputs, kwargs)
+    merged = {blob.name.split("/")[-1]: blob.download_as_string(client=gcs_client) for blob in gcs_client.list_blobs(
+        bucket_or_name='models', prefix=output_dir[len("gs://models/"):])}
+    assert sorted(merged) == sorted("part-{:05d}-{}".format(i, name) for i, names in enumerate(shard_names)
+                                    for name in names)
+    assert sorted(merged.values()) == sorted(name.encode() for names in shard_names for name in names)
+    assert list(gcs_client.list_blobs(bucket_or_name='models', prefix="{}/problem/SCORE_SHARDS/".format(user))) == []
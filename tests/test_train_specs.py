@@ -0,0 +1,55 @@
+from gcpaiutils.train import JOB_SPECS_CLUSTER_POOLS, TrainJobHandler, TrainJobSpecHandler
+from gcpaiutils.utils import get_cluster_config, get_defaults
+from copy import deepcopy
+import pytest
+
+
+IMAGE_URI = 'gcr.io/home-project/classification_lgbm:class_lgbm'
+REQUEST_IDS = {'user': 'user', 'problem': 'problem', 'version': 'v1'}
+
+
+def _create_job_specs(deployment_config, inputs):
+    S = TrainJobSpecHandler(deployment_config=deployment_config, algorithm='class_lgbm', inputs=inputs,
+                            request_ids=REQUEST_IDS)
+    S.create_job_specs()
+    return S.job_specs
+
+
+def test_cluster_config_follows_defaults():
+    distributed = get_defaults()['class_lgbm']['distributed']
+    assert get_cluster_config('class_lgbm', distributed['sizeThreshold']) == {}
+    assert get_cluster_config('class_lgbm', 20) == {'masterType': distributed['workerType'],
+                                                    'workerType': distributed['workerType'], 'workerCount': 2}
+    with pytest.raises(ValueError):
+        get_cluster_config('class_lgbm', distributed['nodeDataSize'] * (distributed['maxWorkerCount'] + 2))
+
+
+def test_distributed_spec_runs_atom_image_on_every_pool(fake_server, deployment_config):
+    inputs = dict(get_cluster_config('class_lgbm', 20), parameterServerCount=1, scaleTier='CUSTOM',
+                  trainFiles='gs://data/DATA/')
+    job_specs = _create_job_specs(deployment_config, inputs)
+    worker_type = get_defaults()['class_lgbm']['distributed']['workerType']
+    assert job_specs['trainingInput']['parameterServerType'] == worker_type  # pool type defaults to workerType
+
+    T = TrainJobHandler(deployment_config=deployment_config)
+    training_input = T.translate_job_specs(deepcopy(job_specs))['trainingInput']
+    assert training_input['masterConfig'] == {'imageUri': IMAGE_URI}
+    assert training_input['workerConfig'] == {'imageUri': IMAGE_URI}
+    assert training_input['parameterServerConfig'] == {'imageUri': IMAGE_URI}
+    assert (training_input['workerType'], training_input['workerCount']) == (worker_type, '2')
+    assert (training_input['parameterServerType'], training_input['parameterServerCount']) == (worker_type, '1')
+    assert not any(key.startswith('evaluator') for key in training_input)
+
+    T.submit_job(deepcopy(job_specs))
+    assert T.success
+    submitted = fake_server.jobs[('home-project', job_specs['jobId'])]['trainingInput']
+    assert {pool: submitted.get(pool + 'Config') for pool in JOB_SPECS_CLUSTER_POOLS} == \
+        {'worker': {'imageUri': IMAGE_URI}, 'parameterServer': {'imageUri': IMAGE_URI}, 'evaluator': None}
+
+
+def test_single_node_spec_has_no_cluster_pools(deployment_config):
+    inputs = {'scaleTier': 'CUSTOM', 'masterType': 'n1-standard-8', 'trainFiles': 'gs://data/DATA/', 'workerCount': 0}
+    training_input = TrainJobHandler(deployment_config=deployment_config).translate_job_specs(
+        _create_job_specs(deployment_config, inputs))['trainingInput']
+    assert training_input['masterConfig'] == {'imageUri': IMAGE_URI}
+    assert not any(key.startswith(pool) for key in training_input for pool in JOB_SPECS_CLUSTER_POOLS)